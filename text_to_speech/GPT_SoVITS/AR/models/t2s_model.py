@@ -1,7 +1,8 @@
 # modified from https://github.com/yangdongchao/SoundStorm/blob/master/soundstorm/s1/AR/models/t2s_model.py
 # reference: https://github.com/lifeiteng/vall-e
 import math
-from typing import List, Optional
+import time
+from typing import List, NamedTuple, Optional
 
 import torch
 from torch import nn
@@ -15,8 +16,10 @@ from .utils import (
     make_pad_mask,
     make_pad_mask_left,
     make_reject_y,
-    sample,
+    fused_sample,
+    token_counts,
     topk_sampling,
+    update_token_counts,
 )
 from ..modules.embedding import SinePositionalEmbedding, TokenEmbedding
 from ..modules.transformer import LayerNorm, TransformerEncoder, TransformerEncoderLayer
@@ -220,6 +223,55 @@ class T2SBlock:
         )
         return x, k_cache, v_cache
 
+    def decode_next_token_static(
+        self,
+        x: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        pos: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        q, k, v = F.linear(x, self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+
+        # cache 已预分配，新 token 的 k/v 原地写入第 pos 个位置
+        k_cache[:, pos : pos + 1] = k
+        v_cache[:, pos : pos + 1] = v
+
+        batch_size = q.shape[0]
+        q_len = q.shape[1]
+        kv_len = pos + 1
+
+        q = q.view(batch_size, q_len, self.num_heads, -1).transpose(1, 2)
+        k = k_cache[:, :kv_len].view(batch_size, kv_len, self.num_heads, -1).transpose(1, 2)
+        v = v_cache[:, :kv_len].view(batch_size, kv_len, self.num_heads, -1).transpose(1, 2)
+
+        if torch_sdpa:
+            attn = F.scaled_dot_product_attention(q, k, v, (~attn_mask) if attn_mask is not None else None)
+        else:
+            attn = scaled_dot_product_attention(q, k, v, attn_mask)
+
+        attn = attn.transpose(1, 2).reshape(batch_size, q_len, -1)
+        attn = F.linear(attn, self.out_w, self.out_b)
+
+        x = x + attn
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w1,
+            self.norm_b1,
+            self.norm_eps1,
+        )
+        x = x + self.mlp.forward(x)
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w2,
+            self.norm_b2,
+            self.norm_eps2,
+        )
+        return x
+
 
 @torch.jit.script
 class T2STransformer:
@@ -256,6 +308,240 @@ class T2STransformer:
             )
         return x, k_cache, v_cache
 
+    def decode_next_token_static(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        pos: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        for i in range(self.num_blocks):
+            x = self.blocks[i].decode_next_token_static(x, k_cache[i], v_cache[i], pos, attn_mask, torch_sdpa)
+        return x
+
+
+class T2SCompiledDecodeStep:
+    """
+    torch.compile'd single-token decode step over all layers, one fused graph instead of the
+    per-layer Python loop of T2STransformer.decode_next_token_static.
+
+    Every graph has a fixed shape: the batch size and the KV cache capacity are taken from
+    `batch_sizes` x `capacities`, and attention runs over the whole capacity with the
+    positions after the current one masked, so the write position is a tensor and does not
+    trigger a recompile. The mask is built inside the graph from the write position and the
+    left padding of each row (`pad_lens`), nothing mask-shaped is passed in per step.
+    All buckets are compiled by `warmup()`; T2SKVCache rounds its capacity up to a bucket
+    and falls back to the eager step for any other shape.
+    """
+
+    def __init__(
+        self,
+        model: "Text2SemanticDecoder",
+        batch_sizes=(1,),
+        capacities=(256, 512, 768, 1024, 1536, 2048),
+        mode: str = "max-autotune-no-cudagraphs",
+    ):
+        self.num_heads = model.num_head
+        self.hidden_dim = model.model_dim
+        self.batch_sizes = tuple(sorted(batch_sizes))
+        self.capacities = tuple(sorted(capacities))
+        self.layers = [
+            (
+                layer.self_attn.in_proj_weight,
+                layer.self_attn.in_proj_bias,
+                layer.self_attn.out_proj.weight,
+                layer.self_attn.out_proj.bias,
+                layer.norm1.weight,
+                layer.norm1.bias,
+                layer.norm1.eps,
+                layer.linear1.weight,
+                layer.linear1.bias,
+                layer.linear2.weight,
+                layer.linear2.bias,
+                layer.norm2.weight,
+                layer.norm2.bias,
+                layer.norm2.eps,
+            )
+            for layer in model.h.layers
+        ]
+        # 每个桶一个图，都在 warmup 里编译好
+        torch._dynamo.config.cache_size_limit = max(
+            torch._dynamo.config.cache_size_limit, len(self.batch_sizes) * len(self.capacities)
+        )
+        self.step = torch.compile(self._step, mode=mode, dynamic=False, fullgraph=True)
+        self.compiled = set()
+
+    def _step(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        pos: torch.Tensor,
+        pad_lens: torch.Tensor,
+    ):
+        batch_size = x.shape[0]
+        capacity = k_cache[0].shape[1]
+        # 每一行左侧的 padding 和还没写入的位置一律屏蔽
+        positions = torch.arange(capacity, device=x.device).view(1, 1, 1, capacity)
+        attn_mask = (positions > pos) | (positions < pad_lens.view(batch_size, 1, 1, 1))
+        for i, (qkv_w, qkv_b, out_w, out_b, norm_w1, norm_b1, norm_eps1, w1, b1, w2, b2, norm_w2, norm_b2, norm_eps2) in enumerate(
+            self.layers
+        ):
+            q, k, v = F.linear(x, qkv_w, qkv_b).chunk(3, dim=-1)
+            k_cache[i].index_copy_(1, pos, k)
+            v_cache[i].index_copy_(1, pos, v)
+
+            q = q.view(batch_size, 1, self.num_heads, -1).transpose(1, 2)
+            k = k_cache[i].view(batch_size, capacity, self.num_heads, -1).transpose(1, 2)
+            v = v_cache[i].view(batch_size, capacity, self.num_heads, -1).transpose(1, 2)
+            attn = F.scaled_dot_product_attention(q, k, v, ~attn_mask)
+            attn = F.linear(attn.transpose(1, 2).reshape(batch_size, 1, -1), out_w, out_b)
+
+            x = F.layer_norm(x + attn, [self.hidden_dim], norm_w1, norm_b1, norm_eps1)
+            x = x + F.linear(F.relu(F.linear(x, w1, b1)), w2, b2)
+            x = F.layer_norm(x, [self.hidden_dim], norm_w2, norm_b2, norm_eps2)
+        return x
+
+    def capacity_for(self, length: int) -> Optional[int]:
+        """Smallest capacity bucket that holds `length` positions, None if none does."""
+        for capacity in self.capacities:
+            if capacity >= length:
+                return capacity
+        return None
+
+    def supports(self, batch_size: int, capacity: int) -> bool:
+        return (batch_size, capacity) in self.compiled
+
+    def __call__(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        pos: int,
+        pad_lens: Optional[torch.Tensor] = None,
+    ):
+        """Same as T2STransformer.decode_next_token_static, with the first pad_lens[b] positions of row b masked."""
+        if pad_lens is None:
+            pad_lens = torch.zeros(x.shape[0], dtype=torch.long, device=x.device)
+        return self.step(x, k_cache, v_cache, torch.tensor([pos], device=x.device), pad_lens)
+
+    def warmup(self, dtype: torch.dtype, device):
+        for batch_size in self.batch_sizes:
+            for capacity in self.capacities:
+                t0 = time.perf_counter()
+                cache = lambda: [
+                    torch.zeros(batch_size, capacity, self.hidden_dim, dtype=dtype, device=device)
+                    for _ in self.layers
+                ]
+                x = torch.zeros(batch_size, 1, self.hidden_dim, dtype=dtype, device=device)
+                self(x, cache(), cache(), 0)
+                self.compiled.add((batch_size, capacity))
+                print(f"T2S decode step compiled: batch {batch_size}, capacity {capacity} ({time.perf_counter() - t0:.1f}s)")
+
+
+class T2SKVCache:
+    """
+    Preallocated key/value buffers of all T2SBlocks, [batch, capacity, hidden_dim] per layer.
+
+    `length` positions are filled, `decode_next_token` writes the next one in place
+    instead of torch.cat-ing the whole cache on every generated token.
+
+    With a `compiled` decode step the capacity starts at the smallest bucket that holds the
+    prompt and grows bucket by bucket, so every step runs one of the precompiled graphs.
+
+    Rows of a left-padded batch are described by `pad_lens`, the number of padding positions
+    at the start of each row. New tokens are appended after the longest row, so the decode
+    mask only has to hide that padding: it is derived from `pad_lens` once per allocation
+    instead of being passed in (and copied) on every step.
+    """
+
+    def __init__(
+        self,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        capacity: int,
+        compiled: Optional[T2SCompiledDecodeStep] = None,
+        pad_lens: Optional[torch.LongTensor] = None,
+    ):
+        self.length = k_cache[0].shape[1]
+        self.compiled = compiled
+        capacity = max(capacity, self.length + 1)
+        if compiled is not None:
+            capacity = compiled.capacity_for(self.length + 1) or capacity
+        self.k_cache = [self._alloc(k, capacity) for k in k_cache]
+        self.v_cache = [self._alloc(v, capacity) for v in v_cache]
+        self.pad_lens = pad_lens
+        self._update_padding_mask()
+
+    @staticmethod
+    def _alloc(cache: torch.Tensor, capacity: int):
+        # 置零而不是 empty：padding 位置即使被 mask，NaN 也会经 0 * NaN 污染输出
+        buffer = cache.new_zeros(cache.shape[0], capacity, cache.shape[2])
+        buffer[:, : cache.shape[1]] = cache
+        return buffer
+
+    @property
+    def capacity(self):
+        return self.k_cache[0].shape[1]
+
+    @property
+    def batch_size(self):
+        return self.k_cache[0].shape[0]
+
+    def reserve(self, n: int):
+        """Make room for n more positions, growing by at least half the capacity."""
+        if self.length + n <= self.capacity:
+            return
+        capacity = max(self.length + n, self.capacity + self.capacity // 2)
+        if self.compiled is not None:
+            capacity = self.compiled.capacity_for(self.length + n) or capacity
+        self.k_cache = [self._alloc(k[:, : self.length], capacity) for k in self.k_cache]
+        self.v_cache = [self._alloc(v[:, : self.length], capacity) for v in self.v_cache]
+        self._update_padding_mask()
+
+    def _update_padding_mask(self):
+        # [batch, 1, 1, capacity]，各个 head 广播；每步只取前 length + 1 列（视图，不拷贝）
+        if self.pad_lens is None:
+            self.padding_mask = None
+            return
+        positions = torch.arange(self.capacity, device=self.pad_lens.device)
+        self.padding_mask = (positions.view(1, -1) < self.pad_lens.view(-1, 1)).view(-1, 1, 1, self.capacity)
+
+    def decode_next_token(self, transformer: T2STransformer, x: torch.Tensor):
+        self.reserve(1)
+        if self.compiled is not None and self.compiled.supports(self.batch_size, self.capacity):
+            x = self.compiled(x, self.k_cache, self.v_cache, self.length, self.pad_lens)
+        else:
+            attn_mask = None if self.padding_mask is None else self.padding_mask[..., : self.length + 1]
+            x = transformer.decode_next_token_static(x, self.k_cache, self.v_cache, self.length, attn_mask)
+        self.length += 1
+        return x
+
+    def index_select(self, index: torch.Tensor):
+        """Keep only the rows in `index`; copies every layer's cache, so callers batch these up."""
+        for i in range(len(self.k_cache)):
+            self.k_cache[i] = torch.index_select(self.k_cache[i], dim=0, index=index)
+            self.v_cache[i] = torch.index_select(self.v_cache[i], dim=0, index=index)
+        if self.pad_lens is not None:
+            self.pad_lens = torch.index_select(self.pad_lens, 0, index)
+            self.padding_mask = torch.index_select(self.padding_mask, 0, index)
+
+
+class T2SPromptPrefix(NamedTuple):
+    """
+    Embedded reference prefix of one prompt: the reference-text tokens (phones1 + bert1, with
+    text positions 0..len-1 applied) and the prompt semantic tokens (with audio positions).
+
+    Only the embeddings are reusable. The text tokens attend to each other bidirectionally and
+    the prompt semantic attends to the whole text, so the per-layer K/V of the prefix change
+    with every target sentence and cannot be cached exactly.
+    """
+
+    x: torch.Tensor  # [x_prefix_len, hidden_dim]
+    y_pos: torch.Tensor  # [y_len, hidden_dim]
+
 
 class Text2SemanticDecoder(nn.Module):
     def __init__(self, config, norm_first=False, top_k=3):
@@ -351,6 +637,15 @@ class Text2SemanticDecoder(nn.Module):
             blocks.append(block)
 
         self.t2s_transformer = T2STransformer(self.num_layers, blocks)
+        self.compiled_decode: Optional[T2SCompiledDecodeStep] = None
+
+    def enable_compiled_decode(self, batch_sizes=(1,), capacities=None, mode: str = "max-autotune-no-cudagraphs"):
+        """Decode with a torch.compile'd step (see T2SCompiledDecodeStep), compiling every bucket now."""
+        kwargs = {} if capacities is None else {"capacities": capacities}
+        compiled = T2SCompiledDecodeStep(self, batch_sizes, mode=mode, **kwargs)
+        weight = self.ar_predict_layer.weight
+        compiled.warmup(weight.dtype, weight.device)
+        self.compiled_decode = compiled
 
     def make_input_data(self, x, x_lens, y, y_lens, bert_feature):
         x = self.ar_text_embedding(x)
@@ -575,6 +870,46 @@ class Text2SemanticDecoder(nn.Module):
             y = torch.concat([y, samples], dim=1)
         return y
 
+    @torch.no_grad()
+    def build_prompt_prefix(
+        self, phones: torch.LongTensor, bert_feature: torch.Tensor, prompt_semantic: torch.LongTensor
+    ) -> T2SPromptPrefix:
+        """phones: [x_prefix_len], bert_feature: [1024, x_prefix_len], prompt_semantic: [y_len]"""
+        x = self.ar_text_embedding(phones.unsqueeze(0))
+        x = x + self.bert_proj(bert_feature.transpose(0, 1).unsqueeze(0).to(x.dtype))
+        x = self.ar_text_position(x)[0]
+        y_pos = self.ar_audio_position(self.ar_audio_embedding(prompt_semantic.unsqueeze(0)))[0]
+        return T2SPromptPrefix(x, y_pos)
+
+    def embed_text(
+        self, x: torch.LongTensor, bert_feature: torch.Tensor, prompt_prefix: Optional[T2SPromptPrefix] = None
+    ) -> torch.Tensor:
+        """
+        x: [B, x_len], bert_feature: [B, 1024, x_len] -> [B, x_len, hidden_dim].
+        With prompt_prefix, the first prompt_prefix.x.shape[0] tokens of x must be its reference
+        text; only the target tokens are embedded and the cached prefix is prepended.
+        """
+        if prompt_prefix is None:
+            x = self.ar_text_embedding(x)
+            x = x + self.bert_proj(bert_feature.transpose(1, 2))
+            return self.ar_text_position(x)
+
+        prefix_len = prompt_prefix.x.shape[0]
+        x_len = x.shape[1]
+        x_target = self.ar_text_embedding(x[:, prefix_len:])
+        x_target = x_target + self.bert_proj(bert_feature[:, :, prefix_len:].transpose(1, 2))
+        position = self.ar_text_position
+        position.extend_pe(x_target.new_empty(1, x_len))
+        x_target = position.dropout(x_target * position.x_scale + position.alpha * position.pe[:, prefix_len:x_len])
+        x_prefix = prompt_prefix.x.to(x_target.dtype).unsqueeze(0).expand(x.shape[0], -1, -1)
+        return torch.cat([x_prefix, x_target], dim=1)
+
+    def embed_prompt(self, y: torch.LongTensor, prompt_prefix: Optional[T2SPromptPrefix] = None) -> torch.Tensor:
+        """y: [B, y_len] prompt semantic tokens -> [B, y_len, hidden_dim]"""
+        if prompt_prefix is None:
+            return self.ar_audio_position(self.ar_audio_embedding(y))
+        return prompt_prefix.y_pos.unsqueeze(0).expand(y.shape[0], -1, -1)
+
     def pad_y_eos(self, y, y_mask_int, eos_id):
         targets = F.pad(y, (0, 1), value=0) + eos_id * F.pad(y_mask_int, (0, 1), value=1)
         # 错位
@@ -608,12 +943,11 @@ class Text2SemanticDecoder(nn.Module):
             )
 
         max_len = kwargs.get("max_len", x_lens.max())
+        prompt_prefix: Optional[T2SPromptPrefix] = kwargs.get("prompt_prefix", None)
         x_list = []
         for x_item, bert_item in zip(x, bert_feature):
             # max_len = max(max_len, x_item.shape[0], bert_item.shape[1])
-            x_item = self.ar_text_embedding(x_item.unsqueeze(0))
-            x_item = x_item + self.bert_proj(bert_item.transpose(0, 1).unsqueeze(0))
-            x_item = self.ar_text_position(x_item).squeeze(0)
+            x_item = self.embed_text(x_item.unsqueeze(0), bert_item.unsqueeze(0), prompt_prefix).squeeze(0)
             # x_item = F.pad(x_item,(0,0,0,max_len-x_item.shape[0]),value=0) if x_item.shape[0]<max_len else x_item  ### padding right
             x_item = (
                 F.pad(x_item, (0, 0, max_len - x_item.shape[0], 0), value=0) if x_item.shape[0] < max_len else x_item
@@ -627,27 +961,21 @@ class Text2SemanticDecoder(nn.Module):
         x_len = x.shape[1]
         stop = False
 
-        k_cache = None
-        v_cache = None
+        kv_cache = None
         ###################  first step ##########################
         assert y is not None, "Error: Prompt free is not supported batch_infer!"
         ref_free = False
 
-        y_emb = self.ar_audio_embedding(y)
-        y_len = y_emb.shape[1]
+        y_len = y.shape[1]
         prefix_len = y.shape[1]
-        y_lens = torch.LongTensor([y_emb.shape[1]] * y_emb.shape[0]).to(x.device)
-        y_pos = self.ar_audio_position(y_emb)
+        y_pos = self.embed_prompt(y, prompt_prefix)
         xy_pos = torch.concat([x, y_pos], dim=1)
 
         ##### create mask #####
         bsz = x.shape[0]
         src_len = x_len + y_len
-        y_paddind_mask = make_pad_mask_left(y_lens, y_len)
-        x_paddind_mask = make_pad_mask_left(x_lens, max_len)
-
-        # (bsz, x_len + y_len)
-        padding_mask = torch.concat([x_paddind_mask, y_paddind_mask], dim=1)
+        # 每一行左侧 padding 的长度；prompt 语义 token 等长，没有 padding
+        pad_lens = (max_len - x_lens).to(device=x.device, dtype=torch.long)
 
         x_mask = F.pad(
             torch.zeros(x_len, x_len, dtype=torch.bool, device=x.device),
@@ -661,7 +989,7 @@ class Text2SemanticDecoder(nn.Module):
             value=False,
         )
 
-        causal_mask = torch.concat([x_mask, y_mask], dim=0).view(1, src_len, src_len).repeat(bsz, 1, 1).to(x.device)
+        causal_mask = torch.concat([x_mask, y_mask], dim=0).view(1, 1, src_len, src_len)
         # padding_mask = padding_mask.unsqueeze(1) * padding_mask.unsqueeze(2) ### [b, x+y, x+y]
         ### 上面是错误的，会导致padding的token被"看见"
 
@@ -677,10 +1005,10 @@ class Text2SemanticDecoder(nn.Module):
         # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6],
         # [PAD, PAD, PAD, 1, 2, 3, 4, 5, 6]]
 
-        padding_mask = padding_mask.view(bsz, 1, src_len).repeat(1, src_len, 1)
+        padding_mask = torch.arange(src_len, device=x.device).view(1, 1, 1, src_len) < pad_lens.view(bsz, 1, 1, 1)
 
+        # [bsz, 1, src_len, src_len]，各个 head 广播，只在预填充时用一次；decode 阶段的 mask 由 pad_lens 隐式给出
         attn_mask: torch.Tensor = causal_mask.logical_or(padding_mask)
-        attn_mask = attn_mask.unsqueeze(1).expand(-1, self.num_head, -1, -1).bool()
 
         # 正确的attn_mask应该是这样的：
         # |   pad_len   |  x_len  |  y_len  |
@@ -696,61 +1024,58 @@ class Text2SemanticDecoder(nn.Module):
 
         ###### decode #####
         y_list = [None] * y.shape[0]
-        batch_idx_map = list(range(y.shape[0]))
+        batch_idx_map = list(range(y.shape[0]))  # 已结束的行为 None，攒够一半再从 batch 中移除
         idx_list = [None] * y.shape[0]
+        max_decode_steps = 1500 if early_stop_num == -1 else min(early_stop_num + 1, 1500)
+        counts = token_counts(y, self.vocab_size)  # 重复惩罚用的 token 计数，每步只加新 token
         for idx in tqdm(range(1500)):
             if idx == 0:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
+                kv_cache = T2SKVCache(k_cache, v_cache, src_len + max_decode_steps, self.compiled_decode, pad_lens)
+                del attn_mask
             else:
-                xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache, attn_mask)
+                xy_dec = kv_cache.decode_next_token(self.t2s_transformer, xy_pos)
             logits = self.ar_predict_layer(xy_dec[:, -1])
 
-            if idx == 0:
-                attn_mask = F.pad(attn_mask[:, :, -1].unsqueeze(-2), (0, 1), value=False)
-            else:
-                attn_mask = F.pad(attn_mask, (0, 1), value=False)
-
             if idx < 11:  ###至少预测出10个token不然不给停止（0.4s）
                 logits = logits[:, :-1] 
 
-            samples = sample(
-                logits, y, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
-            )[0]
+            samples = fused_sample(
+                logits, counts, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
+            )
+            update_token_counts(counts, samples)
 
             y = torch.concat([y, samples], dim=1)
 
             ####### 移除batch中已经生成完毕的序列,进一步优化计算量
             tokens = torch.argmax(logits, dim=-1)
-            reserved_idx_of_batch_for_y = None
-            if (self.EOS in samples[:, 0]) or (self.EOS in tokens):  ###如果生成到EOS，则停止
-                l1 = samples[:, 0] == self.EOS
-                l2 = tokens == self.EOS
-                l = l1.logical_or(l2)
-                removed_idx_of_batch_for_y = torch.where(l == True)[0].tolist()
-                reserved_idx_of_batch_for_y = torch.where(l == False)[0]
-                # batch_indexs = torch.tensor(batch_idx_map, device=y.device)[removed_idx_of_batch_for_y]
-                for i in removed_idx_of_batch_for_y:
-                    batch_index = batch_idx_map[i]
-                    idx_list[batch_index] = idx
-                    y_list[batch_index] = y[i, :-1]
-
-                batch_idx_map = [batch_idx_map[i] for i in reserved_idx_of_batch_for_y.tolist()]
-
-            # 只保留batch中未生成完毕的序列
-            if reserved_idx_of_batch_for_y is not None:
-                # index = torch.LongTensor(batch_idx_map).to(y.device)
+            l = (samples[:, 0] == self.EOS).logical_or(tokens == self.EOS)  ###如果生成到EOS，则停止
+            for i in torch.where(l)[0].tolist():
+                batch_index = batch_idx_map[i]
+                if batch_index is None:
+                    continue
+                idx_list[batch_index] = idx
+                y_list[batch_index] = y[i, :-1]
+                batch_idx_map[i] = None
+
+            # 已结束的行继续跟着解码（结果丢弃），占到一半时才一起移除：
+            # 每次移除都要拷贝各层的 KV cache，这样最多拷贝 log2(bsz) 次
+            num_finished = batch_idx_map.count(None)
+            if num_finished * 2 >= len(batch_idx_map) and num_finished < len(batch_idx_map):
+                reserved_idx_of_batch_for_y = torch.tensor(
+                    [i for i, batch_index in enumerate(batch_idx_map) if batch_index is not None], device=y.device
+                )
+                batch_idx_map = [batch_index for batch_index in batch_idx_map if batch_index is not None]
                 y = torch.index_select(y, dim=0, index=reserved_idx_of_batch_for_y)
-                attn_mask = torch.index_select(attn_mask, dim=0, index=reserved_idx_of_batch_for_y)
-                if k_cache is not None:
-                    for i in range(len(k_cache)):
-                        k_cache[i] = torch.index_select(k_cache[i], dim=0, index=reserved_idx_of_batch_for_y)
-                        v_cache[i] = torch.index_select(v_cache[i], dim=0, index=reserved_idx_of_batch_for_y)
+                counts = torch.index_select(counts, dim=0, index=reserved_idx_of_batch_for_y)
+                kv_cache.index_select(reserved_idx_of_batch_for_y)
 
             if (early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num) or idx == 1499:
                 print("use early stop num:", early_stop_num)
                 stop = True
                 for i, batch_index in enumerate(batch_idx_map):
-                    batch_index = batch_idx_map[i]
+                    if batch_index is None:
+                        continue
                     idx_list[batch_index] = idx
                     y_list[batch_index] = y[i, :-1]
 
@@ -830,12 +1155,13 @@ class Text2SemanticDecoder(nn.Module):
     ):
         mute_emb_sim_matrix = kwargs.get("mute_emb_sim_matrix", None)
         chunk_split_thershold = kwargs.get("chunk_split_thershold", 0.3)
+        # 第一块可以更短，首包更快；之后按 chunk_length 切分
+        first_chunk_length = kwargs.get("first_chunk_length", None) or chunk_length
         check_token_num = 2
+        prompt_prefix: Optional[T2SPromptPrefix] = kwargs.get("prompt_prefix", None)
 
 
-        x = self.ar_text_embedding(x)
-        x = x + self.bert_proj(bert_feature.transpose(1, 2))
-        x = self.ar_text_position(x)
+        x = self.embed_text(x, bert_feature, prompt_prefix)
 
         # AR Decoder
         y = prompts
@@ -845,14 +1171,12 @@ class Text2SemanticDecoder(nn.Module):
         stop = False
         # print(1111111,self.num_layers)
 
-        k_cache = None
-        v_cache = None
+        kv_cache = None
         ###################  first step ##########################
         if y is not None:
-            y_emb = self.ar_audio_embedding(y)
-            y_len = y_emb.shape[1]
+            y_len = y.shape[1]
             prefix_len = y.shape[1]
-            y_pos = self.ar_audio_position(y_emb)
+            y_pos = self.embed_prompt(y, prompt_prefix)
             xy_pos = torch.concat([x, y_pos], dim=1)
             ref_free = False
         else:
@@ -886,12 +1210,16 @@ class Text2SemanticDecoder(nn.Module):
 
         token_counter = 0
         curr_ptr = prefix_len
+        max_decode_steps = 1500 if early_stop_num == -1 else min(early_stop_num + 1, 1500)
+        counts = token_counts(y, self.vocab_size)
         for idx in tqdm(range(1500)):
             token_counter+=1
+            _chunk_length = first_chunk_length if curr_ptr == prefix_len else chunk_length
             if xy_attn_mask is not None:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+                kv_cache = T2SKVCache(k_cache, v_cache, src_len + max_decode_steps, self.compiled_decode)
             else:
-                xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache)
+                xy_dec = kv_cache.decode_next_token(self.t2s_transformer, xy_pos)
 
             logits = self.ar_predict_layer(xy_dec[:, -1])
 
@@ -900,9 +1228,10 @@ class Text2SemanticDecoder(nn.Module):
             if idx < 11:  ###至少预测出10个token不然不给停止（0.4s）
                 logits = logits[:, :-1]
 
-            samples = sample(
-                logits, y, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
-            )[0]
+            samples = fused_sample(
+                logits, counts, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
+            )
+            update_token_counts(counts, samples)
 
             y = torch.concat([y, samples], dim=1)
 
@@ -928,20 +1257,20 @@ class Text2SemanticDecoder(nn.Module):
                 break
 
 
-            if streaming_mode and (mute_emb_sim_matrix is not None) and (token_counter >= chunk_length+check_token_num):
+            if streaming_mode and (mute_emb_sim_matrix is not None) and (token_counter >= _chunk_length+check_token_num):
                 score = mute_emb_sim_matrix[y[0, curr_ptr:]] - chunk_split_thershold
                 score[score<0]=-1
                 score[:-1]=score[:-1]+score[1:] ##考虑连续两个token
                 argmax_idx = score.argmax()
 
-                if score[argmax_idx]>=0 and argmax_idx+1>=chunk_length: 
+                if score[argmax_idx]>=0 and argmax_idx+1>=_chunk_length: 
                     print(f"\n\ncurr_ptr:{curr_ptr}")
                     yield y[:, curr_ptr:], False
                     token_counter -= argmax_idx+1
                     curr_ptr += argmax_idx+1
 
 
-            elif streaming_mode and (mute_emb_sim_matrix is None) and (token_counter >= chunk_length):
+            elif streaming_mode and (mute_emb_sim_matrix is None) and (token_counter >= _chunk_length):
                 yield y[:, -token_counter:], False
                 curr_ptr+=token_counter
                 token_counter = 0
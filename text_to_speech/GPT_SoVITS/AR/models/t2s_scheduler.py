@@ -0,0 +1,324 @@
+# 跨请求的 T2S 连续批处理调度器 (continuous batching)
+# 新请求在 prefill 后直接并入正在解码的 batch，序列在 EOS 时立即退出，
+# batch 内部沿用 infer_panel_batch_infer 的左填充 KV cache 方案（预分配的 T2SKVCache）。
+import queue
+import threading
+import traceback
+from concurrent.futures import Future
+from typing import List, Optional
+
+import torch
+from torch.nn import functional as F
+
+from .t2s_model import T2SKVCache, T2SPromptPrefix
+from .utils import fused_sample, token_counts, update_token_counts
+
+
+class T2SRequest:
+    def __init__(
+        self,
+        x: torch.LongTensor,
+        bert_feature: torch.Tensor,
+        prompt: Optional[torch.LongTensor],
+        top_k: int = 15,
+        top_p: float = 1.0,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        early_stop_num: int = -1,
+        prompt_prefix: Optional[T2SPromptPrefix] = None,
+    ):
+        self.x = x  # [x_len] 全部文本 token (参考文本 + 目标文本)
+        self.bert_feature = bert_feature  # [1024, x_len]
+        self.prompt = prompt  # [y_len] 参考音频 token, ref_free 时为 None
+        self.top_k = top_k
+        self.top_p = top_p
+        self.temperature = temperature
+        self.repetition_penalty = repetition_penalty
+        self.early_stop_num = early_stop_num
+        self.prompt_prefix = prompt_prefix  # 可选，参考文本/参考音频 token 的预计算嵌入
+        self.future = Future()
+
+        self.y: torch.LongTensor = None  # prompt + 已生成的 token
+        self.counts: torch.Tensor = None  # [1, vocab_size] y 中每个 token 的出现次数，用于重复惩罚
+        self.prefix_len = 0
+        self.step = 0  # 已生成的 token 数
+
+
+class T2SScheduler:
+    """
+    Continuous-batching front end for Text2SemanticDecoder.
+
+    Requests from any thread are queued with `submit()`. A single worker thread
+    prefills each new request, merges it into the running decode batch (left padded,
+    like infer_panel_batch_infer) and retires rows as soon as they hit EOS, so
+    concurrent HTTP requests share one decode loop instead of serializing.
+    """
+
+    def __init__(self, model, max_batch_size: int = 8, max_steps: int = 1500, reserve_steps: int = 256):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_steps = max_steps
+        self.reserve_steps = reserve_steps  # 每次(重新)分配 KV cache 时预留的 decode 位置数
+        self.queue = queue.Queue()
+
+        self.active: List[T2SRequest] = []
+        self.kv_cache: T2SKVCache = None  # kv_cache.pad_lens: 每一行左侧 padding 的长度
+
+        self.generated_tokens = 0
+        self.decode_steps = 0
+        self.stats_lock = threading.Lock()
+
+        self.running = True
+        self.submit_lock = threading.Lock()  # close() 之后不再有请求进入队列
+        self.thread = threading.Thread(target=self._loop, name="T2SScheduler", daemon=True)
+        self.thread.start()
+
+    def submit(
+        self,
+        x: torch.LongTensor,
+        prompt: Optional[torch.LongTensor],
+        bert_feature: torch.Tensor,
+        top_k: int = 15,
+        top_p: float = 1.0,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        early_stop_num: int = -1,
+        prompt_prefix: Optional[T2SPromptPrefix] = None,
+    ) -> Future:
+        request = T2SRequest(
+            x, bert_feature, prompt, top_k, top_p, temperature, repetition_penalty, early_stop_num, prompt_prefix
+        )
+        with self.submit_lock:
+            if not self.running:
+                raise RuntimeError("T2SScheduler is closed")
+            self.queue.put(request)
+        return request.future
+
+    def infer(self, *args, **kwargs):
+        """
+        Blocking helper. Returns (y, idx) for one sequence, the same as one item of
+        infer_panel_batch_infer's (y_list, idx_list): y holds the prompt and the generated
+        tokens, the last idx tokens are the prediction.
+        """
+        return self.submit(*args, **kwargs).result()
+
+    def close(self):
+        """Stop the worker. Requests still decoding or queued fail with RuntimeError."""
+        with self.submit_lock:
+            self.running = False
+            self.queue.put(None)
+        self.thread.join()
+
+        # worker 已经退出，没有完成的请求不会再有结果
+        pending = self.active
+        self._reset()
+        while True:
+            try:
+                request = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                pending.append(request)
+        for request in pending:
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("scheduler closed"))
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "active": len(self.active),
+                "queued": self.queue.qsize(),
+                "generated_tokens": self.generated_tokens,
+                "decode_steps": self.decode_steps,
+            }
+
+    def _loop(self):
+        with torch.no_grad():
+            while self.running:
+                try:
+                    self._admit()
+                    if len(self.active) > 0:
+                        self._decode_step()
+                except Exception as e:
+                    traceback.print_exc()
+                    for request in self.active:
+                        if not request.future.done():
+                            request.future.set_exception(e)
+                    self._reset()
+
+    def _reset(self):
+        self.active = []
+        self.kv_cache = None
+
+    def _admit(self):
+        while len(self.active) < self.max_batch_size:
+            try:
+                # 没有正在解码的序列时阻塞等待，否则只取已经到达的请求
+                request = self.queue.get(block=len(self.active) == 0)
+            except queue.Empty:
+                return
+            if request is None:
+                self.running = False
+                return
+            try:
+                self._prefill(request)
+            except Exception as e:
+                traceback.print_exc()
+                request.future.set_exception(e)
+
+    def _prefill(self, request: T2SRequest):
+        model = self.model
+        device = model.ar_predict_layer.weight.device
+        x = request.x.to(device).unsqueeze(0)
+        bert_feature = request.bert_feature.to(device).unsqueeze(0)
+
+        x = model.embed_text(x, bert_feature, request.prompt_prefix)
+        x_len = x.shape[1]
+
+        if request.prompt is not None:
+            y = request.prompt.to(device).unsqueeze(0)
+            y_pos = model.embed_prompt(y, request.prompt_prefix)
+            xy_pos = torch.concat([x, y_pos], dim=1)
+        else:
+            y = torch.zeros(1, 0, dtype=torch.long, device=device)
+            xy_pos = x
+        y_len = y.shape[1]
+        src_len = x_len + y_len
+
+        x_attn_mask_pad = F.pad(
+            torch.zeros((x_len, x_len), dtype=torch.bool, device=device),
+            (0, y_len),
+            value=True,
+        )
+        y_attn_mask = F.pad(
+            torch.triu(torch.ones(y_len, y_len, dtype=torch.bool, device=device), diagonal=1),
+            (x_len, 0),
+            value=False,
+        )
+        xy_attn_mask = (
+            torch.concat([x_attn_mask_pad, y_attn_mask], dim=0)
+            .unsqueeze(0)
+            .expand(model.num_head, -1, -1)
+            .view(1, model.num_head, src_len, src_len)
+        )
+
+        xy_dec, k_cache, v_cache = model.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+        logits = model.ar_predict_layer(xy_dec[:, -1])
+
+        request.y = y[0].long()
+        request.counts = token_counts(y, model.vocab_size)
+        request.prefix_len = y_len
+        if self._sample(request, logits):
+            return
+        self._merge(request, k_cache, v_cache)
+
+    def _merge(self, request: T2SRequest, k_cache: List[torch.Tensor], v_cache: List[torch.Tensor]):
+        new_len = k_cache[0].shape[1]
+        if len(self.active) == 0:
+            self.kv_cache = T2SKVCache(
+                k_cache,
+                v_cache,
+                new_len + self.reserve_steps,
+                self.model.compiled_decode,
+                torch.zeros(1, dtype=torch.long, device=k_cache[0].device),
+            )
+            self.active = [request]
+            return
+
+        # 合并时本来就要重新分配，顺便裁掉所有行共有的左侧 padding
+        pad_lens = self.kv_cache.pad_lens
+        trim = int(pad_lens.min())
+        length = self.kv_cache.length
+        cur_len = length - trim
+        total_len = max(cur_len, new_len)
+
+        def merge(cur: torch.Tensor, new: torch.Tensor):
+            # 统一左填充到相同长度后在 batch 维拼接
+            return torch.cat(
+                [
+                    F.pad(cur[:, trim:length], (0, 0, total_len - cur_len, 0), value=0),
+                    F.pad(new, (0, 0, total_len - new_len, 0), value=0),
+                ],
+                dim=0,
+            )
+
+        self.kv_cache = T2SKVCache(
+            [merge(cur, new) for cur, new in zip(self.kv_cache.k_cache, k_cache)],
+            [merge(cur, new) for cur, new in zip(self.kv_cache.v_cache, v_cache)],
+            total_len + self.reserve_steps,
+            self.model.compiled_decode,
+            torch.cat(
+                [
+                    pad_lens - trim + (total_len - cur_len),
+                    torch.tensor([total_len - new_len], dtype=torch.long, device=pad_lens.device),
+                ]
+            ),
+        )
+        self.active.append(request)
+
+    def _decode_step(self):
+        model = self.model
+        device = self.kv_cache.pad_lens.device
+        tokens = torch.stack([request.y[-1:] for request in self.active], dim=0).to(device)
+        positions = torch.tensor(
+            [request.prefix_len + request.step - 1 for request in self.active], dtype=torch.long, device=device
+        )
+        y_emb = model.ar_audio_embedding(tokens)
+        pe = model.ar_audio_position.pe[0, positions].to(dtype=y_emb.dtype, device=device)
+        xy_pos = y_emb * model.ar_audio_position.x_scale + model.ar_audio_position.alpha * pe.unsqueeze(1)
+
+        # 新 token 追加在 cache 末尾，mask 只需屏蔽每一行左侧的 padding，由 kv_cache.pad_lens 给出
+        xy_dec = self.kv_cache.decode_next_token(model.t2s_transformer, xy_pos)
+        logits = model.ar_predict_layer(xy_dec[:, -1])
+        with self.stats_lock:
+            self.decode_steps += 1
+
+        reserved = []
+        for i, request in enumerate(self.active):
+            if not self._sample(request, logits[i : i + 1]):
+                reserved.append(i)
+
+        if len(reserved) == len(self.active):
+            return
+        if len(reserved) == 0:
+            self._reset()
+            return
+        index = torch.tensor(reserved, dtype=torch.long, device=device)
+        self.active = [self.active[i] for i in reserved]
+        self.kv_cache.index_select(index)
+
+    def _sample(self, request: T2SRequest, logits: torch.Tensor) -> bool:
+        """Sample the next token of one sequence, returns True when the sequence is finished."""
+        EOS = self.model.EOS
+        if request.step < 11:  ###至少预测出10个token不然不给停止（0.4s）
+            logits = logits.clone()
+            logits[:, EOS] = -float("inf")
+
+        samples = fused_sample(
+            logits,
+            request.counts,
+            top_k=request.top_k,
+            top_p=request.top_p,
+            repetition_penalty=request.repetition_penalty,
+            temperature=request.temperature,
+        )
+        update_token_counts(request.counts, samples)
+        request.y = torch.cat([request.y, samples[0].to(request.y.dtype)])
+        request.step += 1
+        with self.stats_lock:
+            self.generated_tokens += 1
+
+        token = torch.argmax(logits, dim=-1)[0]
+        finished = samples[0, 0] == EOS or token == EOS
+        if request.early_stop_num != -1 and request.step > request.early_stop_num:
+            print("use early stop num:", request.early_stop_num)
+            finished = True
+        if request.step >= self.max_steps:
+            finished = True
+        if finished:
+            y = request.y[:-1]
+            if y.shape[0] == 0:
+                y = torch.zeros(1, dtype=request.y.dtype, device=request.y.device)
+                print("bad zero prediction")
+            request.future.set_result((y, request.step - 1))
+        return bool(finished)
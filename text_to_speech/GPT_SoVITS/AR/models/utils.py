@@ -199,6 +199,52 @@ def sample(
     return idx_next, probs
 
 
+def token_counts(tokens: torch.Tensor, vocab_size: int) -> torch.Tensor:
+    """[B, T] token ids -> [B, vocab_size] number of occurrences of each token"""
+    counts = torch.zeros(tokens.shape[0], vocab_size, dtype=torch.int32, device=tokens.device)
+    return counts.scatter_add_(1, tokens.long(), torch.ones_like(tokens, dtype=torch.int32))
+
+
+def update_token_counts(counts: torch.Tensor, samples: torch.Tensor) -> torch.Tensor:
+    """Add the sampled tokens [B, 1] to the running counts, in place."""
+    return counts.scatter_add_(1, samples.long(), torch.ones_like(samples, dtype=counts.dtype))
+
+
+def fused_sample(
+    logits: torch.Tensor,
+    counts: Optional[torch.Tensor] = None,
+    top_k: Optional[int] = None,
+    top_p: Optional[float] = None,
+    temperature: float = 1.0,
+    repetition_penalty: float = 1.0,
+) -> torch.Tensor:
+    """
+    Same distribution as `sample(logits, previous_tokens, ...)`, with less work per step:
+    the repetition penalty reads the running `counts` (see token_counts) instead of
+    gathering the whole history, and top-p runs on the top-k candidates only. Top-p keeps a
+    prefix of the tokens sorted by probability, so with the full-vocab normalizer the
+    nucleus inside the top k is exactly the one `logits_to_probs` computes over the sorted
+    vocab. Returns the sampled ids [B, 1].
+    """
+    if counts is not None and repetition_penalty != 1.0:
+        seen = counts[:, : logits.shape[-1]] > 0
+        logits = torch.where(
+            seen, torch.where(logits < 0, logits * repetition_penalty, logits / repetition_penalty), logits
+        )
+
+    k = logits.shape[-1] if top_k is None or top_k <= 0 else min(top_k, logits.shape[-1])
+    top_logits, top_indices = torch.topk(logits, k)  # sorted, descending
+
+    if top_p is not None and top_p < 1.0:
+        cum_probs = torch.cumsum(torch.exp(top_logits - torch.logsumexp(logits, dim=-1, keepdim=True)), dim=-1)
+        remove = cum_probs > top_p
+        remove[:, 0] = False  # keep at least one option
+        top_logits = top_logits.masked_fill(remove, -float("Inf"))
+
+    probs = torch.nn.functional.softmax(top_logits / max(temperature, 1e-5), dim=-1)
+    return torch.gather(top_indices, 1, multinomial_sample_one_no_sync(probs).long()).to(dtype=torch.int)
+
+
 def dpo_loss(
     policy_chosen_logps: torch.FloatTensor,
     policy_rejected_logps: torch.FloatTensor,
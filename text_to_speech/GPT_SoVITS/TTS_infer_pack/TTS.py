@@ -1,10 +1,13 @@
 import gc
 import math
 import os
+import queue
 import random
 import sys
+import threading
 import time
 import traceback
+from contextlib import closing
 from copy import deepcopy
 
 import torchaudio
@@ -15,26 +18,32 @@ sys.path.append(now_dir)
 import os
 from typing import List, Tuple, Union
 
-import ffmpeg
 import librosa
 import numpy as np
 import torch
 import torch.nn.functional as F
 import yaml
-from AR.models.t2s_lightning_module import Text2SemanticLightningModule
+from ..AR.models.t2s_lightning_module import Text2SemanticLightningModule
+from ..AR.models.t2s_scheduler import T2SScheduler
 from ..BigVGAN.bigvgan import BigVGAN
 from ..feature_extractor.cnhubert import CNHubert
 from ..module.mel_processing import mel_spectrogram_torch, spectrogram_torch
 from ..module.models import SynthesizerTrn, SynthesizerTrnV3, Generator
 from peft import LoraConfig, get_peft_model
 from ..process_ckpt import get_sovits_version_from_path_fast, load_sovits_new
+from ..safetensors_ckpt import load_gpt_ckpt
 from transformers import AutoModelForMaskedLM, AutoTokenizer
 
-from ...tools.audio_sr import AP_BWE
-from ...tools.i18n.i18n import I18nAuto, scan_language_list
+from tools.audio_sr import AP_BWE
+from tools.i18n.i18n import I18nAuto, scan_language_list
+from .segment_cost import SegmentCostModel
 from .text_segmentation_method import splits
+from .time_stretch import TimeStretcher, time_stretch
 from .TextPreprocessor import TextPreprocessor
+from .ort_backend import OrtBackend
 from ..sv import SV
+from ..frontend_cache import FrontendCache
+from ..ref_feature_store import RefFeatureStore
 
 resample_transform_dict = {}
 
@@ -93,25 +102,26 @@ mel_fn_v4 = lambda x: mel_spectrogram_torch(
 )
 
 
-def speed_change(input_audio: np.ndarray, speed: float, sr: int):
-    # 将 NumPy 数组转换为原始 PCM 流
-    raw_audio = input_audio.astype(np.int16).tobytes()
-
-    # 设置 ffmpeg 输入流
-    input_stream = ffmpeg.input("pipe:", format="s16le", acodec="pcm_s16le", ar=str(sr), ac=1)
+# v3/v4 的 CFM 采样配置，按延迟从低到高；请求里单独给出的 sample_steps 等参数优先
+CFM_PROFILES = {
+    "fast": {"sample_steps": 8, "cfm_solver": "euler", "sway_coef": -1.0},
+    "balanced": {"sample_steps": 16, "cfm_solver": "euler", "sway_coef": -1.0},
+    "quality": {"sample_steps": 32, "cfm_solver": "euler", "sway_coef": None},
+    "adaptive": {"sample_steps": 16, "cfm_solver": "adaptive", "sway_coef": None},
+}
 
-    # 变速处理
-    output_stream = input_stream.filter("atempo", speed)
 
-    # 输出流到管道
-    out, _ = output_stream.output("pipe:", format="s16le", acodec="pcm_s16le").run(
-        input=raw_audio, capture_stdout=True, capture_stderr=True
-    )
+# v3 / v4 声码器的参数：采样率、参考与分块的梅尔帧数、每帧的采样数
+VOCODER_CONFIGS = {
+    "v3": {"sr": 24000, "T_ref": 468, "T_chunk": 934, "upsample_rate": 256, "overlapped_len": 12},
+    "v4": {"sr": 48000, "T_ref": 500, "T_chunk": 1000, "upsample_rate": 480, "overlapped_len": 12},
+}
 
-    # 将管道输出解码为 NumPy 数组
-    processed_audio = np.frombuffer(out, np.int16)
 
-    return processed_audio
+def speed_change(input_audio: np.ndarray, speed: float, sr: int):
+    # int16 进 int16 出；变速在进程内完成（WSOLA），不再起 ffmpeg 子进程
+    audio = time_stretch(input_audio.astype(np.float32) / 32768, speed, sr)
+    return (audio * 32768).clip(-32768, 32767).astype(np.int16)
 
 
 class DictToAttrRecursive(dict):
@@ -296,7 +306,9 @@ class TTS_Config:
     # "auto",#多语种启动切分识别语种
     # "auto_yue",#多语种启动切分识别语种
 
-    def __init__(self, configs: Union[dict, str] = None):
+    def __init__(self, configs: Union[dict, str] = None, persist: bool = True):
+        # persist=False 时 save_configs 不写文件（例如 VoiceRegistry 为每个音色建的配置）
+        self.persist = persist
         # 设置默认配置文件路径
         configs_base_path: str = "GPT_SoVITS/configs/"
         os.makedirs(configs_base_path, exist_ok=True)
@@ -375,6 +387,8 @@ class TTS_Config:
         return configs
 
     def save_configs(self, configs_path: str = None) -> None:
+        if not self.persist:
+            return
         configs = deepcopy(self.default_configs)
         if self.configs is not None:
             configs["custom"] = self.update_configs()
@@ -419,7 +433,14 @@ class TTS_Config:
 
 
 class TTS:
-    def __init__(self, configs: Union[dict, str, TTS_Config]):
+    def __init__(self, configs: Union[dict, str, TTS_Config], shared: "TTS" = None):
+        """
+        Args:
+            configs: TTS_Config, its dict form or the path of its yaml file.
+            shared: another TTS on the same device and precision. Its voice independent models
+                (BERT, CNHuBERT, SV, vocoder, super-sampling) and text preprocessor are reused
+                instead of loaded again, only the GPT and SoVITS weights of `configs` are loaded.
+        """
         if isinstance(configs, TTS_Config):
             self.configs = configs
         else:
@@ -431,9 +452,20 @@ class TTS:
         self.bert_model: AutoModelForMaskedLM = None
         self.cnhuhbert_model: CNHubert = None
         self.vocoder = None
+        # 按版本加载过的声码器，和 shared 的 TTS 共用同一个 dict；self.vocoder 是当前版本的那个
+        self.vocoders: dict = {}
+        self.vocoders_lock = threading.Lock()
+        self.owns_vocoders: bool = shared is None
         self.sr_model: AP_BWE = None
         self.sv_model = None
         self.sr_model_not_exist: bool = False
+        # 可选：跨请求的 T2S 连续批处理调度器、参考音频特征缓存
+        self.t2s_scheduler: T2SScheduler = None
+        self.ref_feature_store: RefFeatureStore = None
+        # 可选：ONNX Runtime CPU 后端
+        self.ort_backend: OrtBackend = None
+        # 可选：torch.compile 的 T2S decode step（enable_compiled_decode 的参数，重新加载 GPT 权重时沿用）
+        self.compiled_decode_kwargs: dict = None
 
         self.vocoder_configs: dict = {
             "sr": None,
@@ -443,16 +475,33 @@ class TTS:
             "overlapped_len": None,
         }
 
+        if shared is not None:
+            self.bert_tokenizer = shared.bert_tokenizer
+            self.bert_model = shared.bert_model
+            self.cnhuhbert_model = shared.cnhuhbert_model
+            self.vocoders = shared.vocoders
+            self.vocoders_lock = shared.vocoders_lock
+            self.sr_model = shared.sr_model
+            self.sr_model_not_exist = shared.sr_model_not_exist
+            self.sv_model = shared.sv_model
+            self.ref_feature_store = shared.ref_feature_store
+
         self._init_models()
 
-        self.text_preprocessor: TextPreprocessor = TextPreprocessor(
-            self.bert_model, self.bert_tokenizer, self.configs.device
-        )
+        if shared is not None:
+            self.text_preprocessor: TextPreprocessor = shared.text_preprocessor
+        else:
+            # 文本前端缓存：同一句文本（尤其是固定的参考文本）不再重复做分词/g2p
+            self.text_preprocessor: TextPreprocessor = TextPreprocessor(
+                self.bert_model, self.bert_tokenizer, self.configs.device, frontend_cache=FrontendCache()
+            )
 
         self.prompt_cache: dict = {
             "ref_audio_path": None,
             "prompt_semantic": None,
             "refer_spec": [],
+            "speaker_condition": None,
+            "t2s_prompt_prefix": None,
             "prompt_text": None,
             "prompt_lang": None,
             "phones": None,
@@ -461,7 +510,15 @@ class TTS:
             "aux_ref_audio_paths": [],
         }
 
+        self.prompt_lock = threading.RLock()
+
+        # 按音素数和这个音色以往的语速预测每句的语义 token 数，用于分桶
+        self.segment_cost = SegmentCostModel(semantic_frame_rate=self.configs.semantic_frame_rate)
+
         self.stop_flag: bool = False
+        # run 出错后重新加载 GPT / SoVITS 权重；多个线程共用这个实例时（服务模式）必须关掉，
+        # 否则一个请求出错会在其他请求推理途中换掉模型、关掉 T2S 调度器
+        self.reset_on_error: bool = True
         self.precision: torch.dtype = torch.float16 if self.configs.is_half else torch.float32
 
     def _init_models(
@@ -469,8 +526,10 @@ class TTS:
     ):
         self.init_t2s_weights(self.configs.t2s_weights_path)
         self.init_vits_weights(self.configs.vits_weights_path)
-        self.init_bert_weights(self.configs.bert_base_path)
-        self.init_cnhuhbert_weights(self.configs.cnhuhbert_base_path)
+        if self.bert_model is None:
+            self.init_bert_weights(self.configs.bert_base_path)
+        if self.cnhuhbert_model is None:
+            self.init_cnhuhbert_weights(self.configs.cnhuhbert_base_path)
         # self.enable_half_precision(self.configs.is_half)
 
     def init_cnhuhbert_weights(self, base_path: str):
@@ -492,6 +551,7 @@ class TTS:
 
     def init_vits_weights(self, weights_path: str):
         self.configs.vits_weights_path = weights_path
+        self._clear_prompt_derived_features()
         version, model_version, if_lora_v3 = get_sovits_version_from_path_fast(weights_path)
         if "Pro" in model_version:
             self.init_sv_model()
@@ -595,8 +655,9 @@ class TTS:
         print(f"Loading Text2Semantic weights from {weights_path}")
         self.configs.t2s_weights_path = weights_path
         self.configs.save_configs()
+        self._clear_prompt_derived_features()
         self.configs.hz = 50
-        dict_s1 = torch.load(weights_path, map_location=self.configs.device, weights_only=False)
+        dict_s1 = load_gpt_ckpt(weights_path, self.configs.device)
         config = dict_s1["config"]
         self.configs.max_sec = config["data"]["max_sec"]
         t2s_model = Text2SemanticLightningModule(config, "****", is_train=False)
@@ -607,42 +668,42 @@ class TTS:
         if self.configs.is_half and str(self.configs.device) != "cpu":
             self.t2s_model = self.t2s_model.half()
 
+        if self.t2s_scheduler is not None:
+            self.enable_t2s_scheduler(self.t2s_scheduler.max_batch_size)
+        if self.compiled_decode_kwargs is not None:
+            self.enable_compiled_decode(**self.compiled_decode_kwargs)
+
         codebook = t2s_model.model.ar_audio_embedding.weight.clone()
         mute_emb = codebook[self.configs.mute_tokens[self.configs.version]].unsqueeze(0)
         sim_matrix = F.cosine_similarity(mute_emb.float(), codebook.float(), dim=-1)
         self.configs.mute_emb_sim_matrix = sim_matrix
 
     def init_vocoder(self, version: str):
+        # 每个 TTS 有自己的 vocoder_configs；声码器本身每个版本只加载一次，所有音色共用
+        self.vocoder_configs = dict(VOCODER_CONFIGS[version])
+        with self.vocoders_lock:
+            if self.owns_vocoders:
+                # 只有 base 释放其他版本的声码器；仍在用它的音色保留自己的引用
+                for other in [v for v in self.vocoders if v != version]:
+                    del self.vocoders[other]
+                    self.empty_cache()
+            vocoder = self.vocoders.get(version)
+            if vocoder is None:
+                vocoder = self._load_vocoder(version)
+                self.vocoders[version] = vocoder
+        self.vocoder = vocoder
+
+    def _load_vocoder(self, version: str):
         if version == "v3":
-            if self.vocoder is not None and self.vocoder.__class__.__name__ == "BigVGAN":
-                return
-            if self.vocoder is not None:
-                self.vocoder.cpu()
-                del self.vocoder
-                self.empty_cache()
-
-            self.vocoder = BigVGAN.from_pretrained(
+            vocoder = BigVGAN.from_pretrained(
                 "%s/GPT_SoVITS/pretrained_models/models--nvidia--bigvgan_v2_24khz_100band_256x" % (now_dir,),
                 use_cuda_kernel=False,
             )  # if True, RuntimeError: Ninja is required to load C++ extensions
             # remove weight norm in the model and set to eval mode
-            self.vocoder.remove_weight_norm()
-
-            self.vocoder_configs["sr"] = 24000
-            self.vocoder_configs["T_ref"] = 468
-            self.vocoder_configs["T_chunk"] = 934
-            self.vocoder_configs["upsample_rate"] = 256
-            self.vocoder_configs["overlapped_len"] = 12
+            vocoder.remove_weight_norm()
 
         elif version == "v4":
-            if self.vocoder is not None and self.vocoder.__class__.__name__ == "Generator":
-                return
-            if self.vocoder is not None:
-                self.vocoder.cpu()
-                del self.vocoder
-                self.empty_cache()
-
-            self.vocoder = Generator(
+            vocoder = Generator(
                 initial_channel=100,
                 resblock="1",
                 resblock_kernel_sizes=[3, 7, 11],
@@ -653,25 +714,20 @@ class TTS:
                 gin_channels=0,
                 is_bias=True,
             )
-            self.vocoder.remove_weight_norm()
+            vocoder.remove_weight_norm()
             state_dict_g = torch.load(
                 "%s/GPT_SoVITS/pretrained_models/gsv-v4-pretrained/vocoder.pth" % (now_dir,),
                 map_location="cpu",
                 weights_only=False,
             )
-            print("loading vocoder", self.vocoder.load_state_dict(state_dict_g))
-
-            self.vocoder_configs["sr"] = 48000
-            self.vocoder_configs["T_ref"] = 500
-            self.vocoder_configs["T_chunk"] = 1000
-            self.vocoder_configs["upsample_rate"] = 480
-            self.vocoder_configs["overlapped_len"] = 12
+            print("loading vocoder", vocoder.load_state_dict(state_dict_g))
 
-        self.vocoder = self.vocoder.eval()
+        vocoder = vocoder.eval()
         if self.configs.is_half == True:
-            self.vocoder = self.vocoder.half().to(self.configs.device)
+            vocoder = vocoder.half().to(self.configs.device)
         else:
-            self.vocoder = self.vocoder.to(self.configs.device)
+            vocoder = vocoder.to(self.configs.device)
+        return vocoder
 
     def init_sr_model(self):
         if self.sr_model is not None:
@@ -688,6 +744,101 @@ class TTS:
             return
         self.sv_model = SV(self.configs.device, self.configs.is_half)
 
+    def voice_model_bytes(self) -> int:
+        """Memory held by the voice specific GPT and SoVITS weights."""
+        total = 0
+        for model in (self.t2s_model, self.vits_model):
+            if model is None:
+                continue
+            for tensor in list(model.parameters()) + list(model.buffers()):
+                total += tensor.numel() * tensor.element_size()
+        return total
+
+    def close(self):
+        """Stop the background T2S scheduler, if any."""
+        if self.t2s_scheduler is not None:
+            self.t2s_scheduler.close()
+            self.t2s_scheduler = None
+
+    def enable_t2s_scheduler(self, max_batch_size: int = 8):
+        """
+        Route non-streaming T2S inference of every `run` call through one T2SScheduler,
+        so that concurrent requests share a continuously batched decode loop.
+        """
+        if self.t2s_scheduler is not None:
+            self.t2s_scheduler.close()
+        self.t2s_scheduler = T2SScheduler(self.t2s_model.model, max_batch_size=max_batch_size)
+
+    def enable_compiled_decode(self, batch_sizes=(1,), capacities=None):
+        """
+        Run T2S decode steps as torch.compile'd graphs with fixed-shape KV buffers, see
+        AR.models.t2s_model.T2SCompiledDecodeStep. Every (batch size, KV capacity) bucket is
+        compiled here, so this takes a while; other shapes keep the eager decode step.
+        batch_sizes should cover the batch sizes the T2S scheduler / parallel_infer produce.
+        """
+        self.compiled_decode_kwargs = {"batch_sizes": tuple(batch_sizes), "capacities": capacities}
+        self.t2s_model.model.enable_compiled_decode(batch_sizes, capacities)
+
+    def enable_ort_backend(self, onnx_dir: str, intra_op_num_threads: int = 0):
+        """
+        Run the graphs exported by GPT_SoVITS/export_onnx_backend.py to `onnx_dir` with ONNX Runtime
+        instead of PyTorch: CNHuBERT, BERT, T2S (non-streaming) and VITS (speed_factor 1.0).
+        CPU and fp32 only. The T2S graphs replace the T2S scheduler, if one is enabled.
+        """
+        if str(self.configs.device) != "cpu" or self.configs.is_half:
+            raise ValueError("the ONNX Runtime backend needs device=cpu and is_half=False")
+        self.ort_backend = OrtBackend(onnx_dir, intra_op_num_threads)
+        if self.ort_backend.has("bert"):
+            self.text_preprocessor.ort_backend = self.ort_backend
+
+    def _vits_decode(self, codes, phones, refer_audio_spec, speed, sv_emb, speaker_condition):
+        if self.ort_backend is not None and self.ort_backend.has("vits") and speed == 1.0:
+            return self.ort_backend.vits_decode(codes, phones, speaker_condition)
+        return self.vits_model.decode(
+            codes,
+            phones,
+            refer_audio_spec,
+            speed=speed,
+            sv_emb=sv_emb,
+            speaker_condition=speaker_condition,
+        )
+
+    def _infer_panel_scheduler(
+        self,
+        x: List[torch.LongTensor],
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,
+        bert_feature: List[torch.LongTensor],
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ):
+        """Same inputs and outputs as infer_panel_batch_infer, decoded by self.t2s_scheduler."""
+        futures = [
+            self.t2s_scheduler.submit(
+                x[i],
+                prompts[i] if prompts is not None else None,
+                bert_feature[i],
+                top_k=top_k,
+                top_p=top_p,
+                temperature=temperature,
+                repetition_penalty=repetition_penalty,
+                early_stop_num=early_stop_num,
+                prompt_prefix=kwargs.get("prompt_prefix", None),
+            )
+            for i in range(len(x))
+        ]
+        y_list = []
+        idx_list = []
+        for future in futures:
+            y, idx = future.result()
+            y_list.append(y)
+            idx_list.append(idx)
+        return y_list, idx_list
+
     def enable_half_precision(self, enable: bool = True, save: bool = True):
         """
         To enable half precision for the TTS model.
@@ -701,6 +852,7 @@ class TTS:
 
         self.configs.is_half = enable
         self.precision = torch.float16 if enable else torch.float32
+        self._clear_prompt_derived_features()
         if save:
             self.configs.save_configs()
         if enable:
@@ -733,6 +885,7 @@ class TTS:
             device: torch.device, the device to use for all models.
         """
         self.configs.device = device
+        self._clear_prompt_derived_features()
         if save:
             self.configs.save_configs()
         if self.t2s_model is not None:
@@ -755,10 +908,75 @@ class TTS:
         Args:
             ref_audio_path: str, the path of the reference audio.
         """
-        self._set_prompt_semantic(ref_audio_path)
-        self._set_ref_spec(ref_audio_path)
+        if self.ref_feature_store is None:
+            self._set_prompt_semantic(ref_audio_path)
+            self._set_ref_spec(ref_audio_path)
+        else:
+            key = self.ref_feature_store.make_key(
+                ref_audio_path, self.configs.vits_weights_path, self.configs.version, self.precision
+            )
+            feats = self.ref_feature_store.get_or_compute(key, lambda: self._extract_ref_features(ref_audio_path))
+            device = self.configs.device
+            spec_audio = (
+                feats["spec"].to(device),
+                feats["audio"].to(device) if feats["audio"] is not None else None,
+                feats["sv_emb"].to(device) if feats["sv_emb"] is not None else None,
+            )
+            self.prompt_cache["prompt_semantic"] = feats["prompt_semantic"].to(device)
+            # 原始音频不进缓存（只有 v3/v4 的声码器参考要用），需要时直接从文件读
+            if self.configs.use_vocoder:
+                raw_audio, raw_sr = torchaudio.load(ref_audio_path)
+                self.prompt_cache["raw_audio"] = raw_audio.to(device).float()
+                self.prompt_cache["raw_sr"] = raw_sr
+            if self.prompt_cache["refer_spec"] in [[], None]:
+                self.prompt_cache["refer_spec"] = [spec_audio]
+            else:
+                self.prompt_cache["refer_spec"][0] = spec_audio
+        self._clear_prompt_derived_features()
         self._set_ref_audio_path(ref_audio_path)
 
+    def _extract_ref_features(self, ref_audio_path: str) -> dict:
+        self._set_prompt_semantic(ref_audio_path)
+        spec, audio, sv_emb = self._get_ref_spec(ref_audio_path)
+        return {
+            "prompt_semantic": self.prompt_cache["prompt_semantic"],
+            "spec": spec,
+            "audio": audio,
+            "sv_emb": sv_emb,
+        }
+
+    def _clear_prompt_derived_features(self):
+        """Drop features computed from prompt_cache with the current models (ge, T2S prompt prefix)."""
+        if hasattr(self, "prompt_cache"):
+            self.prompt_cache["speaker_condition"] = None
+            self.prompt_cache["t2s_prompt_prefix"] = None
+
+    def _get_speaker_condition(self, refer_spec: list):
+        """The VITS speaker conditioning (ge) of a reference set, see SynthesizerTrn.get_speaker_condition."""
+        refer_audio_spec = [spec.to(dtype=self.precision, device=self.configs.device) for spec, _, _ in refer_spec]
+        sv_emb = [_sv_emb for _, _, _sv_emb in refer_spec] if self.is_v2pro else None
+        return self.vits_model.get_speaker_condition(refer_audio_spec, sv_emb)
+
+    def _snapshot_prompt_cache(self) -> dict:
+        """Shallow copy of prompt_cache, unaffected by later set_ref_audio calls from other threads."""
+        if self.prompt_cache["speaker_condition"] is None and not self.configs.use_vocoder:
+            # 同一组参考音频只算一次 ge，之后每句 VITS 解码直接复用
+            self.prompt_cache["speaker_condition"] = self._get_speaker_condition(self.prompt_cache["refer_spec"])
+        if (
+            self.prompt_cache["t2s_prompt_prefix"] is None
+            and self.prompt_cache["phones"] is not None
+            and self.prompt_cache["prompt_semantic"] is not None
+        ):
+            # 参考文本 + 参考音频 token 的嵌入每句都一样，算一次复用
+            self.prompt_cache["t2s_prompt_prefix"] = self.t2s_model.model.build_prompt_prefix(
+                torch.LongTensor(self.prompt_cache["phones"]).to(self.configs.device),
+                self.prompt_cache["bert_features"].to(dtype=self.precision, device=self.configs.device),
+                self.prompt_cache["prompt_semantic"].to(self.configs.device),
+            )
+        prompt_cache = dict(self.prompt_cache)
+        prompt_cache["refer_spec"] = list(self.prompt_cache["refer_spec"])
+        return prompt_cache
+
     def _set_ref_audio_path(self, ref_audio_path):
         self.prompt_cache["ref_audio_path"] = ref_audio_path
 
@@ -802,9 +1020,12 @@ class TTS:
             audio = resample(audio, self.configs.sampling_rate, 16000, self.configs.device)
             if self.configs.is_half:
                 audio = audio.half()
+            # 说话人向量只依赖参考音频，在这里算一次，避免每个batch都重跑fbank+ERes2NetV2
+            sv_emb = self.sv_model.compute_embedding3(audio)
         else:
             audio = None
-        return spec, audio
+            sv_emb = None
+        return spec, audio, sv_emb
 
     def _set_prompt_semantic(self, ref_wav_path: str):
         zero_wav = np.zeros(
@@ -824,9 +1045,12 @@ class TTS:
                 zero_wav_torch = zero_wav_torch.half()
 
             wav16k = torch.cat([wav16k, zero_wav_torch])
-            hubert_feature = self.cnhuhbert_model.model(wav16k.unsqueeze(0))["last_hidden_state"].transpose(
-                1, 2
-            )  # .float()
+            if self.ort_backend is not None and self.ort_backend.has("ssl"):
+                hubert_feature = self.ort_backend.ssl(wav16k.unsqueeze(0))
+            else:
+                hubert_feature = self.cnhuhbert_model.model(wav16k.unsqueeze(0))["last_hidden_state"].transpose(
+                    1, 2
+                )  # .float()
             codes = self.vits_model.extract_latent(hubert_feature)
 
             prompt_semantic = codes[0, 0].to(self.configs.device)
@@ -862,35 +1086,22 @@ class TTS:
         split_bucket: bool = True,
         device: torch.device = torch.device("cpu"),
         precision: torch.dtype = torch.float32,
+        token_budget: int = 0,
     ):
         _data: list = []
-        index_and_len_list = []
-        for idx, item in enumerate(data):
-            norm_text_len = len(item["norm_text"])
-            index_and_len_list.append([idx, norm_text_len])
 
         batch_index_list = []
         if split_bucket:
-            index_and_len_list.sort(key=lambda x: x[1])
-            index_and_len_list = np.array(index_and_len_list, dtype=np.int64)
-
-            batch_index_list_len = 0
-            pos = 0
-            while pos < index_and_len_list.shape[0]:
-                # batch_index_list.append(index_and_len_list[pos:min(pos+batch_size,len(index_and_len_list))])
-                pos_end = min(pos + batch_size, index_and_len_list.shape[0])
-                while pos < pos_end:
-                    batch = index_and_len_list[pos:pos_end, 1].astype(np.float32)
-                    score = batch[(pos_end - pos) // 2] / (batch.mean() + 1e-8)
-                    if (score >= threshold) or (pos_end - pos == 1):
-                        batch_index = index_and_len_list[pos:pos_end, 0].tolist()
-                        batch_index_list_len += len(batch_index)
-                        batch_index_list.append(batch_index)
-                        pos = pos_end
-                        break
-                    pos_end = pos_end - 1
-
-            assert batch_index_list_len == len(data)
+            # 按代价分桶：预填充长度（参考 + 本句音素）+ 预测生成的语义 token 数
+            prompt_len = 0
+            if prompt_data is not None:
+                prompt_len = len(prompt_data["phones"])
+                if prompt_data.get("prompt_semantic") is not None:
+                    prompt_len += prompt_data["prompt_semantic"].shape[-1]
+            prefill_lens = [prompt_len + len(item["phones"]) for item in data]
+            decode_lens = [self.segment_cost.predict(len(item["phones"]), item["norm_text"]) for item in data]
+            batch_index_list = self.segment_cost.bucket(prefill_lens, decode_lens, batch_size, threshold, token_budget)
+            assert sum(len(index) for index in batch_index_list) == len(data)
 
         else:
             for i in range(len(data)):
@@ -1002,7 +1213,7 @@ class TTS:
         Args:
             inputs (dict):
                 {
-                    "text": "",                   # str.(required) text to be synthesized
+                    "text": "",                   # str or list.(required) text to be synthesized. A list of texts is synthesized in one batched pass and yields one (sr, audio) per text, in order.
                     "text_lang: "",               # str.(required) language of the text to be synthesized
                     "ref_audio_path": "",         # str.(required) reference audio path
                     "aux_ref_audio_paths": [],    # list.(optional) auxiliary reference audio paths for multi-speaker tone fusion
@@ -1014,26 +1225,33 @@ class TTS:
                     "text_split_method": "cut1",  # str. text split method, see text_segmentation_method.py for details.
                     "batch_size": 1,              # int. batch size for inference
                     "batch_threshold": 0.75,      # float. threshold for batch splitting.
+                    "batch_token_budget": 0,      # int. max padded tokens (batch size * (longest prefill + longest predicted generation)) of a bucket, 0 for no limit.
                     "split_bucket": True,         # bool. whether to split the batch into multiple buckets.
                     "speed_factor":1.0,           # float. control the speed of the synthesized audio.
+                    "speed_method": "model",      # str. "model": SoVITS decodes at speed_factor; "time_stretch": synthesize at 1.0 and change the tempo afterwards (WSOLA), keeps split_bucket, parallel VITS and the ONNX VITS graph.
                     "fragment_interval":0.3,      # float. to control the interval of the audio fragment.
                     "seed": -1,                   # int. random seed for reproducibility.
                     "parallel_infer": True,       # bool. whether to use parallel inference.
                     "repetition_penalty": 1.35,   # float. repetition penalty for T2S model.
                     "sample_steps": 32,           # int. number of sampling steps for VITS model V3.
+                    "cfm_profile": None,          # str. V3/V4: named CFM sampling profile (see CFM_PROFILES: "fast", "balanced", "quality", "adaptive"), sets the defaults of sample_steps / cfm_solver / sway_coef.
+                    "cfm_solver": "euler",        # str. V3/V4: ODE solver of the CFM, "euler", "midpoint", "heun" (two model calls per step) or "adaptive".
+                    "sway_coef": None,            # float. V3/V4: sway sampling of the CFM time steps (e.g. -1.0, more steps near t=0), None for uniform steps.
+                    "cfm_batch_size": 0,          # int. V3/V4 without parallel_infer: max sentences whose next CFM chunk runs in one batch, 0 for all sentences of the batch, 1 for one sentence at a time.
                     "super_sampling": False,      # bool. whether to use super-sampling for audio when using VITS model V3.
                     "return_fragment": False,     # bool. step by step return the audio fragment. (Best Quality, Slowest response speed. old version of streaming mode)
                     "streaming_mode": False,      # bool. return audio chunk by chunk. (Medium quality, Slow response speed)
                     "overlap_length": 2,          # int. overlap length of semantic tokens for streaming mode.
                     "min_chunk_length": 16,        # int. The minimum chunk length of semantic tokens for streaming mode. (affects audio chunk size)
                     "fixed_length_chunk": False,  # bool. When turned on, it can achieve faster streaming response, but with lower quality. (lower quality, faster response speed)
+                    "first_chunk_length": 16,     # int. The chunk length of the first chunk in streaming mode, smaller means a faster first response. (defaults to min_chunk_length)
                 }
         returns:
             Tuple[int, np.ndarray]: sampling rate and audio data.
         """
         ########## variables initialization ###########
         self.stop_flag: bool = False
-        text: str = inputs.get("text", "")
+        text: Union[str, List[str]] = inputs.get("text", "")
         text_lang: str = inputs.get("text_lang", "")
         ref_audio_path: str = inputs.get("ref_audio_path", "")
         aux_ref_audio_paths: list = inputs.get("aux_ref_audio_paths", [])
@@ -1045,7 +1263,9 @@ class TTS:
         text_split_method: str = inputs.get("text_split_method", "cut1")
         batch_size = inputs.get("batch_size", 1)
         batch_threshold = inputs.get("batch_threshold", 0.75)
+        batch_token_budget = inputs.get("batch_token_budget", 0)
         speed_factor = inputs.get("speed_factor", 1.0)
+        speed_method = inputs.get("speed_method", "model")
         split_bucket = inputs.get("split_bucket", True)
         return_fragment = inputs.get("return_fragment", False)
         fragment_interval = inputs.get("fragment_interval", 0.3)
@@ -1054,36 +1274,60 @@ class TTS:
         actual_seed = set_seed(seed)
         parallel_infer = inputs.get("parallel_infer", True)
         repetition_penalty = inputs.get("repetition_penalty", 1.35)
-        sample_steps = inputs.get("sample_steps", 32)
+        cfm_profile = inputs.get("cfm_profile", None)
+        if cfm_profile is not None and cfm_profile not in CFM_PROFILES:
+            raise ValueError(f"unknown cfm_profile: {cfm_profile}, available: {list(CFM_PROFILES)}")
+        profile = CFM_PROFILES.get(cfm_profile, {})
+        sample_steps = inputs.get("sample_steps", profile.get("sample_steps", 32))
+        cfm_options = {
+            "solver": inputs.get("cfm_solver", profile.get("cfm_solver", "euler")),
+            "sway_coef": inputs.get("sway_coef", profile.get("sway_coef", None)),
+        }
+        if cfm_options["solver"] not in ("euler", "midpoint", "heun", "adaptive"):
+            raise ValueError(f"unknown cfm_solver: {cfm_options['solver']}")
+        cfm_batch_size = inputs.get("cfm_batch_size", 0)
         super_sampling = inputs.get("super_sampling", False)
         streaming_mode = inputs.get("streaming_mode", False)
         overlap_length = inputs.get("overlap_length", 2)
         min_chunk_length = inputs.get("min_chunk_length", 16)
         fixed_length_chunk = inputs.get("fixed_length_chunk", False)
+        first_chunk_length = inputs.get("first_chunk_length", min_chunk_length)
+        stretch_factor = 1.0
+        if speed_method == "time_stretch" and speed_factor != 1.0:
+            # 按 1.0 合成，在后处理中变速
+            stretch_factor = speed_factor
+            speed_factor = 1.0
         chunk_split_thershold = 0.0 # 该值代表语义token与mute token的余弦相似度阈值，若大于该阈值，则视为可切分点。
 
         if parallel_infer and not streaming_mode:
             print(i18n("并行推理模式已开启"))
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_batch_infer
+            infer_panel = self.t2s_model.model.infer_panel_batch_infer
         elif not parallel_infer and streaming_mode and not self.configs.use_vocoder:
             print(i18n("流式推理模式已开启"))
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive
+            infer_panel = self.t2s_model.model.infer_panel_naive
         elif streaming_mode and self.configs.use_vocoder:
             print(i18n("SoVits V3/4模型不支持流式推理模式，已自动回退到分段返回模式"))
             streaming_mode = False
             return_fragment = True
             if parallel_infer:
-                self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_batch_infer
+                infer_panel = self.t2s_model.model.infer_panel_batch_infer
             else:
-                self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive_batched
+                infer_panel = self.t2s_model.model.infer_panel_naive_batched
             # self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive
         elif parallel_infer and streaming_mode:
             print(i18n("不支持同时开启并行推理和流式推理模式，已自动关闭并行推理模式"))
             parallel_infer = False
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive
+            infer_panel = self.t2s_model.model.infer_panel_naive
         else:
             print(i18n("朴素推理模式已开启"))
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive_batched
+            infer_panel = self.t2s_model.model.infer_panel_naive_batched
+
+        if self.t2s_scheduler is not None and not streaming_mode:
+            # 与其他并发请求共享连续批处理的解码循环
+            infer_panel = self._infer_panel_scheduler
+
+        if self.ort_backend is not None and self.ort_backend.has("t2s_prefill") and not streaming_mode:
+            infer_panel = self.ort_backend.infer_panel
 
         if return_fragment and streaming_mode:
             print(i18n("流式推理模式不支持分段返回，已自动关闭分段返回"))
@@ -1109,6 +1353,10 @@ class TTS:
         #     fragment_interval = 0.01
         #     print(i18n("分段间隔过小，已自动设置为0.01"))
 
+        multi_text = isinstance(text, (list, tuple))
+        if multi_text and (return_fragment or streaming_mode):
+            raise ValueError("a list of texts is not supported with return_fragment or streaming_mode")
+
         no_prompt_text = False
         if prompt_text in [None, ""]:
             no_prompt_text = True
@@ -1120,69 +1368,86 @@ class TTS:
         if no_prompt_text and self.configs.use_vocoder:
             raise NO_PROMPT_ERROR("prompt_text cannot be empty when using SoVITS_V3")
 
-        if ref_audio_path in [None, ""] and (
-            (self.prompt_cache["prompt_semantic"] is None) or (self.prompt_cache["refer_spec"] in [None, []])
-        ):
-            raise ValueError(
-                "ref_audio_path cannot be empty, when the reference audio is not set using set_ref_audio()"
-            )
-
-        ###### setting reference audio and prompt text preprocessing ########
-        t0 = time.perf_counter()
-        if (ref_audio_path is not None) and (
-            ref_audio_path != self.prompt_cache["ref_audio_path"]
-            or (self.is_v2pro and self.prompt_cache["refer_spec"][0][1] is None)
-        ):
-            if not os.path.exists(ref_audio_path):
-                raise ValueError(f"{ref_audio_path} not exists")
-            self.set_ref_audio(ref_audio_path)
-
-        aux_ref_audio_paths = aux_ref_audio_paths if aux_ref_audio_paths is not None else []
-        paths = set(aux_ref_audio_paths) & set(self.prompt_cache["aux_ref_audio_paths"])
-        if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
-            self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
-            self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
-            for path in aux_ref_audio_paths:
-                if path in [None, ""]:
-                    continue
-                if not os.path.exists(path):
-                    print(i18n("音频文件不存在，跳过："), path)
-                    continue
-                self.prompt_cache["refer_spec"].append(self._get_ref_spec(path))
-
-        if not no_prompt_text:
-            prompt_text = prompt_text.strip("\n")
-            if prompt_text[-1] not in splits:
-                prompt_text += "。" if prompt_lang != "en" else "."
-            print(i18n("实际输入的参考文本:"), prompt_text)
-            if self.prompt_cache["prompt_text"] != prompt_text:
-                phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
-                    prompt_text, prompt_lang, self.configs.version
+        # prompt_cache 被所有线程共享：加锁更新，本次推理只使用更新后的快照
+        with self.prompt_lock:
+            if ref_audio_path in [None, ""] and (
+                (self.prompt_cache["prompt_semantic"] is None) or (self.prompt_cache["refer_spec"] in [None, []])
+            ):
+                raise ValueError(
+                    "ref_audio_path cannot be empty, when the reference audio is not set using set_ref_audio()"
                 )
-                self.prompt_cache["prompt_text"] = prompt_text
-                self.prompt_cache["prompt_lang"] = prompt_lang
-                self.prompt_cache["phones"] = phones
-                self.prompt_cache["bert_features"] = bert_features
-                self.prompt_cache["norm_text"] = norm_text
+
+            ###### setting reference audio and prompt text preprocessing ########
+            t0 = time.perf_counter()
+            if (ref_audio_path is not None) and (
+                ref_audio_path != self.prompt_cache["ref_audio_path"]
+                or (self.is_v2pro and self.prompt_cache["refer_spec"][0][2] is None)
+            ):
+                if not os.path.exists(ref_audio_path):
+                    raise ValueError(f"{ref_audio_path} not exists")
+                self.set_ref_audio(ref_audio_path)
+
+            aux_ref_audio_paths = aux_ref_audio_paths if aux_ref_audio_paths is not None else []
+            paths = set(aux_ref_audio_paths) & set(self.prompt_cache["aux_ref_audio_paths"])
+            if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
+                self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
+                self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
+                self.prompt_cache["speaker_condition"] = None
+                for path in aux_ref_audio_paths:
+                    if path in [None, ""]:
+                        continue
+                    if not os.path.exists(path):
+                        print(i18n("音频文件不存在，跳过："), path)
+                        continue
+                    self.prompt_cache["refer_spec"].append(self._get_ref_spec(path))
+
+            if not no_prompt_text:
+                prompt_text = prompt_text.strip("\n")
+                if prompt_text[-1] not in splits:
+                    prompt_text += "。" if prompt_lang != "en" else "."
+                print(i18n("实际输入的参考文本:"), prompt_text)
+                if self.prompt_cache["prompt_text"] != prompt_text:
+                    phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
+                        prompt_text, prompt_lang, self.configs.version
+                    )
+                    self.prompt_cache["prompt_text"] = prompt_text
+                    self.prompt_cache["prompt_lang"] = prompt_lang
+                    self.prompt_cache["phones"] = phones
+                    self.prompt_cache["bert_features"] = bert_features
+                    self.prompt_cache["norm_text"] = norm_text
+                    self.prompt_cache["t2s_prompt_prefix"] = None
+            prompt_cache = self._snapshot_prompt_cache()
 
         ###### text preprocessing ########
         t1 = time.perf_counter()
         data: list = None
         if not (return_fragment or streaming_mode):
-            data = self.text_preprocessor.preprocess(text, text_lang, text_split_method, self.configs.version)
+            text_owners: list = None
+            if multi_text:
+                # 所有文本的分句一起分桶推理，text_owners 记录每个分句属于第几条文本
+                data, text_owners = self.text_preprocessor.preprocess_texts(
+                    text, text_lang, text_split_method, self.configs.version
+                )
+            else:
+                data = self.text_preprocessor.preprocess(text, text_lang, text_split_method, self.configs.version)
             if len(data) == 0:
+                if multi_text:
+                    for _ in text:
+                        yield 16000, np.zeros(int(16000), dtype=np.int16)
+                    return
                 yield 16000, np.zeros(int(16000), dtype=np.int16)
                 return
 
             batch_index_list: list = None
             data, batch_index_list = self.to_batch(
                 data,
-                prompt_data=self.prompt_cache if not no_prompt_text else None,
+                prompt_data=prompt_cache if not no_prompt_text else None,
                 batch_size=batch_size,
                 threshold=batch_threshold,
                 split_bucket=split_bucket,
                 device=self.configs.device,
                 precision=self.precision,
+                token_budget=batch_token_budget,
             )
         else:
             print(f"############ {i18n('切分文本')} ############")
@@ -1196,10 +1461,9 @@ class TTS:
             def make_batch(batch_texts):
                 batch_data = []
                 print(f"############ {i18n('提取文本Bert特征')} ############")
-                for text in tqdm(batch_texts):
-                    phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
-                        text, text_lang, self.configs.version
-                    )
+                for phones, bert_features, norm_text in self.text_preprocessor.segment_and_extract_feature_for_texts(
+                    batch_texts, text_lang, self.configs.version
+                ):
                     if phones is None:
                         continue
                     res = {
@@ -1212,7 +1476,7 @@ class TTS:
                     return None
                 batch, _ = self.to_batch(
                     batch_data,
-                    prompt_data=self.prompt_cache if not no_prompt_text else None,
+                    prompt_data=prompt_cache if not no_prompt_text else None,
                     batch_size=batch_size,
                     threshold=batch_threshold,
                     split_bucket=False,
@@ -1230,9 +1494,153 @@ class TTS:
             audio = []
             is_first_package = True
             output_sr = self.configs.sampling_rate if not self.configs.use_vocoder else self.vocoder_configs["sr"]
+
+            refer_audio_spec = []
+            sv_emb = [] if self.is_v2pro else None
+            for spec, _, _sv_emb in prompt_cache["refer_spec"]:
+                spec = spec.to(dtype=self.precision, device=self.configs.device)
+                refer_audio_spec.append(spec)
+                if self.is_v2pro:
+                    sv_emb.append(_sv_emb)
+            speaker_condition = prompt_cache["speaker_condition"]
+            t2s_prompt_prefix = None if no_prompt_text else prompt_cache["t2s_prompt_prefix"]
+
+            if streaming_mode:
+                print(f"############ {i18n('预测语义Token')} ############")
+
+                def stream_semantic_tokens():
+                    # 后台线程里逐句做前端处理和 T2S 解码：下面 VITS 解码当前块时，后面的 token（包括下一句的）继续生成
+                    for batch_texts in data:
+                        item = make_batch(batch_texts)
+                        if item is None:
+                            continue
+                        print(i18n("前端处理后的文本(每句):"), item["norm_text"])
+                        for i in range(len(item["phones"])):
+                            prompt = (
+                                None
+                                if no_prompt_text
+                                else prompt_cache["prompt_semantic"].expand(1, -1).to(self.configs.device)
+                            )
+                            semantic_token_generator = infer_panel(
+                                item["all_phones"][i].unsqueeze(0),
+                                item["all_phones_len"][i : i + 1],
+                                prompt,
+                                item["all_bert_features"][i].unsqueeze(0),
+                                top_k=top_k,
+                                top_p=top_p,
+                                temperature=temperature,
+                                early_stop_num=self.configs.hz * self.configs.max_sec,
+                                max_len=item["max_len"],
+                                prompt_prefix=t2s_prompt_prefix,
+                                repetition_penalty=repetition_penalty,
+                                streaming_mode=True,
+                                chunk_length=min_chunk_length,
+                                first_chunk_length=first_chunk_length,
+                                mute_emb_sim_matrix=self.configs.mute_emb_sim_matrix if not fixed_length_chunk else None,
+                                chunk_split_thershold=chunk_split_thershold,
+                            )
+                            phones = item["phones"][i].unsqueeze(0).to(self.configs.device)
+                            for semantic_tokens, is_final in semantic_token_generator:
+                                yield phones, semantic_tokens, is_final
+                            if self.stop_flag:
+                                return
+
+                # V3/4 模型在上面已回退到分段返回模式，这里只有 VITS
+                frame_rate = 2 if self.vits_model.semantic_frame_rate == "25hz" else 1
+                upsample_rate = math.prod(self.vits_model.upsample_rates) * (frame_rate / speed_factor)
+                overlap_size = math.ceil(overlap_length * upsample_rate)
+
+                last_audio_chunk = None
+                last_latent = None
+                previous_tokens = []
+                is_first_chunk = True
+                stretcher = TimeStretcher(stretch_factor, output_sr) if stretch_factor != 1.0 else None
+
+                def stretch_chunk(audio_chunk: torch.Tensor, flush: bool = False) -> torch.Tensor:
+                    # 逐块变速，句内跨块保留状态
+                    if stretcher is None:
+                        return audio_chunk
+                    out = stretcher.process(audio_chunk.float().cpu().numpy())
+                    if flush:
+                        out = np.concatenate([out, stretcher.flush()])
+                    return torch.from_numpy(out)
+
+                with closing(self._prefetch(stream_semantic_tokens())) as chunks:
+                    for phones, semantic_tokens, is_final in chunks:
+                        if semantic_tokens is not None:
+                            print(f"semantic_tokens shape:{semantic_tokens.shape}")
+                            previous_tokens.append(semantic_tokens)
+                            _semantic_tokens = torch.cat(previous_tokens, dim=-1)
+
+                            if not is_first_chunk and semantic_tokens.shape[-1] < 10:
+                                overlap_len = overlap_length + (10 - semantic_tokens.shape[-1])
+                            else:
+                                overlap_len = overlap_length
+
+                            audio_chunk, latent, latent_mask = self.vits_model.decode_streaming(
+                                _semantic_tokens.unsqueeze(0),
+                                phones,
+                                refer_audio_spec,
+                                speed=speed_factor,
+                                sv_emb=sv_emb,
+                                speaker_condition=speaker_condition,
+                                result_length=semantic_tokens.shape[-1] + overlap_len if not is_first_chunk else None,
+                                overlap_frames=last_latent[:, :, -overlap_len * frame_rate :]
+                                if last_latent is not None
+                                else None,
+                                padding_length=0,
+                            )
+                            audio_chunk = audio_chunk.detach()[0, 0, :]
+
+                            if overlap_len > overlap_length:
+                                audio_chunk = audio_chunk[-int((overlap_length + semantic_tokens.shape[-1]) * upsample_rate) :]
+
+                            audio_chunk_ = audio_chunk
+                            if is_first_chunk and not is_final:
+                                audio_chunk_ = audio_chunk_[:-overlap_size]
+                            elif not is_first_chunk and not is_final:
+                                audio_chunk_ = self.sola_algorithm([last_audio_chunk, audio_chunk_], overlap_size)
+                                audio_chunk_ = audio_chunk_[last_audio_chunk.shape[0] - overlap_size : -overlap_size]
+                            is_first_chunk = False
+
+                            last_latent = latent
+                            last_audio_chunk = audio_chunk
+                            audio_chunk_ = stretch_chunk(audio_chunk_, flush=is_final)
+                            if audio_chunk_.shape[0] > 0:
+                                yield self.audio_postprocess([[audio_chunk_]], output_sr, None, 1.0, False, 0.0, False)
+
+                            if is_first_package:
+                                print(f"first_package_delay: {time.perf_counter()-t0:.3f}")
+                                is_first_package = False
+                        elif last_audio_chunk is not None:
+                            # 最后一块没有新 token：补上上一块留作重叠的尾巴
+                            yield self.audio_postprocess(
+                                [[stretch_chunk(last_audio_chunk[-overlap_size:], flush=True)]],
+                                output_sr,
+                                None,
+                                1.0,
+                                False,
+                                0.0,
+                                False,
+                            )
+
+                        if is_final:
+                            yield output_sr, np.zeros(int(output_sr * fragment_interval), dtype=np.int16)
+                            last_audio_chunk = None
+                            last_latent = None
+                            previous_tokens = []
+                            is_first_chunk = True
+                            stretcher = TimeStretcher(stretch_factor, output_sr) if stretch_factor != 1.0 else None
+
+                        if self.stop_flag:
+                            yield output_sr, np.zeros(int(output_sr), dtype=np.int16)
+                            return
+                print("%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, time.perf_counter() - t2))
+                return
+
             for item in data:
                 t3 = time.perf_counter()
-                if return_fragment or streaming_mode:
+                if return_fragment:
                     item = make_batch(item)
                     if item is None:
                         continue
@@ -1251,231 +1659,141 @@ class TTS:
                     prompt = None
                 else:
                     prompt = (
-                        self.prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
+                        prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
                     )
 
-                refer_audio_spec = []
-                
-                sv_emb = [] if self.is_v2pro else None
-                for spec, audio_tensor in self.prompt_cache["refer_spec"]:
-                    spec = spec.to(dtype=self.precision, device=self.configs.device)
-                    refer_audio_spec.append(spec)
-                    if self.is_v2pro:
-                        sv_emb.append(self.sv_model.compute_embedding3(audio_tensor))
-
-                if not streaming_mode:
-                    print(f"############ {i18n('预测语义Token')} ############")
-                    pred_semantic_list, idx_list = self.t2s_model.model.infer_panel(
-                        all_phoneme_ids,
-                        all_phoneme_lens,
-                        prompt,
-                        all_bert_features,
-                        # prompt_phone_len=ph_offset,
-                        top_k=top_k,
-                        top_p=top_p,
-                        temperature=temperature,
-                        early_stop_num=self.configs.hz * self.configs.max_sec,
-                        max_len=max_len,
-                        repetition_penalty=repetition_penalty,
-                    )
-                    t4 = time.perf_counter()
-                    t_34 += t4 - t3
-
-
-                    batch_audio_fragment = []
-
-                    # ## vits并行推理 method 1
-                    # pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
-                    # pred_semantic_len = torch.LongTensor([item.shape[0] for item in pred_semantic_list]).to(self.configs.device)
-                    # pred_semantic = self.batch_sequences(pred_semantic_list, axis=0, pad_value=0).unsqueeze(0)
-                    # max_len = 0
-                    # for i in range(0, len(batch_phones)):
-                    #     max_len = max(max_len, batch_phones[i].shape[-1])
-                    # batch_phones = self.batch_sequences(batch_phones, axis=0, pad_value=0, max_length=max_len)
-                    # batch_phones = batch_phones.to(self.configs.device)
-                    # batch_audio_fragment = (self.vits_model.batched_decode(
-                    #         pred_semantic, pred_semantic_len, batch_phones, batch_phones_len,refer_audio_spec
-                    #     ))
-                    print(f"############ {i18n('合成音频')} ############")
-                    if not self.configs.use_vocoder:
-                        if speed_factor == 1.0:
-                            print(f"{i18n('并行合成中')}...")
-                            # ## vits并行推理 method 2
-                            pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
-                            upsample_rate = math.prod(self.vits_model.upsample_rates)
-                            audio_frag_idx = [
-                                pred_semantic_list[i].shape[0] * 2 * upsample_rate
-                                for i in range(0, len(pred_semantic_list))
-                            ]
-                            audio_frag_end_idx = [sum(audio_frag_idx[: i + 1]) for i in range(0, len(audio_frag_idx))]
-                            all_pred_semantic = (
-                                torch.cat(pred_semantic_list).unsqueeze(0).unsqueeze(0).to(self.configs.device)
-                            )
-                            _batch_phones = torch.cat(batch_phones).unsqueeze(0).to(self.configs.device)
+                print(f"############ {i18n('预测语义Token')} ############")
+                pred_semantic_list, idx_list = infer_panel(
+                    all_phoneme_ids,
+                    all_phoneme_lens,
+                    prompt,
+                    all_bert_features,
+                    # prompt_phone_len=ph_offset,
+                    top_k=top_k,
+                    top_p=top_p,
+                    temperature=temperature,
+                    early_stop_num=self.configs.hz * self.configs.max_sec,
+                    max_len=max_len,
+                    prompt_prefix=t2s_prompt_prefix,
+                    repetition_penalty=repetition_penalty,
+                )
+                t4 = time.perf_counter()
+                t_34 += t4 - t3
+                # 无参考文本时 idx 都是 0，整个 y 就是生成的 token；跑到步数上限 / early stop 的句子不参与学习
+                num_tokens = [
+                    int(item.shape[-1]) if no_prompt_text else int(idx)
+                    for item, idx in zip(pred_semantic_list, idx_list)
+                ]
+                self.segment_cost.update(
+                    batch_phones_len.tolist(),
+                    norm_text,
+                    num_tokens,
+                    max_tokens=min(self.configs.hz * self.configs.max_sec, 1500 - 1),
+                )
 
-                            _batch_audio_fragment = self.vits_model.decode(
-                                    all_pred_semantic, _batch_phones, refer_audio_spec, speed=speed_factor, sv_emb=sv_emb
-                                ).detach()[0, 0, :]
 
-                            audio_frag_end_idx.insert(0, 0)
-                            batch_audio_fragment = [
-                                _batch_audio_fragment[audio_frag_end_idx[i - 1] : audio_frag_end_idx[i]]
-                                for i in range(1, len(audio_frag_end_idx))
-                            ]
-                        else:
-                            # ## vits串行推理
-                            for i, idx in enumerate(tqdm(idx_list)):
-                                phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
-                                _pred_semantic = (
-                                    pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
-                                )  # .unsqueeze(0)#mq要多unsqueeze一次
-                                audio_fragment = self.vits_model.decode(
-                                        _pred_semantic, phones, refer_audio_spec, speed=speed_factor, sv_emb=sv_emb
-                                    ).detach()[0, 0, :]
-                                batch_audio_fragment.append(audio_fragment)  ###试试重建不带上prompt部分
+                batch_audio_fragment = []
+
+                # ## vits并行推理 method 1
+                # pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
+                # pred_semantic_len = torch.LongTensor([item.shape[0] for item in pred_semantic_list]).to(self.configs.device)
+                # pred_semantic = self.batch_sequences(pred_semantic_list, axis=0, pad_value=0).unsqueeze(0)
+                # max_len = 0
+                # for i in range(0, len(batch_phones)):
+                #     max_len = max(max_len, batch_phones[i].shape[-1])
+                # batch_phones = self.batch_sequences(batch_phones, axis=0, pad_value=0, max_length=max_len)
+                # batch_phones = batch_phones.to(self.configs.device)
+                # batch_audio_fragment = (self.vits_model.batched_decode(
+                #         pred_semantic, pred_semantic_len, batch_phones, batch_phones_len,refer_audio_spec
+                #     ))
+                print(f"############ {i18n('合成音频')} ############")
+                if not self.configs.use_vocoder:
+                    if speed_factor == 1.0:
+                        print(f"{i18n('并行合成中')}...")
+                        # ## vits并行推理 method 2
+                        pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
+                        upsample_rate = math.prod(self.vits_model.upsample_rates)
+                        audio_frag_idx = [
+                            pred_semantic_list[i].shape[0] * 2 * upsample_rate
+                            for i in range(0, len(pred_semantic_list))
+                        ]
+                        audio_frag_end_idx = [sum(audio_frag_idx[: i + 1]) for i in range(0, len(audio_frag_idx))]
+                        all_pred_semantic = (
+                            torch.cat(pred_semantic_list).unsqueeze(0).unsqueeze(0).to(self.configs.device)
+                        )
+                        _batch_phones = torch.cat(batch_phones).unsqueeze(0).to(self.configs.device)
+
+                        _batch_audio_fragment = self._vits_decode(
+                                all_pred_semantic,
+                                _batch_phones,
+                                refer_audio_spec,
+                                speed_factor,
+                                sv_emb,
+                                speaker_condition,
+                            ).detach()[0, 0, :]
+
+                        audio_frag_end_idx.insert(0, 0)
+                        batch_audio_fragment = [
+                            _batch_audio_fragment[audio_frag_end_idx[i - 1] : audio_frag_end_idx[i]]
+                            for i in range(1, len(audio_frag_end_idx))
+                        ]
                     else:
-                        if parallel_infer:
-                            print(f"{i18n('并行合成中')}...")
-                            audio_fragments = self.using_vocoder_synthesis_batched_infer(
-                                idx_list, pred_semantic_list, batch_phones, speed=speed_factor, sample_steps=sample_steps
-                            )
-                            batch_audio_fragment.extend(audio_fragments)
-                        else:
-                            for i, idx in enumerate(tqdm(idx_list)):
-                                phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
-                                _pred_semantic = (
-                                    pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
-                                )  # .unsqueeze(0)#mq要多unsqueeze一次
-                                audio_fragment = self.using_vocoder_synthesis(
-                                    _pred_semantic, phones, speed=speed_factor, sample_steps=sample_steps
-                                )
-                                batch_audio_fragment.append(audio_fragment)
-
+                        # ## vits串行推理
+                        for i, idx in enumerate(tqdm(idx_list)):
+                            phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
+                            _pred_semantic = (
+                                pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
+                            )  # .unsqueeze(0)#mq要多unsqueeze一次
+                            audio_fragment = self._vits_decode(
+                                    _pred_semantic,
+                                    phones,
+                                    refer_audio_spec,
+                                    speed_factor,
+                                    sv_emb,
+                                    speaker_condition,
+                                ).detach()[0, 0, :]
+                            batch_audio_fragment.append(audio_fragment)  ###试试重建不带上prompt部分
                 else:
-                    # refer_audio_spec: torch.Tensor = [
-                    #     item.to(dtype=self.precision, device=self.configs.device)
-                    #     for item in self.prompt_cache["refer_spec"]
-                    # ]
-                    semantic_token_generator =self.t2s_model.model.infer_panel(
-                        all_phoneme_ids[0].unsqueeze(0),
-                        all_phoneme_lens,
-                        prompt,
-                        all_bert_features[0].unsqueeze(0),
-                        top_k=top_k,
-                        top_p=top_p,
-                        temperature=temperature,
-                        early_stop_num=self.configs.hz * self.configs.max_sec,
-                        max_len=max_len,
-                        repetition_penalty=repetition_penalty,
-                        streaming_mode=True,
-                        chunk_length=min_chunk_length,
-                        mute_emb_sim_matrix=self.configs.mute_emb_sim_matrix if not fixed_length_chunk else None,
-                        chunk_split_thershold=chunk_split_thershold,
-                    )
-                    t4 = time.perf_counter()
-                    t_34 += t4 - t3
-                    phones = batch_phones[0].unsqueeze(0).to(self.configs.device)
-                    is_first_chunk = True
-
-                    if not self.configs.use_vocoder:
-                        # if speed_factor == 1.0:
-                        #     upsample_rate = math.prod(self.vits_model.upsample_rates)*(2 if self.vits_model.semantic_frame_rate == "25hz" else 1)
-                        # else:
-                        upsample_rate = math.prod(self.vits_model.upsample_rates)*((2 if self.vits_model.semantic_frame_rate == "25hz" else 1)/speed_factor)
+                    if parallel_infer:
+                        print(f"{i18n('并行合成中')}...")
+                        audio_fragments = self.using_vocoder_synthesis_batched_infer(
+                            idx_list,
+                            pred_semantic_list,
+                            batch_phones,
+                            speed=speed_factor,
+                            sample_steps=sample_steps,
+                            prompt_cache=prompt_cache,
+                            cfm_options=cfm_options,
+                        )
+                        batch_audio_fragment.extend(audio_fragments)
+                    elif cfm_batch_size != 1:
+                        # 各句逐 chunk 推理，但每一轮把各句的下一个 chunk 拼成一个 batch
+                        audio_fragments = self.using_vocoder_synthesis_chunk_batched(
+                            idx_list,
+                            pred_semantic_list,
+                            batch_phones,
+                            speed=speed_factor,
+                            sample_steps=sample_steps,
+                            prompt_cache=prompt_cache,
+                            max_batch_size=cfm_batch_size,
+                            cfm_options=cfm_options,
+                        )
+                        batch_audio_fragment.extend(audio_fragments)
                     else:
-                        # if speed_factor == 1.0:
-                        #     upsample_rate = self.vocoder_configs["upsample_rate"]*(3.875 if self.configs.version == "v3" else 4)
-                        # else:
-                        upsample_rate = self.vocoder_configs["upsample_rate"]*((3.875 if self.configs.version == "v3" else 4)/speed_factor)
-
-                    last_audio_chunk = None
-                    # last_tokens = None
-                    last_latent = None
-                    previous_tokens = []
-                    overlap_len = overlap_length
-                    overlap_size = math.ceil(overlap_length*upsample_rate)
-                    for semantic_tokens, is_final in semantic_token_generator:
-                        if semantic_tokens is None and last_audio_chunk is not None:
-                            yield self.audio_postprocess(
-                                    [[last_audio_chunk[-overlap_size:]]],
-                                    output_sr,
-                                    None,
-                                    speed_factor,
-                                    False,
-                                    0.0,
-                                    super_sampling if self.configs.use_vocoder and self.configs.version == "v3" else False,
-                                )
-                            break
-
-                        _semantic_tokens = semantic_tokens
-                        print(f"semantic_tokens shape:{semantic_tokens.shape}")
-
-                        previous_tokens.append(semantic_tokens)
-
-                        _semantic_tokens = torch.cat(previous_tokens, dim=-1)
-
-                        if not is_first_chunk and semantic_tokens.shape[-1] < 10:
-                            overlap_len = overlap_length+(10-semantic_tokens.shape[-1])
-                        else:
-                            overlap_len = overlap_length
-
-
-                        if not self.configs.use_vocoder:
-                            token_padding_length = 0
-                            # token_padding_length = int(phones.shape[-1]*2)-_semantic_tokens.shape[-1]
-                            # if token_padding_length>0:
-                            #     _semantic_tokens = F.pad(_semantic_tokens, (0, token_padding_length), "constant", 486)
-                            # else:
-                            #     token_padding_length = 0
-
-                            audio_chunk, latent, latent_mask = self.vits_model.decode_streaming(
-                                                    _semantic_tokens.unsqueeze(0), 
-                                                    phones, refer_audio_spec, 
-                                                    speed=speed_factor,
-                                                    sv_emb=sv_emb,
-                                                    result_length=semantic_tokens.shape[-1]+overlap_len if not is_first_chunk else None,
-                                                    overlap_frames=last_latent[:,:,-overlap_len*(2 if self.vits_model.semantic_frame_rate == "25hz" else 1):] \
-                                                    if last_latent is not None else None,
-                                                    padding_length=token_padding_length
-                                                )
-                            audio_chunk=audio_chunk.detach()[0, 0, :]
-                        else:
-                            raise RuntimeError(i18n("SoVits V3/4模型不支持流式推理模式"))
-                        
-                        if overlap_len>overlap_length:
-                            audio_chunk=audio_chunk[-int((overlap_length+semantic_tokens.shape[-1])*upsample_rate):]
-
-                        audio_chunk_ = audio_chunk
-                        if is_first_chunk and not is_final:
-                            is_first_chunk = False
-                            audio_chunk_ = audio_chunk_[:-overlap_size]
-                        elif is_first_chunk and is_final: 
-                            is_first_chunk = False
-                        elif not is_first_chunk and not is_final:
-                            audio_chunk_ = self.sola_algorithm([last_audio_chunk, audio_chunk_], overlap_size)
-                            audio_chunk_ = (
-                                audio_chunk_[last_audio_chunk.shape[0]-overlap_size:-overlap_size] if not is_final \
-                                    else audio_chunk_[last_audio_chunk.shape[0]-overlap_size:]
-                                    )
-
-                        last_latent = latent
-                        last_audio_chunk = audio_chunk
-                        yield self.audio_postprocess(
-                                [[audio_chunk_]],
-                                output_sr,
-                                None,
-                                speed_factor,
-                                False,
-                                0.0,
-                                super_sampling if self.configs.use_vocoder and self.configs.version == "v3" else False,
+                        for i, idx in enumerate(tqdm(idx_list)):
+                            phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
+                            _pred_semantic = (
+                                pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
+                            )  # .unsqueeze(0)#mq要多unsqueeze一次
+                            audio_fragment = self.using_vocoder_synthesis(
+                                _pred_semantic,
+                                phones,
+                                speed=speed_factor,
+                                sample_steps=sample_steps,
+                                prompt_cache=prompt_cache,
+                                cfm_options=cfm_options,
                             )
-                        
-                        if is_first_package: 
-                            print(f"first_package_delay: {time.perf_counter()-t0:.3f}")
-                            is_first_package = False
-
-
-                    yield output_sr, np.zeros(int(output_sr*fragment_interval), dtype=np.int16)
+                            batch_audio_fragment.append(audio_fragment)
 
                 t5 = time.perf_counter()
                 t_45 += t5 - t4
@@ -1485,12 +1803,11 @@ class TTS:
                         [batch_audio_fragment],
                         output_sr,
                         None,
-                        speed_factor,
+                        stretch_factor,
                         False,
                         fragment_interval,
                         super_sampling if self.configs.use_vocoder and self.configs.version == "v3" else False,
                     )
-                elif streaming_mode:...
                 else:
                     audio.append(batch_audio_fragment)
 
@@ -1498,16 +1815,30 @@ class TTS:
                     yield output_sr, np.zeros(int(output_sr), dtype=np.int16)
                     return
 
-            if not (return_fragment or streaming_mode):
+            if not return_fragment:
                 print("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t_34, t_45))
                 if len(audio) == 0:
                     yield output_sr, np.zeros(int(output_sr), dtype=np.int16)
                     return
+                if multi_text:
+                    for item in self.audio_postprocess_grouped(
+                        audio,
+                        output_sr,
+                        batch_index_list,
+                        text_owners,
+                        len(text),
+                        stretch_factor,
+                        split_bucket,
+                        fragment_interval,
+                        super_sampling if self.configs.use_vocoder and self.configs.version == "v3" else False,
+                    ):
+                        yield item
+                    return
                 yield self.audio_postprocess(
                     audio,
                     output_sr,
                     batch_index_list,
-                    speed_factor,
+                    stretch_factor,
                     split_bucket,
                     fragment_interval,
                     super_sampling if self.configs.use_vocoder and self.configs.version == "v3" else False,
@@ -1515,15 +1846,14 @@ class TTS:
 
         except Exception as e:
             traceback.print_exc()
-            # 必须返回一个空音频, 否则会导致显存不释放。
-            yield 16000, np.zeros(int(16000), dtype=np.int16)
-            # 重置模型, 否则会导致显存释放不完全。
-            del self.t2s_model
-            del self.vits_model
-            self.t2s_model = None
-            self.vits_model = None
-            self.init_t2s_weights(self.configs.t2s_weights_path)
-            self.init_vits_weights(self.configs.vits_weights_path)
+            if self.reset_on_error:
+                # 重置模型, 否则会导致显存释放不完全。
+                del self.t2s_model
+                del self.vits_model
+                self.t2s_model = None
+                self.vits_model = None
+                self.init_t2s_weights(self.configs.t2s_weights_path)
+                self.init_vits_weights(self.configs.vits_weights_path)
             raise e
         finally:
             self.empty_cache()
@@ -1578,39 +1908,75 @@ class TTS:
                 max_audio = np.abs(audio).max()
                 if max_audio > 1:
                     audio /= max_audio
-            audio = (audio * 32768).astype(np.int16)
             t2 = time.perf_counter()
             print(f"超采样用时：{t2 - t1:.3f}s")
-        else:
+
+        if isinstance(audio, torch.Tensor):
             # audio = audio.float() * 32768
             # audio = audio.to(dtype=torch.int16).clamp(-32768, 32767).cpu().numpy()
 
-            audio = audio.cpu().numpy()
-
-        audio = (audio * 32768).astype(np.int16)
+            audio = audio.float().cpu().numpy()
 
+        if speed_factor != 1.0:
+            # speed_method="time_stretch"：在量化成 int16 之前变速
+            audio = time_stretch(audio, speed_factor, int(sr))
 
-        # try:
-        #     if speed_factor != 1.0:
-        #         audio = speed_change(audio, speed=speed_factor, sr=int(sr))
-        # except Exception as e:
-        #     print(f"Failed to change speed of audio: \n{e}")
+        audio = (audio * 32768).astype(np.int16)
 
         return sr, audio
 
-    def using_vocoder_synthesis(
-        self, semantic_tokens: torch.Tensor, phones: torch.Tensor, speed: float = 1.0, sample_steps: int = 32
+    def audio_postprocess_grouped(
+        self,
+        audio: List[List[torch.Tensor]],
+        sr: int,
+        batch_index_list: list,
+        text_owners: list,
+        num_texts: int,
+        speed_factor: float = 1.0,
+        split_bucket: bool = True,
+        fragment_interval: float = 0.3,
+        super_sampling: bool = False,
     ):
-        prompt_semantic_tokens = self.prompt_cache["prompt_semantic"].unsqueeze(0).unsqueeze(0).to(self.configs.device)
-        prompt_phones = torch.LongTensor(self.prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
-        raw_entry = self.prompt_cache["refer_spec"][0]
+        """
+        Split the fragments of a multi-text run back into one audio per text.
+
+        Yields:
+            Tuple[int, np.ndarray]: sampling rate and audio data of each text, in input order.
+        """
+        if split_bucket:
+            fragments = self.recovery_order(audio, batch_index_list)
+        else:
+            fragments = sum(audio, [])
+
+        groups = [[] for _ in range(num_texts)]
+        for owner, fragment in zip(text_owners, fragments):
+            groups[owner].append(fragment)
+
+        for group in groups:
+            if len(group) == 0:
+                yield sr, np.zeros(int(sr), dtype=np.int16)
+                continue
+            yield self.audio_postprocess(
+                [group], sr, None, speed_factor, False, fragment_interval, super_sampling
+            )
+
+    def _prepare_vocoder_reference(self, prompt_cache: dict = None):
+        """
+        Reference conditioning of the v3/v4 CFM: returns refer_audio_spec, the reference
+        features fea_ref and their mel mel2 (the prompt of the first chunk, T_min frames), ge,
+        T_min and chunk_len, the number of new frames per CFM chunk.
+        """
+        prompt_cache = self.prompt_cache if prompt_cache is None else prompt_cache
+        prompt_semantic_tokens = prompt_cache["prompt_semantic"].unsqueeze(0).unsqueeze(0).to(self.configs.device)
+        prompt_phones = torch.LongTensor(prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
+        raw_entry = prompt_cache["refer_spec"][0]
         if isinstance(raw_entry, tuple):
             raw_entry = raw_entry[0]
         refer_audio_spec = raw_entry.to(dtype=self.precision, device=self.configs.device)
 
         fea_ref, ge = self.vits_model.decode_encp(prompt_semantic_tokens, prompt_phones, refer_audio_spec)
-        ref_audio: torch.Tensor = self.prompt_cache["raw_audio"]
-        ref_sr = self.prompt_cache["raw_sr"]
+        ref_audio: torch.Tensor = prompt_cache["raw_audio"]
+        ref_sr = prompt_cache["raw_sr"]
         ref_audio = ref_audio.to(self.configs.device).float()
         if ref_audio.shape[0] == 2:
             ref_audio = ref_audio.mean(0).unsqueeze(0)
@@ -1634,6 +2000,18 @@ class TTS:
         chunk_len = T_chunk - T_min
 
         mel2 = mel2.to(self.precision)
+        return refer_audio_spec, fea_ref, ge, mel2, T_min, chunk_len
+
+    def using_vocoder_synthesis(
+        self,
+        semantic_tokens: torch.Tensor,
+        phones: torch.Tensor,
+        speed: float = 1.0,
+        sample_steps: int = 32,
+        prompt_cache: dict = None,
+        cfm_options: dict = None,
+    ):
+        refer_audio_spec, fea_ref, ge, mel2, T_min, chunk_len = self._prepare_vocoder_reference(prompt_cache)
         fea_todo, ge = self.vits_model.decode_encp(semantic_tokens, phones, refer_audio_spec, ge, speed)
 
         cfm_resss = []
@@ -1646,7 +2024,12 @@ class TTS:
             fea = torch.cat([fea_ref, fea_todo_chunk], 2).transpose(2, 1)
 
             cfm_res = self.vits_model.cfm.inference(
-                fea, torch.LongTensor([fea.size(1)]).to(fea.device), mel2, sample_steps, inference_cfg_rate=0
+                fea,
+                torch.LongTensor([fea.size(1)]).to(fea.device),
+                mel2,
+                sample_steps,
+                inference_cfg_rate=0,
+                **(cfm_options or {}),
             )
             cfm_res = cfm_res[:, :, mel2.shape[2] :]
 
@@ -1663,47 +2046,85 @@ class TTS:
 
         return audio
 
-    def using_vocoder_synthesis_batched_infer(
+    def using_vocoder_synthesis_chunk_batched(
         self,
         idx_list: List[int],
         semantic_tokens_list: List[torch.Tensor],
         batch_phones: List[torch.Tensor],
         speed: float = 1.0,
         sample_steps: int = 32,
+        prompt_cache: dict = None,
+        max_batch_size: int = 0,
+        cfm_options: dict = None,
     ) -> List[torch.Tensor]:
-        prompt_semantic_tokens = self.prompt_cache["prompt_semantic"].unsqueeze(0).unsqueeze(0).to(self.configs.device)
-        prompt_phones = torch.LongTensor(self.prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
-        raw_entry = self.prompt_cache["refer_spec"][0]
-        if isinstance(raw_entry, tuple):
-            raw_entry = raw_entry[0]
-        refer_audio_spec = raw_entry.to(dtype=self.precision, device=self.configs.device)
+        """
+        using_vocoder_synthesis for several sentences at once. Every chunk is still conditioned on
+        the mel tail of the previous chunk of its own sentence, but each round takes the next
+        chunk of every unfinished sentence and runs the chunks of equal length as one
+        CFM.inference batch, so the sample_steps DiT evaluations run once per round instead of
+        once per chunk.
+
+        With max_batch_size > 0 a round takes at most that many sentences, those with the most
+        frames left first, so chunk N + 1 of one sentence can share a batch with chunk N of another.
+        """
+        refer_audio_spec, fea_ref, ge, mel2, T_min, chunk_len = self._prepare_vocoder_reference(prompt_cache)
 
-        fea_ref, ge = self.vits_model.decode_encp(prompt_semantic_tokens, prompt_phones, refer_audio_spec)
-        ref_audio: torch.Tensor = self.prompt_cache["raw_audio"]
-        ref_sr = self.prompt_cache["raw_sr"]
-        ref_audio = ref_audio.to(self.configs.device).float()
-        if ref_audio.shape[0] == 2:
-            ref_audio = ref_audio.mean(0).unsqueeze(0)
+        sentences = []
+        for i, idx in enumerate(idx_list):
+            phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
+            semantic_tokens = semantic_tokens_list[i][-idx:].unsqueeze(0).unsqueeze(0)
+            fea_todo, _ = self.vits_model.decode_encp(semantic_tokens, phones, refer_audio_spec, ge, speed)
+            sentences.append({"fea_todo": fea_todo, "pos": 0, "fea_ref": fea_ref, "mel2": mel2, "cfm_res": []})
+
+        pending = [sentence for sentence in sentences if sentence["fea_todo"].shape[-1] > 0]
+        while len(pending) > 0:
+            pending.sort(key=lambda sentence: sentence["fea_todo"].shape[-1] - sentence["pos"], reverse=True)
+            groups = {}
+            for sentence in pending[:max_batch_size] if max_batch_size > 0 else pending:
+                sentence["chunk"] = sentence["fea_todo"][:, :, sentence["pos"] : sentence["pos"] + chunk_len]
+                # 不同长度的 chunk 不拼 batch：右侧补零会经 DiT 的卷积位置编码影响结果
+                key = (sentence["chunk"].shape[-1], sentence["mel2"].shape[-1])
+                groups.setdefault(key, []).append(sentence)
+
+            for group in groups.values():
+                fea = torch.cat([torch.cat([s["fea_ref"], s["chunk"]], 2) for s in group], 0).transpose(2, 1)
+                prompt = torch.cat([s["mel2"] for s in group], 0)
+                cfm_res = self.vits_model.cfm.inference(
+                    fea,
+                    torch.LongTensor([fea.size(1)]).to(fea.device),
+                    prompt,
+                    sample_steps,
+                    inference_cfg_rate=0,
+                    **(cfm_options or {}),
+                )
+                cfm_res = cfm_res[:, :, prompt.shape[2] :]
+                for i, sentence in enumerate(group):
+                    sentence["cfm_res"].append(cfm_res[i : i + 1])
+                    sentence["mel2"] = cfm_res[i : i + 1, :, -T_min:]
+                    sentence["fea_ref"] = sentence["chunk"][:, :, -T_min:]
+                    sentence["pos"] += chunk_len
 
-        # tgt_sr = self.vocoder_configs["sr"]
-        tgt_sr = 24000 if self.configs.version == "v3" else 32000
-        if ref_sr != tgt_sr:
-            ref_audio = resample(ref_audio, ref_sr, tgt_sr, self.configs.device)
+            pending = [sentence for sentence in pending if sentence["pos"] < sentence["fea_todo"].shape[-1]]
 
-        mel2 = mel_fn(ref_audio) if self.configs.version == "v3" else mel_fn_v4(ref_audio)
-        mel2 = norm_spec(mel2)
-        T_min = min(mel2.shape[2], fea_ref.shape[2])
-        mel2 = mel2[:, :, :T_min]
-        fea_ref = fea_ref[:, :, :T_min]
-        T_ref = self.vocoder_configs["T_ref"]
-        T_chunk = self.vocoder_configs["T_chunk"]
-        if T_min > T_ref:
-            mel2 = mel2[:, :, -T_ref:]
-            fea_ref = fea_ref[:, :, -T_ref:]
-            T_min = T_ref
-        chunk_len = T_chunk - T_min
+        audio_fragments = []
+        for sentence in sentences:
+            cfm_res = denorm_spec(torch.cat(sentence["cfm_res"], 2))
+            with torch.inference_mode():
+                wav_gen = self.vocoder(cfm_res)
+            audio_fragments.append(wav_gen[0][0])
+        return audio_fragments
 
-        mel2 = mel2.to(self.precision)
+    def using_vocoder_synthesis_batched_infer(
+        self,
+        idx_list: List[int],
+        semantic_tokens_list: List[torch.Tensor],
+        batch_phones: List[torch.Tensor],
+        speed: float = 1.0,
+        sample_steps: int = 32,
+        prompt_cache: dict = None,
+        cfm_options: dict = None,
+    ) -> List[torch.Tensor]:
+        refer_audio_spec, fea_ref, ge, mel2, T_min, chunk_len = self._prepare_vocoder_reference(prompt_cache)
 
         # #### batched inference
         overlapped_len = self.vocoder_configs["overlapped_len"]
@@ -1745,7 +2166,12 @@ class TTS:
         fea_ref = fea_ref.repeat(bs, 1, 1)
         fea = torch.cat([fea_ref, feat_chunks], 2).transpose(2, 1)
         pred_spec = self.vits_model.cfm.inference(
-            fea, torch.LongTensor([fea.size(1)]).to(fea.device), mel2, sample_steps, inference_cfg_rate=0
+            fea,
+            torch.LongTensor([fea.size(1)]).to(fea.device),
+            mel2,
+            sample_steps,
+            inference_cfg_rate=0,
+            **(cfm_options or {}),
         )
         pred_spec = pred_spec[:, :, -chunk_len:]
         dd = pred_spec.shape[1]
@@ -1778,6 +2204,44 @@ class TTS:
 
         return audio_fragments
 
+    def _prefetch(self, generator):
+        """
+        Run `generator` in a background thread and yield its items, so the producer keeps
+        going while the caller works on the previous item. Exceptions of the producer are
+        raised here; closing the returned generator stops and joins the producer.
+        """
+        items = queue.Queue()
+        stop = threading.Event()
+
+        def produce():
+            error = None
+            try:
+                # no_grad 是线程局部的
+                with torch.no_grad():
+                    for item in generator:
+                        if stop.is_set():
+                            break
+                        items.put((False, item))
+            except BaseException as e:
+                error = e
+            finally:
+                generator.close()
+                items.put((True, error))
+
+        thread = threading.Thread(target=produce, name="tts_stream_producer", daemon=True)
+        thread.start()
+        try:
+            while True:
+                finished, value = items.get()
+                if finished:
+                    if value is not None:
+                        raise value
+                    return
+                yield value
+        finally:
+            stop.set()
+            thread.join()
+
     def sola_algorithm(
         self,
         audio_fragments: List[torch.Tensor],
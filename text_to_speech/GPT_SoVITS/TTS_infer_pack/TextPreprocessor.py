@@ -2,22 +2,20 @@ import os
 import sys
 import threading
 
-from tqdm import tqdm
-
 now_dir = os.getcwd()
 sys.path.append(now_dir)
 
 import re
 import torch
 from ..text.LangSegmenter import LangSegmenter
-from ..text import chinese
 from typing import Dict, List, Tuple
-from ..text.cleaner import clean_text
+from ..text.cleaner import clean_text, preload as preload_language_frontends
 from ..text import cleaned_text_to_sequence
 from transformers import AutoModelForMaskedLM, AutoTokenizer
+from ..frontend_cache import FrontendCache
 from .text_segmentation_method import split_big_text, splits, get_method as get_seg_method
 
-from ...tools.i18n.i18n import I18nAuto, scan_language_list
+from tools.i18n.i18n import I18nAuto, scan_language_list
 
 language = os.environ.get("language", "Auto")
 language = sys.argv[-1] if sys.argv[-1] in scan_language_list() else language
@@ -50,20 +48,53 @@ def merge_short_text_in_array(texts: str, threshold: int) -> list:
 
 
 class TextPreprocessor:
-    def __init__(self, bert_model: AutoModelForMaskedLM, tokenizer: AutoTokenizer, device: torch.device):
+    def __init__(
+        self,
+        bert_model: AutoModelForMaskedLM,
+        tokenizer: AutoTokenizer,
+        device: torch.device,
+        bert_batch_size: int = 16,
+        frontend_cache: FrontendCache = None,
+    ):
         self.bert_model = bert_model
         self.tokenizer = tokenizer
         self.device = device
+        self.bert_batch_size = bert_batch_size  # 一次 BERT 前向的最大句数
+        self.frontend_cache: FrontendCache = frontend_cache
+        self.ort_backend = None  # OrtBackend with bert.onnx, see TTS.enable_ort_backend
         self.bert_lock = threading.RLock()
 
+    def preload(self, languages: List[str], version: str = "v2"):
+        """
+        Load the language splitter and the g2p frontends of `languages` (e.g. ["all_zh"]) now.
+        Frontends are otherwise imported on first use, so languages that never occur are never loaded.
+        """
+        LangSegmenter.preload()
+        preload_language_frontends(languages, version)
+
     def preprocess(self, text: str, lang: str, text_split_method: str, version: str = "v2") -> List[Dict]:
+        return self.preprocess_texts([text], lang, text_split_method, version)[0]
+
+    def preprocess_texts(
+        self, texts: List[str], lang: str, text_split_method: str, version: str = "v2"
+    ) -> Tuple[List[Dict], List[int]]:
+        """
+        Preprocess several texts with one batched BERT pass over all of their segments.
+        Returns the segment list and, for each segment, the index of the text it came from.
+        """
         print(f"############ {i18n('切分文本')} ############")
-        text = self.replace_consecutive_punctuation(text)
-        texts = self.pre_seg_text(text, lang, text_split_method)
+        segments = []
+        owners = []
+        for text_idx, text in enumerate(texts):
+            text = self.replace_consecutive_punctuation(text)
+            _segments = self.pre_seg_text(text, lang, text_split_method)
+            segments.extend(_segments)
+            owners.extend([text_idx] * len(_segments))
         result = []
+        result_owners = []
         print(f"############ {i18n('提取文本Bert特征')} ############")
-        for text in tqdm(texts):
-            phones, bert_features, norm_text = self.segment_and_extract_feature_for_text(text, lang, version)
+        features = self.segment_and_extract_feature_for_texts(segments, lang, version)
+        for owner, (phones, bert_features, norm_text) in zip(owners, features):
             if phones is None or norm_text == "":
                 continue
             res = {
@@ -72,7 +103,8 @@ class TextPreprocessor:
                 "norm_text": norm_text,
             }
             result.append(res)
-        return result
+            result_owners.append(owner)
+        return result, result_owners
 
     def pre_seg_text(self, text: str, lang: str, text_split_method: str):
         text = text.strip("\n")
@@ -119,89 +151,154 @@ class TextPreprocessor:
     ) -> Tuple[list, torch.Tensor, str]:
         return self.get_phones_and_bert(text, language, version)
 
+    def segment_and_extract_feature_for_texts(
+        self, texts: List[str], language: str, version: str = "v1"
+    ) -> List[Tuple[list, torch.Tensor, str]]:
+        if len(texts) == 0:
+            return []
+        return self.get_phones_and_bert_batch(texts, language, version)
+
     def get_phones_and_bert(self, text: str, language: str, version: str, final: bool = False):
+        return self.get_phones_and_bert_batch([text], language, version)[0]
+
+    def get_phones_and_bert_batch(self, texts: List[str], language: str, version: str) -> List[Tuple[list, torch.Tensor, str]]:
+        """
+        Batched get_phones_and_bert: texts are cleaned one by one, then every zh segment of every
+        text goes through the BERT model in padded batches instead of one forward per segment.
+        """
         with self.bert_lock:
-            text = re.sub(r' {2,}', ' ', text)
-            textlist = []
-            langlist = []
-            if language == "all_zh":
-                for tmp in LangSegmenter.getTexts(text,"zh"):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "all_yue":
-                for tmp in LangSegmenter.getTexts(text,"zh"):
-                    if tmp["lang"] == "zh":
-                        tmp["lang"] = "yue"
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "all_ja":
-                for tmp in LangSegmenter.getTexts(text,"ja"):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "all_ko":
-                for tmp in LangSegmenter.getTexts(text,"ko"):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "en":
-                langlist.append("en")
-                textlist.append(text)
-            elif language == "auto":
-                for tmp in LangSegmenter.getTexts(text):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "auto_yue":
-                for tmp in LangSegmenter.getTexts(text):
-                    if tmp["lang"] == "zh":
-                        tmp["lang"] = "yue"
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            else:
-                for tmp in LangSegmenter.getTexts(text):
-                    if langlist:
-                        if (tmp["lang"] == "en" and langlist[-1] == "en") or (tmp["lang"] != "en" and langlist[-1] != "en"):
-                            textlist[-1] += tmp["text"]
-                            continue
-                    if tmp["lang"] == "en":
-                        langlist.append(tmp["lang"])
+            result = [None] * len(texts)
+            cleaned = {}
+            for i, text in enumerate(texts):
+                if self.frontend_cache is not None:
+                    cached = self.frontend_cache.get_bert(text, language, version)
+                    if cached is not None:
+                        phones, bert, norm_text = cached
+                        result[i] = (list(phones), bert.to(self.device), norm_text)
+                        continue
+                cleaned[i] = self.get_text_segments(text, language, version)
+
+            zh_segments = [
+                (i, j) for i, segments in cleaned.items() for j, segment in enumerate(segments) if segment[3] == "zh"
+            ]
+            features = self.get_bert_feature_batch(
+                [cleaned[i][j][2] for i, j in zh_segments], [cleaned[i][j][1] for i, j in zh_segments]
+            )
+            zh_features = dict(zip(zh_segments, features))
+
+            for i, segments in cleaned.items():
+                bert_list = []
+                for j, (phones, word2ph, norm_text, lang) in enumerate(segments):
+                    if (i, j) in zh_features:
+                        bert_list.append(zh_features[(i, j)].to(self.device))
                     else:
-                        # 因无法区别中日韩文汉字,以用户输入为准
-                        langlist.append(language)
-                    textlist.append(tmp["text"])
-            # print(textlist)
-            # print(langlist)
-            phones_list = []
-            bert_list = []
-            norm_text_list = []
-            for i in range(len(textlist)):
-                lang = langlist[i]
-                phones, word2ph, norm_text = self.clean_text_inf(textlist[i], lang, version)
-                bert = self.get_bert_inf(phones, word2ph, norm_text, lang)
-                phones_list.append(phones)
-                norm_text_list.append(norm_text)
-                bert_list.append(bert)
-            bert = torch.cat(bert_list, dim=1)
-            phones = sum(phones_list, [])
-            norm_text = "".join(norm_text_list)
-
-            if not final and len(phones) < 6:
-                return self.get_phones_and_bert("." + text, language, version, final=True)
-
-            return phones, bert, norm_text
+                        bert_list.append(self.get_bert_inf(phones, word2ph, norm_text, lang))
+                bert = torch.cat(bert_list, dim=1)
+                phones = sum([segment[0] for segment in segments], [])
+                norm_text = "".join([segment[2] for segment in segments])
+                if self.frontend_cache is not None:
+                    self.frontend_cache.put_bert(texts[i], language, version, (list(phones), bert, norm_text))
+                result[i] = (phones, bert, norm_text)
+            return result
+
+    def get_text_segments(self, text: str, language: str, version: str) -> List[tuple]:
+        """clean_text_segments through the frontend cache, when one is set."""
+        if self.frontend_cache is None:
+            return self.clean_text_segments(text, language, version)
+        segments = self.frontend_cache.get(text, language, version)
+        if segments is None:
+            segments = self.frontend_cache.put(text, language, version, self.clean_text_segments(text, language, version))
+        return segments
+
+    def clean_text_segments(self, text: str, language: str, version: str, final: bool = False) -> List[tuple]:
+        """Split text by language and clean each part, returns [(phones, word2ph, norm_text, lang), ...]."""
+        text = re.sub(r' {2,}', ' ', text)
+        textlist = []
+        langlist = []
+        if language == "all_zh":
+            for tmp in LangSegmenter.getTexts(text,"zh"):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "all_yue":
+            for tmp in LangSegmenter.getTexts(text,"zh"):
+                if tmp["lang"] == "zh":
+                    tmp["lang"] = "yue"
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "all_ja":
+            for tmp in LangSegmenter.getTexts(text,"ja"):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "all_ko":
+            for tmp in LangSegmenter.getTexts(text,"ko"):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "en":
+            langlist.append("en")
+            textlist.append(text)
+        elif language == "auto":
+            for tmp in LangSegmenter.getTexts(text):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "auto_yue":
+            for tmp in LangSegmenter.getTexts(text):
+                if tmp["lang"] == "zh":
+                    tmp["lang"] = "yue"
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        else:
+            for tmp in LangSegmenter.getTexts(text):
+                if langlist:
+                    if (tmp["lang"] == "en" and langlist[-1] == "en") or (tmp["lang"] != "en" and langlist[-1] != "en"):
+                        textlist[-1] += tmp["text"]
+                        continue
+                if tmp["lang"] == "en":
+                    langlist.append(tmp["lang"])
+                else:
+                    # 因无法区别中日韩文汉字,以用户输入为准
+                    langlist.append(language)
+                textlist.append(tmp["text"])
+        segments = []
+        for i in range(len(textlist)):
+            lang = langlist[i]
+            phones, word2ph, norm_text = self.clean_text_inf(textlist[i], lang, version)
+            segments.append((phones, word2ph, norm_text, lang.replace("all_", "")))
+
+        if not final and sum(len(segment[0]) for segment in segments) < 6:
+            return self.clean_text_segments("." + text, language, version, final=True)
+
+        return segments
 
     def get_bert_feature(self, text: str, word2ph: list) -> torch.Tensor:
-        with torch.no_grad():
-            inputs = self.tokenizer(text, return_tensors="pt")
-            for i in inputs:
-                inputs[i] = inputs[i].to(self.device)
-            res = self.bert_model(**inputs, output_hidden_states=True)
-            res = torch.cat(res["hidden_states"][-3:-2], -1)[0].cpu()[1:-1]
-        assert len(word2ph) == len(text)
-        phone_level_feature = []
-        for i in range(len(word2ph)):
-            repeat_feature = res[i].repeat(word2ph[i], 1)
-            phone_level_feature.append(repeat_feature)
-        phone_level_feature = torch.cat(phone_level_feature, dim=0)
-        return phone_level_feature.T
+        return self.get_bert_feature_batch([text], [word2ph])[0]
+
+    def get_bert_feature_batch(self, texts: List[str], word2phs: List[list]) -> List[torch.Tensor]:
+        """
+        Run BERT on many texts at once. Texts are sorted by length and padded into batches of
+        bert_batch_size, the hidden states of each sample are mapped back to phones with its word2ph.
+        """
+        features = [None] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), self.bert_batch_size):
+            batch_index = order[start : start + self.bert_batch_size]
+            with torch.no_grad():
+                inputs = self.tokenizer([texts[i] for i in batch_index], return_tensors="pt", padding=True)
+                if self.ort_backend is not None:
+                    res = self.ort_backend.bert(inputs)
+                else:
+                    for i in inputs:
+                        inputs[i] = inputs[i].to(self.device)
+                    res = self.bert_model(**inputs, output_hidden_states=True)
+                    res = torch.cat(res["hidden_states"][-3:-2], -1).cpu()
+                token_lens = inputs["attention_mask"].sum(-1).tolist()
+            for b, i in enumerate(batch_index):
+                word2ph = word2phs[i]
+                assert len(word2ph) == len(texts[i])
+                # 去掉 [CLS]/[SEP] 和右侧 padding
+                hidden = res[b, 1 : token_lens[b] - 1]
+                repeats = torch.tensor(word2ph, dtype=torch.long)
+                features[i] = torch.repeat_interleave(hidden[: len(word2ph)], repeats, dim=0).T
+        return features
 
     def clean_text_inf(self, text: str, language: str, version: str = "v2"):
         language = language.replace("all_", "")
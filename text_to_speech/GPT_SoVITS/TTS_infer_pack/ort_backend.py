@@ -0,0 +1,252 @@
+"""
+ONNX Runtime CPU backend for TTS.
+
+Runs the graphs written by `GPT_SoVITS/export_onnx_backend.py` instead of the PyTorch
+modules: CNHuBERT (ssl.onnx), BERT (bert.onnx), the T2S prefill (t2s_prefill.onnx), the T2S
+decode step (t2s_decode.onnx) and the VITS decoder (vits.onnx). Any graph missing from the
+directory keeps running in PyTorch.
+
+The decode step reads the past keys/values and writes the new position straight into one
+preallocated buffer per request through IOBinding, so the KV cache is never copied or
+concatenated between steps. Sampling runs on the host, with the same rules as
+`AR.models.utils.fused_sample`.
+"""
+
+import os
+from typing import List
+
+import numpy as np
+import onnxruntime as ort
+import torch
+
+GRAPHS = ("ssl", "bert", "t2s_prefill", "t2s_decode", "vits")
+
+
+def cpu_session_options(intra_op_num_threads: int = 0, dynamic_shapes: bool = False) -> ort.SessionOptions:
+    """
+    Session options for CPU serving: full graph optimization, sequential execution (the
+    graphs are a single chain, inter-op threads only add scheduling cost) and spinning
+    intra-op threads, which keeps the per-step latency of the small decode graph low.
+    intra_op_num_threads=0 lets ORT use one thread per physical core.
+    """
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = intra_op_num_threads
+    options.inter_op_num_threads = 1
+    options.enable_cpu_mem_arena = True
+    # 每步形状都在变的图（decode step）用不上内存规划，反而每次重新规划
+    options.enable_mem_pattern = not dynamic_shapes
+    options.add_session_config_entry("session.intra_op.allow_spinning", "1")
+    options.add_session_config_entry("session.set_denormal_as_zero", "1")
+    return options
+
+
+def sample_logits(
+    logits: np.ndarray,
+    counts: np.ndarray = None,
+    top_k: int = None,
+    top_p: float = None,
+    temperature: float = 1.0,
+    repetition_penalty: float = 1.0,
+) -> int:
+    """
+    Numpy version of AR.models.utils.fused_sample for one sequence, logits: [vocab], counts:
+    running number of occurrences of each token (at least vocab entries).
+    """
+    logits = logits.astype(np.float64)
+    if counts is not None and repetition_penalty != 1.0:
+        seen = counts[: logits.shape[-1]] > 0
+        score = logits[seen]
+        logits[seen] = np.where(score < 0, score * repetition_penalty, score / repetition_penalty)
+
+    k = logits.shape[-1] if top_k is None or top_k <= 0 else min(top_k, logits.shape[-1])
+    top_indices = np.argpartition(-logits, k - 1)[:k]
+    top_indices = top_indices[np.argsort(-logits[top_indices], kind="stable")]
+    top_logits = logits[top_indices]
+
+    if top_p is not None and top_p < 1.0:
+        log_norm = logits.max() + np.log(np.exp(logits - logits.max()).sum())
+        cum_probs = np.cumsum(np.exp(top_logits - log_norm))
+        remove = cum_probs > top_p
+        remove[0] = False  # keep at least one option
+        top_logits = np.where(remove, -np.inf, top_logits)
+
+    top_logits = top_logits / max(temperature, 1e-5)
+    probs = np.exp(top_logits - top_logits.max())
+    probs /= probs.sum()
+    # 与 multinomial_sample_one_no_sync 相同：probs / Exp(1) 取 argmax
+    return int(top_indices[np.argmax(probs / np.random.exponential(size=probs.shape))])
+
+
+class OrtBackend:
+    def __init__(self, onnx_dir: str, intra_op_num_threads: int = 0):
+        if not os.path.isdir(onnx_dir):
+            raise FileNotFoundError(f"ONNX directory not found: {onnx_dir}")
+        self.onnx_dir = onnx_dir
+        self.sessions = {}
+        for name in GRAPHS:
+            path = os.path.join(onnx_dir, f"{name}.onnx")
+            if not os.path.exists(path):
+                continue
+            options = cpu_session_options(intra_op_num_threads, dynamic_shapes=name == "t2s_decode")
+            self.sessions[name] = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        if not self.sessions:
+            raise FileNotFoundError(f"no exported graph in {onnx_dir}, run GPT_SoVITS/export_onnx_backend.py first")
+        if self.has("t2s_prefill") != self.has("t2s_decode"):
+            raise FileNotFoundError("t2s_prefill.onnx and t2s_decode.onnx must be exported together")
+
+        if self.has("t2s_decode"):
+            decode = self.sessions["t2s_decode"]
+            k_past = [i for i in decode.get_inputs() if i.name == "k_past"][0]
+            self.num_layers = k_past.shape[1]
+            self.hidden_dim = k_past.shape[3]
+            # EOS 是词表的最后一个 token
+            self.eos = [o for o in decode.get_outputs() if o.name == "logits"][0].shape[-1] - 1
+        print(f"ONNX Runtime backend: {', '.join(self.sessions)} from {onnx_dir}")
+
+    def has(self, name: str) -> bool:
+        return name in self.sessions
+
+    def ssl(self, wav16k: torch.Tensor) -> torch.Tensor:
+        """wav16k: [1, T] -> CNHuBERT features [1, 768, T']"""
+        (feature,) = self.sessions["ssl"].run(None, {"wav16k": wav16k.float().cpu().numpy()})
+        return torch.from_numpy(feature)
+
+    def bert(self, inputs) -> torch.Tensor:
+        """Tokenizer output -> hidden states of the third to last layer, [B, T, 1024]."""
+        feeds = {name: inputs[name].cpu().numpy().astype(np.int64) for name in ("input_ids", "attention_mask", "token_type_ids")}
+        (hidden,) = self.sessions["bert"].run(None, feeds)
+        return torch.from_numpy(hidden)
+
+    def vits_decode(self, codes: torch.Tensor, text: torch.Tensor, speaker_condition) -> torch.Tensor:
+        """Same result as SynthesizerTrn.decode(codes, text, ..., speed=1, speaker_condition=...), [1, 1, T]."""
+        ge, ge_text = speaker_condition
+        (audio,) = self.sessions["vits"].run(
+            None,
+            {
+                "codes": codes.cpu().numpy().astype(np.int64),
+                "text": text.cpu().numpy().astype(np.int64),
+                "ge": ge.float().cpu().numpy(),
+                "ge_text": ge_text.float().cpu().numpy(),
+            },
+        )
+        return torch.from_numpy(audio)
+
+    def infer_panel(
+        self,
+        x: List[torch.LongTensor],
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,
+        bert_feature: List[torch.LongTensor],
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ):
+        """
+        Same inputs and outputs as Text2SemanticDecoder.infer_panel_batch_infer. Sequences are
+        decoded one after another: with batch 1 there is no padding and no mask in the graphs.
+        prompts is None for reference free synthesis: the prefill graph gets an empty prompt and,
+        like the PyTorch decoders, every idx is 0 (the whole of y is the prediction).
+        """
+        y_list = []
+        idx_list = []
+        for i in range(len(x)):
+            y = self.decode_one(
+                x[i].cpu().numpy(),
+                bert_feature[i].float().cpu().numpy(),
+                prompts[i].cpu().numpy() if prompts is not None else np.zeros(0, dtype=np.int64),
+                top_k=top_k,
+                top_p=top_p,
+                early_stop_num=early_stop_num,
+                temperature=temperature,
+                repetition_penalty=repetition_penalty,
+            )
+            y_list.append(torch.from_numpy(y))
+            idx_list.append(len(y) if prompts is not None else 0)
+        return y_list, idx_list
+
+    def decode_one(
+        self,
+        x: np.ndarray,
+        bert_feature: np.ndarray,
+        prompt: np.ndarray,
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+    ) -> np.ndarray:
+        """x: [x_len] phones, bert_feature: [1024, x_len], prompt: [y_len], may be empty -> generated tokens"""
+        prompt = prompt.astype(np.int64)
+        logits, k, v = self.sessions["t2s_prefill"].run(
+            None,
+            {
+                "x": x.astype(np.int64)[None],
+                "bert_feature": bert_feature[None],
+                "prompts": prompt[None],
+            },
+        )
+
+        max_steps = 1500 if early_stop_num == -1 else min(early_stop_num + 1, 1500)
+        length = k.shape[0]
+        # [position, layer, batch, hidden]：新位置在内存里是连续的一块，可以直接绑定为输出
+        k_cache = np.zeros((length + max_steps, self.num_layers, 1, self.hidden_dim), dtype=np.float32)
+        v_cache = np.zeros_like(k_cache)
+        k_cache[:length] = k
+        v_cache[:length] = v
+        logits = logits[0]
+
+        session = self.sessions["t2s_decode"]
+        binding = session.io_binding()
+        step_logits = np.empty((1, logits.shape[-1]), dtype=np.float32)
+        binding.bind_output("logits", "cpu", 0, np.float32, list(step_logits.shape), step_logits.ctypes.data)
+
+        y_len = len(prompt)
+        tokens = list(prompt)
+        counts = np.bincount(prompt, minlength=logits.shape[-1])
+        for idx in range(1500):
+            if idx < 11:  ###至少预测出10个token不然不给停止（0.4s）
+                logits = logits[:-1]
+            token = sample_logits(
+                logits,
+                counts,
+                top_k=top_k,
+                top_p=top_p,
+                temperature=temperature,
+                repetition_penalty=repetition_penalty,
+            )
+            if token == self.eos or int(np.argmax(logits)) == self.eos:
+                break
+            tokens.append(token)
+            counts[token] += 1
+            if early_stop_num != -1 and len(tokens) - y_len > early_stop_num:
+                print("use early stop num:", early_stop_num)
+                break
+            if length >= k_cache.shape[0]:
+                break
+
+            # 绑定的都是 numpy 视图，不拷贝；run 结束前保持引用
+            feeds = {
+                "token": np.array([[token]], dtype=np.int64),
+                "position": np.array([y_len + idx], dtype=np.int64),
+                "k_past": k_cache[:length],
+                "v_past": v_cache[:length],
+            }
+            for name, value in feeds.items():
+                binding.bind_cpu_input(name, value)
+            shape = [1, self.num_layers, 1, self.hidden_dim]
+            binding.bind_output("k_new", "cpu", 0, np.float32, shape, k_cache[length:].ctypes.data)
+            binding.bind_output("v_new", "cpu", 0, np.float32, shape, v_cache[length:].ctypes.data)
+            session.run_with_iobinding(binding)
+            length += 1
+            logits = step_logits[0]
+
+        y = np.asarray(tokens[y_len:], dtype=np.int64)
+        if len(y) == 0:
+            print("bad zero prediction")
+            y = np.zeros(1, dtype=np.int64)
+        return y
@@ -0,0 +1,119 @@
+"""
+Cost model for bucketing text segments into T2S batches.
+
+A segment's T2S cost is its prefill length (prompt + segment phones) plus the number of
+semantic tokens it will generate. The number of semantic tokens is predicted from the phone
+count with a tokens-per-phone rate per script (Han / Latin / kana / Hangul), since speech
+rate per phone differs between languages. The rates start from a prior and are learned
+from finished runs with an exponential moving average.
+
+In a left-padded `infer_panel_batch_infer` batch every row runs for as many steps as its
+longest member, so a batch costs batch size * (longest prefill + longest generation)
+padded tokens; `SegmentCostModel.bucket` keeps that under a token budget.
+"""
+
+import re
+import threading
+from typing import Dict, List
+
+_SCRIPTS = {
+    "han": re.compile(r"[一-鿿]"),
+    "latin": re.compile(r"[A-Za-z]"),
+    "kana": re.compile(r"[぀-ヿ]"),
+    "hangul": re.compile(r"[가-힯]"),
+}
+
+# 每个音素大约 0.09 秒
+SECONDS_PER_PHONE = 0.09
+# 单个样本的语速限制在先验的 [1/4, 4] 倍之内，没停下来的句子不会把速率拉偏
+MAX_RATE_RATIO = 4.0
+
+
+def prior_tokens_per_phone(semantic_frame_rate: str = "25hz") -> float:
+    """Prior tokens-per-phone rate for semantic tokens at `semantic_frame_rate` ("25hz" -> 2.25)."""
+    return int(semantic_frame_rate.lower().rstrip("hz")) * SECONDS_PER_PHONE
+
+
+def script_of(norm_text: str) -> str:
+    """The script most characters of `norm_text` are written in."""
+    counts = {script: len(pattern.findall(norm_text)) for script, pattern in _SCRIPTS.items()}
+    script = max(counts, key=counts.get)
+    return script if counts[script] > 0 else "han"
+
+
+class SegmentCostModel:
+    def __init__(self, tokens_per_phone: float = None, momentum: float = 0.9, semantic_frame_rate: str = "25hz"):
+        if tokens_per_phone is None:
+            tokens_per_phone = prior_tokens_per_phone(semantic_frame_rate)
+        self.default_rate = tokens_per_phone
+        self.momentum = momentum
+        self.rates: Dict[str, float] = {}
+        self.observed: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def predict(self, num_phones: int, norm_text: str) -> int:
+        """Predicted number of semantic tokens for a segment."""
+        rate = self.rates.get(script_of(norm_text), self.default_rate)
+        return int(round(num_phones * rate))
+
+    def update(self, num_phones: List[int], norm_texts: List[str], num_tokens: List[int], max_tokens: int = None):
+        """
+        Learn from the semantic lengths a finished batch actually generated. Segments that ran
+        into `max_tokens` (no EOS before the step limit or early_stop_num) are skipped, and each
+        rate is clamped to MAX_RATE_RATIO times the prior either way. The moving average starts
+        from the prior, so one segment cannot set a script's rate on its own.
+        """
+        low, high = self.default_rate / MAX_RATE_RATIO, self.default_rate * MAX_RATE_RATIO
+        with self.lock:
+            for phones, norm_text, tokens in zip(num_phones, norm_texts, num_tokens):
+                if phones <= 0 or tokens <= 0:
+                    continue
+                if max_tokens is not None and tokens >= max_tokens:
+                    continue
+                script = script_of(norm_text)
+                rate = min(max(tokens / phones, low), high)
+                previous = self.rates.get(script, self.default_rate)
+                self.rates[script] = self.momentum * previous + (1 - self.momentum) * rate
+                self.observed[script] = self.observed.get(script, 0) + 1
+
+    def bucket(
+        self,
+        prefill_lens: List[int],
+        decode_lens: List[int],
+        batch_size: int,
+        threshold: float = 0.75,
+        token_budget: int = 0,
+    ) -> List[List[int]]:
+        """
+        Group segment indices into batches of similar predicted cost.
+
+        Segments are sorted by predicted generation length (then prefill length). Starting
+        from `batch_size`, a batch is shrunk until its median cost is at least `threshold`
+        times its mean cost and, if `token_budget` > 0, its padded token count
+        (size * (max prefill + max generation)) fits the budget. A single segment always
+        makes a batch.
+        """
+        order = sorted(range(len(prefill_lens)), key=lambda i: (decode_lens[i], prefill_lens[i]))
+        batches = []
+        pos = 0
+        while pos < len(order):
+            pos_end = min(pos + batch_size, len(order))
+            while pos_end - pos > 1:
+                index = order[pos:pos_end]
+                costs = [prefill_lens[i] + decode_lens[i] for i in index]
+                score = costs[(pos_end - pos) // 2] / (sum(costs) / len(costs) + 1e-8)
+                padded = len(index) * (max(prefill_lens[i] for i in index) + max(decode_lens[i] for i in index))
+                if score >= threshold and (token_budget <= 0 or padded <= token_budget):
+                    break
+                pos_end -= 1
+            batches.append(order[pos:pos_end])
+            pos = pos_end
+        return batches
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "default_tokens_per_phone": self.default_rate,
+                "tokens_per_phone": {script: round(rate, 3) for script, rate in self.rates.items()},
+                "observed_segments": dict(self.observed),
+            }
@@ -0,0 +1,120 @@
+"""
+In-process WSOLA time-stretch (tempo change without pitch change), replacing the ffmpeg
+`atempo` subprocess.
+
+Output frames of `frame_length` samples are overlap-added with a Hann window every
+`frame_length // 2` samples. Each frame is read from the input around its nominal position
+(output position * speed), shifted by up to `tolerance` samples to the offset that best
+continues the previously copied frame, so the overlaps stay in phase. The offset search is
+one matrix-vector product over all candidate offsets.
+
+TimeStretcher keeps its state between calls and can stretch a stream chunk by chunk;
+`time_stretch` runs it over a whole signal.
+"""
+
+from typing import Union
+
+import numpy as np
+import torch
+
+
+class TimeStretcher:
+    """Stretches a mono float stream by `speed`, chunk by chunk."""
+
+    def __init__(self, speed: float, sr: int, frame_ms: float = 30.0, tolerance_ms: float = 7.5):
+        if speed <= 0:
+            raise ValueError(f"speed must be positive, got {speed}")
+        self.speed = speed
+        self.frame_length = int(sr * frame_ms / 1000) // 2 * 2
+        self.hop = self.frame_length // 2
+        self.tolerance = int(sr * tolerance_ms / 1000)
+        # 周期 Hann 窗，50% 重叠时相加恒为 1
+        self.window = np.hanning(self.frame_length + 1)[:-1].astype(np.float32)
+
+        # 输入缓冲从绝对位置 self.offset 开始；前面补 0，第一帧也能以第 0 个采样为中心并向前搜索
+        self.offset = -(self.hop + self.tolerance)
+        self.buffer = np.zeros(-self.offset, dtype=np.float32)
+        self.input_length = 0
+        self.frame = 0  # 下一个输出帧的序号
+        self.previous = None  # 上一帧在输入中的起点（绝对位置）
+        self.overlap = np.zeros(self.hop, dtype=np.float32)  # 上一帧的后半段，等待与下一帧相加
+        self.output_length = 0
+
+    def process(self, audio: np.ndarray) -> np.ndarray:
+        """Feed input samples, returns the output samples that are final so far."""
+        audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+        self.buffer = np.concatenate([self.buffer, audio])
+        self.input_length += audio.shape[0]
+        return self._run(final=False)
+
+    def flush(self) -> np.ndarray:
+        """End of the input: returns the rest of the output, round(input length / speed) samples in total."""
+        padding = self.frame_length + self.hop + self.tolerance
+        self.buffer = np.concatenate([self.buffer, np.zeros(padding, dtype=np.float32)])
+        # _run 会把自己的输出计入 output_length，总长度要从调用前算起
+        before = self.output_length
+        out = np.concatenate([self._run(final=True), self.overlap])
+        remaining = max(int(round(self.input_length / self.speed)) - before, 0)
+        out = np.pad(out[:remaining], (0, max(remaining - out.shape[0], 0)))
+        self.output_length = before + out.shape[0]
+        self.overlap = np.zeros(self.hop, dtype=np.float32)
+        return out
+
+    def _nominal(self, frame: int) -> int:
+        # 第 frame 帧以输出位置 frame * hop 为中心，对应输入位置 frame * hop * speed
+        return int(round(frame * self.hop * self.speed)) - self.hop
+
+    def _run(self, final: bool) -> np.ndarray:
+        outputs = []
+        end = self.offset + self.buffer.shape[0]
+        while True:
+            nominal = self._nominal(self.frame)
+            if final and nominal >= self.input_length:
+                break
+            needed = nominal + self.tolerance
+            if self.previous is not None:
+                needed = max(needed, self.previous + self.hop)
+            if needed + self.frame_length > end:
+                break  # 等更多输入
+            start = self._align(nominal)
+            frame = self.buffer[start - self.offset : start - self.offset + self.frame_length] * self.window
+            if self.frame > 0:
+                # 输出 [(frame - 1) * hop, frame * hop) 在这一帧之后不再变化
+                outputs.append(self.overlap + frame[: self.hop])
+            self.overlap = frame[self.hop :]
+            self.previous = start
+            self.frame += 1
+
+        if self.previous is not None:
+            # 丢掉之后不会再读到的输入
+            keep_from = min(self.previous + self.hop, self._nominal(self.frame) - self.tolerance)
+            if keep_from > self.offset:
+                self.buffer = self.buffer[keep_from - self.offset :]
+                self.offset = keep_from
+
+        out = np.concatenate(outputs) if outputs else np.zeros(0, dtype=np.float32)
+        self.output_length += out.shape[0]
+        return out
+
+    def _align(self, nominal: int) -> int:
+        """Start of the frame near `nominal` that best continues the previous one."""
+        if self.previous is None:
+            return nominal
+        low = max(nominal - self.tolerance, self.offset)
+        # 上一帧在输入里的自然延续
+        natural = self.previous + self.hop - self.offset
+        reference = self.buffer[natural : natural + self.frame_length]
+        candidates = self.buffer[low - self.offset : nominal + self.tolerance - self.offset + self.frame_length]
+        windows = np.lib.stride_tricks.sliding_window_view(candidates, self.frame_length)
+        return low + int(np.argmax(windows @ reference))
+
+
+def time_stretch(audio: Union[np.ndarray, torch.Tensor], speed: float, sr: int) -> Union[np.ndarray, torch.Tensor]:
+    """Change the tempo of a mono float signal by `speed` (2.0 = twice as fast) without changing the pitch."""
+    if speed == 1.0:
+        return audio
+    if isinstance(audio, torch.Tensor):
+        out = time_stretch(audio.detach().float().cpu().numpy(), speed, sr)
+        return torch.from_numpy(out).to(dtype=audio.dtype, device=audio.device)
+    stretcher = TimeStretcher(speed, sr)
+    return np.concatenate([stretcher.process(audio), stretcher.flush()])
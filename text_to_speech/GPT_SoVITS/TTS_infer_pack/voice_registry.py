@@ -0,0 +1,198 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+from .TTS import TTS, TTS_Config
+
+
+class Voice:
+    """A named voice: its GPT / SoVITS weights and default reference audio."""
+
+    def __init__(
+        self,
+        name: str,
+        t2s_weights_path: str,
+        vits_weights_path: str,
+        ref_audio_path: str,
+        prompt_text: str = "",
+        prompt_lang: str = "all_zh",
+        onnx_dir: str = None,
+    ):
+        self.name = name
+        self.t2s_weights_path = t2s_weights_path
+        self.vits_weights_path = vits_weights_path
+        self.ref_audio_path = ref_audio_path
+        self.prompt_text = prompt_text
+        self.prompt_lang = prompt_lang
+        self.onnx_dir = onnx_dir  # graphs of export_onnx_backend.py, for the ONNX Runtime backend
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "gpt_model": self.t2s_weights_path,
+            "sovits_model": self.vits_weights_path,
+            "reference_audio": self.ref_audio_path,
+            "reference_text": self.prompt_text,
+            "onnx_dir": self.onnx_dir,
+        }
+
+
+class _Resident:
+    def __init__(self, tts: TTS, nbytes: int):
+        self.tts = tts
+        self.nbytes = nbytes
+        self.in_use = 0
+
+
+class VoiceRegistry:
+    """
+    Keeps several voices loaded at once, each as its own TTS instance (GPT + SoVITS weights,
+    prompt cache, T2S scheduler) built on top of `base`, so BERT, CNHuBERT, SV, the vocoder
+    and the text frontend are loaded only once for all voices.
+
+    Voices are loaded on first use. When the GPT + SoVITS weights of the resident voices go
+    over `memory_budget_mb`, the least recently used idle voices are unloaded; a voice that
+    is serving a request is never unloaded, and `base_voice` (whose TTS is `base`) stays
+    resident.
+
+    Usage:
+        with registry.acquire("name") as (tts, voice):
+            list(tts.run({...}))
+    """
+
+    def __init__(
+        self,
+        base: TTS,
+        base_voice: Voice,
+        memory_budget_mb: float = 4096,
+        setup: Callable[[TTS, Voice], None] = None,
+    ):
+        self.base = base
+        self.base_voice = base_voice
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.setup = setup  # setup(tts, voice) on every newly loaded voice, e.g. to enable the T2S scheduler
+        self.voices: Dict[str, Voice] = OrderedDict()
+        self.resident: Dict[str, _Resident] = OrderedDict()
+        self.lock = threading.RLock()
+        self.load_locks: Dict[str, threading.Lock] = {}
+        self.loads = 0
+        self.evictions = 0
+
+        self.voices[base_voice.name] = base_voice
+        self.resident[base_voice.name] = _Resident(base, base.voice_model_bytes())
+
+    def register(self, voice: Voice):
+        # TTS_Config silently falls back to the pretrained weights for a missing path
+        for path in (voice.t2s_weights_path, voice.vits_weights_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"weights of voice {voice.name} not found: {path}")
+        with self.lock:
+            if voice.name == self.base_voice.name:
+                raise ValueError(f"voice {voice.name} is the base voice and cannot be replaced")
+            old = self.voices.get(voice.name)
+            self.voices[voice.name] = voice
+            if old is not None and (
+                old.t2s_weights_path != voice.t2s_weights_path or old.vits_weights_path != voice.vits_weights_path
+            ):
+                self._unload(voice.name)
+
+    def get_voice(self, name: str = None) -> Voice:
+        name = name or self.base_voice.name
+        with self.lock:
+            if name not in self.voices:
+                raise KeyError(f"unknown voice: {name}")
+            return self.voices[name]
+
+    @contextmanager
+    def acquire(self, name: str = None):
+        """Yield (tts, voice) for `name` (default: the base voice), loading it if needed."""
+        voice = self.get_voice(name)
+        resident = self._load(voice)
+        try:
+            yield resident.tts, voice
+        finally:
+            with self.lock:
+                resident.in_use -= 1
+                if resident.in_use == 0 and self.resident.get(voice.name) is not resident:
+                    # unloaded while this request was running
+                    resident.tts.close()
+                self._evict()
+
+    def _load(self, voice: Voice) -> _Resident:
+        with self.lock:
+            resident = self._touch(voice.name)
+            if resident is not None:
+                return resident
+            load_lock = self.load_locks.setdefault(voice.name, threading.Lock())
+
+        # load outside the registry lock, requests for resident voices keep going meanwhile
+        with load_lock:
+            with self.lock:
+                resident = self._touch(voice.name)
+                if resident is not None:
+                    return resident
+
+            print(f"Loading voice {voice.name}...")
+            configs = dict(self.base.configs.update_configs())
+            configs["t2s_weights_path"] = voice.t2s_weights_path
+            configs["vits_weights_path"] = voice.vits_weights_path
+            # 音色换入换出不改写 tts_infer.yaml
+            configs = TTS_Config({"custom": configs}, persist=False)
+            tts = TTS(configs, shared=self.base)
+            if self.setup is not None:
+                self.setup(tts, voice)
+
+            with self.lock:
+                resident = _Resident(tts, tts.voice_model_bytes())
+                resident.in_use += 1
+                self.resident[voice.name] = resident
+                self.loads += 1
+                self._evict()
+                return resident
+
+    def _touch(self, name: str):
+        resident = self.resident.get(name)
+        if resident is not None:
+            self.resident.move_to_end(name)
+            resident.in_use += 1
+        return resident
+
+    def _evict(self):
+        total = sum(resident.nbytes for resident in self.resident.values())
+        for name in list(self.resident.keys()):
+            if total <= self.memory_budget:
+                break
+            resident = self.resident[name]
+            if name == self.base_voice.name or resident.in_use > 0:
+                continue
+            total -= resident.nbytes
+            self._unload(name)
+            self.evictions += 1
+
+    def _unload(self, name: str):
+        resident = self.resident.pop(name, None)
+        if resident is None:
+            return
+        print(f"Unloading voice {name}")
+        if resident.in_use == 0:
+            resident.tts.close()
+        # otherwise the running request keeps its TTS alive until it finishes
+
+    def list_voices(self) -> List[dict]:
+        with self.lock:
+            return [dict(voice.to_dict(), resident=name in self.resident) for name, voice in self.voices.items()]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "memory_budget_mb": round(self.memory_budget / 1024 / 1024, 1),
+                "resident_mb": round(sum(r.nbytes for r in self.resident.values()) / 1024 / 1024, 1),
+                "resident": [
+                    {"name": name, "size_mb": round(r.nbytes / 1024 / 1024, 1), "in_use": r.in_use}
+                    for name, r in self.resident.items()
+                ],
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+把 GPT / SoVITS / SV 权重以及 BERT / CNHubert 目录转换为 safetensors
+转换后的文件与原文件同名（扩展名 .safetensors），加载时自动优先使用，用 mmap 读取、不经过 pickle
+
+用法（在 text_to_speech 目录下运行）:
+  python GPT_SoVITS/convert_to_safetensors.py                      # 转换默认模型
+  python GPT_SoVITS/convert_to_safetensors.py GPT_weights_v2/xxx.ckpt SoVITS_weights_v2/xxx.pth
+"""
+
+import os
+import sys
+import argparse
+
+now_dir = os.getcwd()
+sys.path.insert(0, now_dir)
+sys.path.insert(0, os.path.join(now_dir, "GPT_SoVITS"))
+
+import torch
+from safetensors.torch import save_file
+
+from GPT_SoVITS.process_ckpt import get_sovits_version_from_path_fast, load_sovits_new
+from GPT_SoVITS.safetensors_ckpt import safetensors_path, save_ckpt
+
+DEFAULT_PATHS = [
+    "GPT_weights_v2/ZhuangFangyi_V1-e16.ckpt",
+    "SoVITS_weights_v2/ZhuangFangyi_V1_e20_s300.pth",
+    "GPT_SoVITS/pretrained_models/sv/pretrained_eres2netv2w24s4ep4.ckpt",
+    "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large",
+    "GPT_SoVITS/pretrained_models/chinese-hubert-base",
+]
+
+
+def convert_hf_dir(path):
+    # transformers 优先加载目录里的 model.safetensors
+    src = os.path.join(path, "pytorch_model.bin")
+    dst = os.path.join(path, "model.safetensors")
+    if os.path.exists(dst):
+        print(f"⏭️  已存在: {dst}")
+        return
+    if not os.path.exists(src):
+        print(f"⚠️  未找到 pytorch_model.bin: {path}")
+        return
+    state_dict = torch.load(src, map_location="cpu", weights_only=True)
+    state_dict = {k: v.contiguous().clone() for k, v in state_dict.items()}
+    save_file(state_dict, dst, metadata={"format": "pt"})
+    print(f"✅ {src} -> {dst}")
+
+
+def convert_file(path):
+    dst = safetensors_path(path)
+    with open(path, "rb") as f:
+        is_zip = f.read(2) == b"PK"
+    if path.endswith(".pth"):
+        # SoVITS：文件头里的版本号存到元数据
+        ckpt = load_sovits_new(path)
+        save_ckpt(ckpt, dst, extra={"sovits_version": list(get_sovits_version_from_path_fast(path))})
+    else:
+        ckpt = torch.load(path, map_location="cpu", weights_only=False, mmap=is_zip)
+        if "weight" in ckpt:
+            save_ckpt(ckpt, dst)  # GPT
+        else:
+            save_file({k: v.contiguous().clone() for k, v in ckpt.items()}, dst)  # SV 等纯 state_dict
+    print(f"✅ {path} -> {dst}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert GPT-SoVITS weights to safetensors")
+    parser.add_argument("paths", nargs="*", help="权重文件或 HuggingFace 模型目录（默认转换内置模型）")
+    args = parser.parse_args()
+
+    for path in args.paths or DEFAULT_PATHS:
+        if not os.path.exists(path):
+            print(f"⚠️  不存在，跳过: {path}")
+        elif os.path.isdir(path):
+            convert_hf_dir(path)
+        else:
+            convert_file(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+导出 ONNX Runtime 后端（TTS_infer_pack/ort_backend.py）使用的计算图
+ssl.onnx / bert.onnx 与音色无关；t2s_prefill.onnx / t2s_decode.onnx / vits.onnx 属于当前 GPT/SoVITS 权重
+
+用法（在 text_to_speech 目录下运行）:
+  python GPT_SoVITS/export_onnx_backend.py                                   # 导出默认模型到 onnx/ZhuangFangyi
+  python GPT_SoVITS/export_onnx_backend.py --gpt xxx.ckpt --sovits xxx.pth -o onnx/xxx
+"""
+
+import os
+import sys
+import argparse
+
+now_dir = os.getcwd()
+sys.path.insert(0, now_dir)
+sys.path.insert(0, os.path.join(now_dir, "GPT_SoVITS"))
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
+
+OPSET = 17
+
+
+def block_forward(layer, num_head, x, k_past=None, v_past=None, mask=None):
+    """One post-norm T2S layer, the same math as T2SBlock (batch 1, mask True = not attended)."""
+    hidden_dim = x.shape[-1]
+    head_dim = layer.self_attn.in_proj_weight.shape[1] // num_head
+    q, k, v = F.linear(x, layer.self_attn.in_proj_weight, layer.self_attn.in_proj_bias).chunk(3, dim=-1)
+    if k_past is not None:
+        k = torch.cat([k_past, k], dim=1)
+        v = torch.cat([v_past, v], dim=1)
+
+    q_ = q.reshape(1, -1, num_head, head_dim).transpose(1, 2)
+    k_ = k.reshape(1, -1, num_head, head_dim).transpose(1, 2)
+    v_ = v.reshape(1, -1, num_head, head_dim).transpose(1, 2)
+    weight = q_ @ k_.transpose(-2, -1) * (head_dim**-0.5)
+    if mask is not None:
+        weight = weight.masked_fill(mask, float("-inf"))
+    attn = (torch.softmax(weight, dim=-1) @ v_).transpose(1, 2).reshape(1, -1, hidden_dim)
+
+    x = x + F.linear(attn, layer.self_attn.out_proj.weight, layer.self_attn.out_proj.bias)
+    x = F.layer_norm(x, [hidden_dim], layer.norm1.weight, layer.norm1.bias, layer.norm1.eps)
+    x = x + layer.linear2(F.relu(layer.linear1(x)))
+    x = F.layer_norm(x, [hidden_dim], layer.norm2.weight, layer.norm2.bias, layer.norm2.eps)
+    return x, k, v
+
+
+def stack_cache(caches):
+    # L x [1, S, D] -> [S, L, 1, D]，按位置排列，ort_backend 里新位置可以原地写入
+    return torch.stack(caches, 0).permute(2, 0, 1, 3)
+
+
+class SSLExport(nn.Module):
+    def __init__(self, cnhubert):
+        super().__init__()
+        self.model = cnhubert.model
+
+    def forward(self, wav16k):
+        return self.model(wav16k)["last_hidden_state"].transpose(1, 2)
+
+
+class BertExport(nn.Module):
+    def __init__(self, bert_model):
+        super().__init__()
+        self.bert_model = bert_model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        res = self.bert_model(
+            input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids, output_hidden_states=True
+        )
+        return res["hidden_states"][-3]
+
+
+class T2SPrefillExport(nn.Module):
+    """Whole prompt (text + prompt semantic) -> logits of the first token and the KV cache."""
+
+    def __init__(self, t2s):
+        super().__init__()
+        self.t2s = t2s
+
+    def forward(self, x, bert_feature, prompts):
+        t2s = self.t2s
+        x = t2s.embed_text(x, bert_feature)
+        xy = torch.cat([x, t2s.embed_prompt(prompts)], dim=1)
+
+        # 文本之间双向可见、看不到语义 token；语义 token 看全部文本和之前的语义 token
+        position = torch.cumsum(torch.ones_like(xy[0, :, 0]), dim=0) - 1
+        x_len = torch.ones_like(x[0, :, 0]).sum()
+        key_is_y = (position >= x_len).unsqueeze(0)
+        query_is_x = (position < x_len).unsqueeze(1)
+        mask = key_is_y & (query_is_x | (position.unsqueeze(0) > position.unsqueeze(1)))
+
+        k_cache, v_cache = [], []
+        for layer in t2s.h.layers:
+            xy, k, v = block_forward(layer, t2s.num_head, xy, mask=mask)
+            k_cache.append(k)
+            v_cache.append(v)
+        logits = t2s.ar_predict_layer(xy[:, -1])
+        return logits, stack_cache(k_cache), stack_cache(v_cache)
+
+
+class T2SDecodeExport(nn.Module):
+    """One decode step: the last token at `position` -> logits and its keys/values."""
+
+    def __init__(self, t2s):
+        super().__init__()
+        self.t2s = t2s
+
+    def forward(self, token, position, k_past, v_past):
+        t2s = self.t2s
+        audio_position = t2s.ar_audio_position
+        xy = t2s.ar_audio_embedding(token)
+        xy = xy * audio_position.x_scale + audio_position.alpha * audio_position.pe[0].index_select(0, position)
+
+        k_new, v_new = [], []
+        for i, layer in enumerate(t2s.h.layers):
+            xy, k, v = block_forward(
+                layer, t2s.num_head, xy, k_past[:, i].transpose(0, 1), v_past[:, i].transpose(0, 1)
+            )
+            k_new.append(k[:, -1:])
+            v_new.append(v[:, -1:])
+        logits = t2s.ar_predict_layer(xy[:, -1])
+        return logits, stack_cache(k_new), stack_cache(v_new)
+
+
+class VitsExport(nn.Module):
+    """SynthesizerTrn.decode with speed 1 and a precomputed SpeakerCondition."""
+
+    def __init__(self, vits_model):
+        super().__init__()
+        self.vits_model = vits_model
+
+    def forward(self, codes, text, ge, ge_text):
+        vits = self.vits_model
+        # 长度用张量算，导出后仍随输入变化
+        y_lengths = torch.ones_like(codes[0]).sum(-1)
+        text_lengths = torch.ones_like(text).sum(-1)
+        quantized = vits.quantizer.decode(codes)
+        if vits.semantic_frame_rate == "25hz":
+            quantized = F.interpolate(quantized, scale_factor=2.0, mode="nearest")
+            y_lengths = y_lengths * 2
+        x, m_p, logs_p, y_mask, _, _ = vits.enc_p(quantized, y_lengths, text, text_lengths, ge_text, 1)
+        z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * 0.5
+        z = vits.flow(z_p, y_mask, g=ge, reverse=True)
+        return vits.dec(z * y_mask, g=ge)
+
+
+def export(module, args, path, input_names, output_names, dynamic_axes):
+    with torch.no_grad():
+        torch.onnx.export(
+            module.eval(),
+            args,
+            path,
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=OPSET,
+        )
+    print(f"✅ {path}")
+
+
+def check_empty_prompt(module, path, x, bert_feature):
+    """Reference free synthesis runs the prefill graph with a zero-length prompt, it must match PyTorch."""
+    import onnxruntime as ort
+
+    prompts = torch.zeros(1, 0, dtype=torch.long)
+    with torch.no_grad():
+        expected = module(x, bert_feature, prompts)
+    session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+    outputs = session.run(
+        None, {"x": x.numpy(), "bert_feature": bert_feature.numpy(), "prompts": prompts.numpy()}
+    )
+    for name, want, got in zip(("logits", "k", "v"), expected, outputs):
+        if want.shape != got.shape or not np.allclose(want.numpy(), got, atol=1e-3):
+            raise RuntimeError(f"{path}: {name} of an empty prompt does not match PyTorch")
+    print(f"✅ {path} (empty prompt)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export ONNX graphs for the ONNX Runtime backend")
+    parser.add_argument("--gpt", default="GPT_weights_v2/ZhuangFangyi_V1-e16.ckpt", help="GPT 权重")
+    parser.add_argument("--sovits", default="SoVITS_weights_v2/ZhuangFangyi_V1_e20_s300.pth", help="SoVITS 权重")
+    parser.add_argument("--version", default="v2Pro")
+    parser.add_argument("-o", "--output", default="onnx/ZhuangFangyi", help="输出目录")
+    parser.add_argument("--skip-shared", action="store_true", help="不导出与音色无关的 ssl / bert")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    tts = TTS(TTS_Config({
+        "custom": {
+            "device": "cpu",
+            "is_half": False,
+            "version": args.version,
+            "t2s_weights_path": args.gpt,
+            "vits_weights_path": args.sovits,
+            "bert_base_path": "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large",
+            "cnhuhbert_base_path": "GPT_SoVITS/pretrained_models/chinese-hubert-base",
+        }
+    }))
+    output = lambda name: os.path.join(args.output, f"{name}.onnx")
+
+    if not args.skip_shared:
+        export(
+            SSLExport(tts.cnhuhbert_model),
+            (torch.randn(1, 16000 * 5),),
+            output("ssl"),
+            ["wav16k"],
+            ["feature"],
+            {"wav16k": {1: "samples"}, "feature": {2: "frames"}},
+        )
+        inputs = tts.bert_tokenizer(["管理员，好久不见。", "不用太拘谨。"], return_tensors="pt", padding=True)
+        export(
+            BertExport(tts.bert_model),
+            (inputs["input_ids"], inputs["attention_mask"], inputs["token_type_ids"]),
+            output("bert"),
+            ["input_ids", "attention_mask", "token_type_ids"],
+            ["hidden"],
+            {
+                "input_ids": {0: "batch", 1: "tokens"},
+                "attention_mask": {0: "batch", 1: "tokens"},
+                "token_type_ids": {0: "batch", 1: "tokens"},
+                "hidden": {0: "batch", 1: "tokens"},
+            },
+        )
+
+    t2s = tts.t2s_model.model
+    x = torch.randint(0, 300, (1, 40))
+    bert_feature = torch.randn(1, 1024, 40)
+    prompts = torch.randint(0, 1024, (1, 75))
+    export(
+        T2SPrefillExport(t2s),
+        (x, bert_feature, prompts),
+        output("t2s_prefill"),
+        ["x", "bert_feature", "prompts"],
+        ["logits", "k", "v"],
+        {
+            "x": {1: "x_len"},
+            "bert_feature": {2: "x_len"},
+            "prompts": {1: "y_len"},
+            "k": {0: "prefix_len"},
+            "v": {0: "prefix_len"},
+        },
+    )
+    check_empty_prompt(T2SPrefillExport(t2s), output("t2s_prefill"), x, bert_feature)
+    with torch.no_grad():
+        _, k, v = T2SPrefillExport(t2s)(x, bert_feature, prompts)
+    export(
+        T2SDecodeExport(t2s),
+        (torch.randint(0, 1024, (1, 1)), torch.LongTensor([prompts.shape[1]]), k, v),
+        output("t2s_decode"),
+        ["token", "position", "k_past", "v_past"],
+        ["logits", "k_new", "v_new"],
+        {"k_past": {0: "past_len"}, "v_past": {0: "past_len"}},
+    )
+
+    if tts.configs.use_vocoder:
+        print("⚠️  v3/v4 模型的 CFM + 声码器不导出，仍使用 PyTorch")
+    else:
+        vits = tts.vits_model
+        ge = torch.randn(1, vits.gin_channels, 1)
+        ge_text = torch.randn(1, 512 if vits.is_v2pro else vits.gin_channels, 1)
+        export(
+            VitsExport(vits),
+            (torch.randint(0, 1024, (1, 1, 100)), torch.randint(0, 300, (1, 40)), ge, ge_text),
+            output("vits"),
+            ["codes", "text", "ge", "ge_text"],
+            ["audio"],
+            {"codes": {2: "semantic_len"}, "text": {1: "phone_len"}, "audio": {2: "samples"}},
+        )
+
+
+if __name__ == "__main__":
+    main()
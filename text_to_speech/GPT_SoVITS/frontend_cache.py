@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+class FrontendCache:
+    """
+    Text frontend cache, keyed by (text, language, version).
+
+    The frontend tier keeps the output of LangSegmenter + normalization + g2p
+    (phones, word2ph, norm_text per language segment). The optional BERT tier
+    (`bert_capacity` > 0) also keeps the phone-level BERT feature of the whole text,
+    so a stock phrase or the fixed prompt text skips the BERT forward as well.
+    Both tiers are bounded LRUs and safe to share between threads.
+    """
+
+    def __init__(self, capacity: int = 4096, bert_capacity: int = 0):
+        self.capacity = capacity
+        self.bert_capacity = bert_capacity
+        self.entries = OrderedDict()
+        self.bert_entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.bert_hits = 0
+        self.bert_misses = 0
+
+    @staticmethod
+    def make_key(text, language, version):
+        return (text, language, version)
+
+    def get(self, text, language, version):
+        key = self.make_key(text, language, version)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, text, language, version, entry):
+        if self.capacity <= 0:
+            return entry
+        key = self.make_key(text, language, version)
+        with self.lock:
+            self._put(self.entries, key, entry, self.capacity)
+        return entry
+
+    def get_bert(self, text, language, version):
+        if self.bert_capacity <= 0:
+            return None
+        key = self.make_key(text, language, version)
+        with self.lock:
+            entry = self.bert_entries.get(key)
+            if entry is None:
+                self.bert_misses += 1
+                return None
+            self.bert_entries.move_to_end(key)
+            self.bert_hits += 1
+            return entry
+
+    def put_bert(self, text, language, version, entry):
+        if self.bert_capacity <= 0:
+            return entry
+        key = self.make_key(text, language, version)
+        entry = tuple(v.detach().cpu() if isinstance(v, torch.Tensor) else v for v in entry)
+        with self.lock:
+            self._put(self.bert_entries, key, entry, self.bert_capacity)
+        return entry
+
+    @staticmethod
+    def _put(entries, key, entry, capacity):
+        entries[key] = entry
+        entries.move_to_end(key)
+        while len(entries) > capacity:
+            entries.popitem(last=False)
+
+    def clear(self, bert_only=False):
+        with self.lock:
+            self.bert_entries.clear()
+            if not bert_only:
+                self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bert_size": len(self.bert_entries),
+                "bert_capacity": self.bert_capacity,
+                "bert_hits": self.bert_hits,
+                "bert_misses": self.bert_misses,
+            }
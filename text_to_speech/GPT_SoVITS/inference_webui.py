@@ -229,6 +229,7 @@ else:
 ###todo:put them to process_ckpt and modify my_save func (save sovits weights), gpt save weights use my_save in process_ckpt
 # symbol_version-model_version-if_lora_v3
 from .process_ckpt import get_sovits_version_from_path_fast, load_sovits_new
+from .safetensors_ckpt import load_gpt_ckpt
 
 v3v4set = {"v3", "v4"}
 
@@ -236,7 +237,7 @@ v3v4set = {"v3", "v4"}
 def change_sovits_weights(sovits_path, prompt_language=None, text_language=None):
     if "！" in sovits_path or "!" in sovits_path:
         sovits_path = name2sovits_path[sovits_path]
-    global vq_model, hps, version, model_version, dict_language, if_lora_v3
+    global vq_model, vq_model_path, hps, version, model_version, dict_language, if_lora_v3
     version, model_version, if_lora_v3 = get_sovits_version_from_path_fast(sovits_path)
     print(sovits_path, version, model_version, if_lora_v3)
     is_exist = is_exist_s2gv3 if model_version == "v3" else is_exist_s2gv4
@@ -347,6 +348,7 @@ def change_sovits_weights(sovits_path, prompt_language=None, text_language=None)
         vq_model.cfm = vq_model.cfm.merge_and_unload()
         # torch.save(vq_model.state_dict(),"merge_win.pth")
         vq_model.eval()
+    vq_model_path = sovits_path
 
     yield (
         {"__type__": "update", "choices": list(dict_language.keys())},
@@ -385,7 +387,7 @@ def change_gpt_weights(gpt_path):
         gpt_path = name2gpt_path[gpt_path]
     global hz, max_sec, t2s_model, config
     hz = 50
-    dict_s1 = torch.load(gpt_path, map_location="cpu", weights_only=False)
+    dict_s1 = load_gpt_ckpt(gpt_path)
     config = dict_s1["config"]
     max_sec = config["data"]["max_sec"]
     t2s_model = Text2SemanticLightningModule(config, "****", is_train=False)
@@ -561,10 +563,21 @@ def get_spepc(hps, filename, dtype, device, is_v2pro=False):
     return spec, audio
 
 
+from .frontend_cache import FrontendCache
+
+# 文本前端缓存：固定的参考文本和常用句子不再重复做规范化/g2p
+frontend_cache = FrontendCache(capacity=int(os.environ.get("frontend_cache_size", 4096)))
+
+
 def clean_text_inf(text, language, version):
     language = language.replace("all_", "")
+    cached = frontend_cache.get(text, language, version)
+    if cached is not None:
+        phones, word2ph, norm_text = cached
+        return list(phones), word2ph, norm_text
     phones, word2ph, norm_text = clean_text(text, language, version)
     phones = cleaned_text_to_sequence(phones, version)
+    frontend_cache.put(text, language, version, (list(phones), word2ph, norm_text))
     return phones, word2ph, norm_text
 
 
@@ -759,6 +772,62 @@ def audio_sr(audio, sr):
 # cache_tokens={}#暂未实现清理机制
 cache = {}
 
+from .ref_feature_store import RefFeatureStore
+
+# 参考音频特征缓存：按参考音频内容哈希+参考文本索引，内存LRU+磁盘两级
+ref_feature_store = RefFeatureStore(
+    capacity=int(os.environ.get("ref_cache_size", 8)),
+    cache_dir=os.environ.get("ref_cache_dir", "TEMP/ref_feature_cache") or None,
+)
+
+
+def get_ref_features(ref_wav_path, prompt_text, prompt_language, ref_free, pause_second):
+    is_v2pro = model_version in {"v2Pro", "v2ProPlus"}
+    key = ref_feature_store.make_key(
+        ref_wav_path,
+        "" if ref_free else prompt_text,
+        "" if ref_free else prompt_language,
+        version,
+        model_version,
+        vq_model_path,
+        dtype,
+        pause_second,
+    )
+
+    def compute():
+        feats = {}
+        if not ref_free:
+            zero_wav_torch = torch.zeros(int(hps.data.sampling_rate * pause_second), dtype=dtype, device=device)
+            with torch.no_grad():
+                wav16k, sr = librosa.load(ref_wav_path, sr=16000)
+                if wav16k.shape[0] > 160000 or wav16k.shape[0] < 48000:
+                    gr.Warning(i18n("参考音频在3~10秒范围外，请更换！"))
+                    raise OSError(i18n("参考音频在3~10秒范围外，请更换！"))
+                wav16k = torch.from_numpy(wav16k).to(dtype=dtype, device=device)
+                wav16k = torch.cat([wav16k, zero_wav_torch])
+                ssl_content = ssl_model.model(wav16k.unsqueeze(0))["last_hidden_state"].transpose(1, 2)  # .float()
+                codes = vq_model.extract_latent(ssl_content)
+            feats["prompt_semantic"] = codes[0, 0]
+            phones1, bert1, norm_text1 = get_phones_and_bert(prompt_text, prompt_language, version)
+            feats["phones"] = phones1
+            feats["bert"] = bert1
+            feats["norm_text"] = norm_text1
+        refer, audio_tensor = get_spepc(hps, ref_wav_path, dtype, device, is_v2pro)
+        feats["refer_spec"] = refer
+        feats["sv_emb"] = None
+        if is_v2pro:
+            if sv_cn_model == None:
+                init_sv_cn()
+            feats["sv_emb"] = sv_cn_model.compute_embedding3(audio_tensor)
+        return feats
+
+    return ref_feature_store.get_or_compute(key, compute)
+
+
+# 跨请求连续批处理调度器，由服务端按需创建（见 simple_tts.ZhuangFangyiTTS）
+# 为 None 时 get_tts_wav 逐条调用 infer_panel
+t2s_scheduler = None
+
 
 def get_tts_wav(
     ref_wav_path,
@@ -820,22 +889,9 @@ def get_tts_wav(
         zero_wav_torch = zero_wav_torch.half().to(device)
     else:
         zero_wav_torch = zero_wav_torch.to(device)
+    ref_feats = get_ref_features(ref_wav_path, prompt_text, prompt_language, ref_free, pause_second)
     if not ref_free:
-        with torch.no_grad():
-            wav16k, sr = librosa.load(ref_wav_path, sr=16000)
-            if wav16k.shape[0] > 160000 or wav16k.shape[0] < 48000:
-                gr.Warning(i18n("参考音频在3~10秒范围外，请更换！"))
-                raise OSError(i18n("参考音频在3~10秒范围外，请更换！"))
-            wav16k = torch.from_numpy(wav16k)
-            if is_half == True:
-                wav16k = wav16k.half().to(device)
-            else:
-                wav16k = wav16k.to(device)
-            wav16k = torch.cat([wav16k, zero_wav_torch])
-            ssl_content = ssl_model.model(wav16k.unsqueeze(0))["last_hidden_state"].transpose(1, 2)  # .float()
-            codes = vq_model.extract_latent(ssl_content)
-            prompt_semantic = codes[0, 0]
-            prompt = prompt_semantic.unsqueeze(0).to(device)
+        prompt = ref_feats["prompt_semantic"].unsqueeze(0).to(device)
 
     t1 = ttime()
     t.append(t1 - t0)
@@ -859,7 +915,7 @@ def get_tts_wav(
     audio_opt = []
     ###s2v3暂不支持ref_free
     if not ref_free:
-        phones1, bert1, norm_text1 = get_phones_and_bert(prompt_text, prompt_language, version)
+        phones1, bert1 = ref_feats["phones"], ref_feats["bert"].to(device)
 
     for i_text, text in enumerate(texts):
         # 解决输入目标文本的空行导致报错的问题
@@ -885,6 +941,19 @@ def get_tts_wav(
         # print(cache.keys(),if_freeze)
         if i_text in cache and if_freeze == True:
             pred_semantic = cache[i_text]
+        elif t2s_scheduler is not None:
+            # 并发请求共享同一个解码 batch
+            pred_semantic, idx = t2s_scheduler.infer(
+                all_phoneme_ids[0],
+                None if ref_free else prompt[0],
+                bert[0],
+                top_k=top_k,
+                top_p=top_p,
+                temperature=temperature,
+                early_stop_num=hz * max_sec,
+            )
+            pred_semantic = pred_semantic[-idx:].unsqueeze(0).unsqueeze(0)
+            cache[i_text] = pred_semantic
         else:
             with torch.no_grad():
                 pred_semantic, idx = t2s_model.model.infer_panel(
@@ -920,10 +989,9 @@ def get_tts_wav(
                     except:
                         traceback.print_exc()
             if len(refers) == 0:
-                refers, audio_tensor = get_spepc(hps, ref_wav_path, dtype, device, is_v2pro)
-                refers = [refers]
+                refers = [ref_feats["refer_spec"].to(device)]
                 if is_v2pro:
-                    sv_emb = [sv_cn_model.compute_embedding3(audio_tensor)]
+                    sv_emb = [ref_feats["sv_emb"].to(device)]
             if is_v2pro:
                 audio = vq_model.decode(
                     pred_semantic, torch.LongTensor(phones2).to(device).unsqueeze(0), refers, speed=speed, sv_emb=sv_emb
@@ -933,7 +1001,7 @@ def get_tts_wav(
                     pred_semantic, torch.LongTensor(phones2).to(device).unsqueeze(0), refers, speed=speed
                 )[0][0]
         else:
-            refer, audio_tensor = get_spepc(hps, ref_wav_path, dtype, device)
+            refer = ref_feats["refer_spec"].to(device)
             phoneme_ids0 = torch.LongTensor(phones1).to(device).unsqueeze(0)
             phoneme_ids1 = torch.LongTensor(phones2).to(device).unsqueeze(0)
             fea_ref, ge = vq_model.decode_encp(prompt.unsqueeze(0), phoneme_ids0, refer)
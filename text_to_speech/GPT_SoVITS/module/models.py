@@ -23,6 +23,12 @@ from ..text import symbols2 as symbols_v2
 from torch.cuda.amp import autocast
 import contextlib
 import random
+from typing import NamedTuple, Optional
+
+
+class SpeakerCondition(NamedTuple):
+    ge: Optional[torch.Tensor]  # [B, gin_channels, 1], conditions flow and dec
+    ge_text: Optional[torch.Tensor]  # conditions enc_p (ge_to512(ge) for v2Pro, else ge)
 
 
 class StochasticDurationPredictor(nn.Module):
@@ -992,7 +998,11 @@ class SynthesizerTrn(nn.Module):
 
 
     @torch.no_grad()
-    def decode(self, codes, text, refer, noise_scale=0.5, speed=1, sv_emb=None):
+    def get_speaker_condition(self, refer, sv_emb=None) -> SpeakerCondition:
+        """
+        Speaker conditioning of decode/decode_streaming. It only depends on the reference
+        spectrogram(s) and sv_emb, so it can be built once per reference set and reused.
+        """
         def get_ge(refer, sv_emb):
             ge = None
             if refer is not None:
@@ -1017,6 +1027,15 @@ class SynthesizerTrn(nn.Module):
         else:
             ge = get_ge(refer, sv_emb)
 
+        ge_text = self.ge_to512(ge.transpose(2, 1)).transpose(2, 1) if self.is_v2pro else ge
+        return SpeakerCondition(ge, ge_text)
+
+    @torch.no_grad()
+    def decode(self, codes, text, refer, noise_scale=0.5, speed=1, sv_emb=None, speaker_condition: SpeakerCondition = None):
+        if speaker_condition is None:
+            speaker_condition = self.get_speaker_condition(refer, sv_emb)
+        ge, ge_text = speaker_condition
+
         y_lengths = torch.LongTensor([codes.size(2) * 2]).to(codes.device)
         text_lengths = torch.LongTensor([text.size(-1)]).to(text.device)
 
@@ -1028,7 +1047,7 @@ class SynthesizerTrn(nn.Module):
             y_lengths,
             text,
             text_lengths,
-            self.ge_to512(ge.transpose(2, 1)).transpose(2, 1) if self.is_v2pro else ge,
+            ge_text,
             speed,
         )
         z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
@@ -1040,30 +1059,10 @@ class SynthesizerTrn(nn.Module):
 
 
     @torch.no_grad()
-    def decode_streaming(self, codes, text, refer, noise_scale=0.5, speed=1, sv_emb=None, result_length:int=None, overlap_frames:torch.Tensor=None, padding_length:int=None):
-        def get_ge(refer, sv_emb):
-            ge = None
-            if refer is not None:
-                refer_lengths = torch.LongTensor([refer.size(2)]).to(refer.device)
-                refer_mask = torch.unsqueeze(commons.sequence_mask(refer_lengths, refer.size(2)), 1).to(refer.dtype)
-                if self.version == "v1":
-                    ge = self.ref_enc(refer * refer_mask, refer_mask)
-                else:
-                    ge = self.ref_enc(refer[:, :704] * refer_mask, refer_mask)
-                if self.is_v2pro:
-                    sv_emb = self.sv_emb(sv_emb)  # B*20480->B*512
-                    ge += sv_emb.unsqueeze(-1)
-                    ge = self.prelu(ge)
-            return ge
-
-        if type(refer) == list:
-            ges = []
-            for idx, _refer in enumerate(refer):
-                ge = get_ge(_refer, sv_emb[idx] if self.is_v2pro else None)
-                ges.append(ge)
-            ge = torch.stack(ges, 0).mean(0)
-        else:
-            ge = get_ge(refer, sv_emb)
+    def decode_streaming(self, codes, text, refer, noise_scale=0.5, speed=1, sv_emb=None, result_length:int=None, overlap_frames:torch.Tensor=None, padding_length:int=None, speaker_condition: SpeakerCondition = None):
+        if speaker_condition is None:
+            speaker_condition = self.get_speaker_condition(refer, sv_emb)
+        ge, ge_text = speaker_condition
 
         y_lengths = torch.LongTensor([codes.size(2) * 2]).to(codes.device)
         text_lengths = torch.LongTensor([text.size(-1)]).to(text.device)
@@ -1078,7 +1077,7 @@ class SynthesizerTrn(nn.Module):
             y_lengths,
             text,
             text_lengths,
-            self.ge_to512(ge.transpose(2, 1)).transpose(2, 1) if self.is_v2pro else ge,
+            ge_text,
             speed,
             result_length=result_length, 
             overlap_frames=overlap_frames, 
@@ -1110,9 +1109,42 @@ class CFM(torch.nn.Module):
 
         self.use_conditioner_cache = True
 
+    @staticmethod
+    def timesteps(n_timesteps, sway_coef=None):
+        """
+        n_timesteps + 1 time points from 0 to 1. With sway_coef (F5-TTS sway sampling, e.g. -1)
+        t = u + s * (cos(pi / 2 * u) - 1 + u) instead of the uniform u, so a negative s puts
+        more of the steps near t = 0, where the coarse structure of the mel is decided.
+        """
+        u = [j / n_timesteps for j in range(n_timesteps + 1)]
+        if sway_coef is None:
+            return u
+        return [t + sway_coef * (math.cos(math.pi / 2 * t) - 1 + t) for t in u]
+
     @torch.inference_mode()
-    def inference(self, mu, x_lens, prompt, n_timesteps, temperature=1.0, inference_cfg_rate=0):
-        """Forward diffusion"""
+    def inference(
+        self,
+        mu,
+        x_lens,
+        prompt,
+        n_timesteps,
+        temperature=1.0,
+        inference_cfg_rate=0,
+        solver="euler",
+        sway_coef=None,
+        atol=1e-2,
+    ):
+        """
+        Forward diffusion.
+
+        solver:
+            euler: one estimator call per step (the default).
+            midpoint / heun: second order, two estimator calls per step.
+            adaptive: Heun with the Euler step as error estimate. The step starts at
+                1 / n_timesteps and is adapted so the RMS local error stays under atol,
+                using at most 4 * n_timesteps estimator calls.
+        sway_coef: non-uniform time schedule for the fixed-step solvers, see `timesteps`.
+        """
         B, T = mu.size(0), mu.size(1)
         x = torch.randn([B, self.in_channels, T], device=mu.device, dtype=mu.dtype) * temperature
         prompt_len = prompt.size(-1)
@@ -1120,14 +1152,13 @@ class CFM(torch.nn.Module):
         prompt_x[..., :prompt_len] = prompt[..., :prompt_len]
         x[..., :prompt_len] = 0
         mu = mu.transpose(2, 1)
-        t = 0
-        d = 1 / n_timesteps
-        text_cache = None
-        text_cfg_cache = None
-        dt_cache = None
-        d_tensor = torch.ones(x.shape[0], device=x.device, dtype=mu.dtype) * d
-        for j in range(n_timesteps):
+        # text 条件与 t 无关，所有 step 共用；步长的 embedding 按步长缓存
+        cache = {"text": None, "text_cfg": None, "dt": {}}
+
+        def velocity(x, t, d):
             t_tensor = torch.ones(x.shape[0], device=x.device, dtype=mu.dtype) * t
+            d_tensor = torch.ones(x.shape[0], device=x.device, dtype=mu.dtype) * d
+            dt_cache = cache["dt"].get(d)
             # v_pred = model(x, t_tensor, d_tensor, **extra_args)
             v_pred, text_emb, dt = self.estimator(
                 x,
@@ -1140,13 +1171,14 @@ class CFM(torch.nn.Module):
                 drop_audio_cond=False,
                 drop_text=False,
                 infer=True,
-                text_cache=text_cache,
+                text_cache=cache["text"],
                 dt_cache=dt_cache,
             )
             v_pred = v_pred.transpose(2, 1)
             if self.use_conditioner_cache:
-                text_cache = text_emb
-                dt_cache = dt
+                cache["text"] = text_emb
+                if solver != "adaptive":
+                    cache["dt"][d] = dt
             if inference_cfg_rate > 1e-5:
                 neg, text_cfg_emb, _ = self.estimator(
                     x,
@@ -1159,15 +1191,47 @@ class CFM(torch.nn.Module):
                     drop_audio_cond=True,
                     drop_text=True,
                     infer=True,
-                    text_cache=text_cfg_cache,
-                    dt_cache=dt_cache,
+                    text_cache=cache["text_cfg"],
+                    dt_cache=dt if self.use_conditioner_cache else None,
                 )
                 neg = neg.transpose(2, 1)
                 if self.use_conditioner_cache:
-                    text_cfg_cache = text_cfg_emb
+                    cache["text_cfg"] = text_cfg_emb
                 v_pred = v_pred + (v_pred - neg) * inference_cfg_rate
+            v_pred[:, :, :prompt_len] = 0
+            return v_pred
+
+        if solver == "adaptive":
+            t = 0.0
+            d = 1 / n_timesteps
+            calls = 0
+            while t < 1 - 1e-6:
+                # 调用次数只够最后一步时，一步走完剩下的区间
+                last = calls + 4 > 4 * n_timesteps
+                d = 1 - t if last else min(d, 1 - t)
+                v1 = velocity(x, t, d)
+                v2 = velocity(x + d * v1, t + d, d)
+                calls += 2
+                error = (d / 2 * (v2 - v1)).float().pow(2).mean().sqrt().item()
+                if last or error <= atol or d <= 1 / (4 * n_timesteps):
+                    x = x + d / 2 * (v1 + v2)
+                    t = t + d
+                d = d * min(2.0, max(0.2, 0.9 * (atol / max(error, 1e-8)) ** 0.5))
+            return x
+
+        if solver not in ("euler", "midpoint", "heun"):
+            raise ValueError(f"unknown CFM solver: {solver}")
+        ts = self.timesteps(n_timesteps, sway_coef)
+        for j in range(n_timesteps):
+            t = ts[j]
+            # 均匀步长时 d 固定，步长的 embedding 只算一次
+            d = 1 / n_timesteps if sway_coef is None else ts[j + 1] - ts[j]
+            v_pred = velocity(x, t, d)
+            if solver == "midpoint":
+                v_pred = velocity(x + d / 2 * v_pred, t + d / 2, d)
+            elif solver == "heun":
+                v_pred = (v_pred + velocity(x + d * v_pred, t + d, d)) / 2
             x = x + d * v_pred
-            t = t + d
             x[:, :, :prompt_len] = 0
         return x
 
@@ -6,6 +6,11 @@ import os
 import torch
 from tools.i18n.i18n import I18nAuto
 
+try:
+    from .safetensors_ckpt import is_safetensors, load_sovits_ckpt, read_metadata
+except ImportError:  # imported as a top-level module by the training scripts
+    from safetensors_ckpt import is_safetensors, load_sovits_ckpt, read_metadata
+
 i18n = I18nAuto()
 
 
@@ -98,6 +103,9 @@ def get_hash_from_file(sovits_path):
 
 
 def get_sovits_version_from_path_fast(sovits_path):
+    ###0-converted weights, by safetensors metadata
+    if is_safetensors(sovits_path):
+        return tuple(read_metadata(sovits_path)["sovits_version"])
     ###1-if it is pretrained sovits models, by hash
     hash = get_hash_from_file(sovits_path)
     if hash in hash_pretrained_dict:
@@ -127,12 +135,5 @@ def get_sovits_version_from_path_fast(sovits_path):
 
 
 def load_sovits_new(sovits_path):
-    f = open(sovits_path, "rb")
-    meta = f.read(2)
-    if meta != b"PK":
-        data = b"PK" + f.read()
-        bio = BytesIO()
-        bio.write(data)
-        bio.seek(0)
-        return torch.load(bio, map_location="cpu", weights_only=False)
-    return torch.load(sovits_path, map_location="cpu", weights_only=False)
+    # 优先读取转换好的 safetensors；旧格式用 mmap 加载，不再把整个文件读进内存两次
+    return load_sovits_ckpt(sovits_path)
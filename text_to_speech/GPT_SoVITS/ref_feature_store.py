@@ -0,0 +1,177 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from time import time as ttime
+
+import torch
+
+
+def hash_file_content(path, block_size=1 << 20):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+class RefFeatureStore:
+    """
+    Reference-prompt feature store, keyed by the content hash of the reference wav
+    plus everything else the features depend on (prompt text, language, model).
+
+    Entries are dicts of tensors (prompt_semantic, refer_spec, sv_emb, phones, bert, ...).
+    They live in an in-memory LRU of `capacity` entries, backed by `cache_dir` on disk
+    so that a restarted process does not pay the prompt extraction again. The disk keeps at
+    most `disk_capacity` entries, the least recently used (by mtime) are deleted first.
+    """
+
+    def __init__(self, capacity: int = 8, cache_dir: str = None, disk_capacity: int = 256):
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self.disk_capacity = disk_capacity
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        # (path, size, mtime) -> sha256, avoids re-reading the same file on every request
+        self.file_hashes = {}
+        # key -> [lock, number of callers using it]; the lock is held while that key is being
+        # computed, concurrent first requests wait for it
+        self.compute_locks = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        file_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            digest = self.file_hashes.get(file_key)
+        if digest is None:
+            digest = hash_file_content(path)
+            with self.lock:
+                self.file_hashes[file_key] = digest
+        return digest
+
+    def make_key(self, ref_wav_path, *parts):
+        hasher = hashlib.sha256()
+        hasher.update(self.file_hash(ref_wav_path).encode("utf-8"))
+        for part in parts:
+            hasher.update(b"\x00")
+            hasher.update(str(part).encode("utf-8"))
+        return hasher.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, "%s.pt" % key)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        if self.cache_dir and os.path.exists(self._disk_path(key)):
+            try:
+                # entries are plain dicts of tensors / lists / str / None, no arbitrary unpickling needed
+                entry = torch.load(self._disk_path(key), map_location="cpu", weights_only=True)
+            except Exception as e:
+                print("Failed to load reference features from disk cache: %s" % e)
+            else:
+                try:
+                    # mtime 记录最近一次使用，磁盘按它淘汰
+                    os.utime(self._disk_path(key))
+                except OSError:
+                    pass
+                with self.lock:
+                    self.disk_hits += 1
+                    self._put_memory(key, entry)
+                return entry
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        entry = {k: (v.detach().cpu() if isinstance(v, torch.Tensor) else v) for k, v in entry.items()}
+        with self.lock:
+            self._put_memory(key, entry)
+        if self.cache_dir:
+            # write to a temp file first, a crashed writer must not leave a truncated entry behind
+            tmp_path = "%s.%s.tmp" % (self._disk_path(key), ttime())
+            try:
+                torch.save(entry, tmp_path)
+                os.replace(tmp_path, self._disk_path(key))
+            except Exception as e:
+                print("Failed to write reference features to disk cache: %s" % e)
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self._evict_disk()
+        return entry
+
+    def _evict_disk(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".pt"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass  # removed by another thread
+        entries.sort()
+        for _, path in entries[: max(len(entries) - self.disk_capacity, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _put_memory(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute_fn):
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        with self.lock:
+            slot = self.compute_locks.setdefault(key, [threading.Lock(), 0])
+            slot[1] += 1
+        try:
+            with slot[0]:
+                with self.lock:
+                    # another thread may have computed it while this one was waiting
+                    entry = self.entries.get(key)
+                    if entry is not None:
+                        self.entries.move_to_end(key)
+                        return entry
+                return self.put(key, compute_fn())
+        finally:
+            # 最后一个使用者才移除锁，计算失败时等待者和新请求仍然排在同一把锁上
+            with self.lock:
+                slot[1] -= 1
+                if slot[1] == 0:
+                    del self.compute_locks[key]
+
+    def clear(self, disk=False):
+        with self.lock:
+            self.entries.clear()
+        if disk and self.cache_dir and os.path.exists(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".pt"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,122 @@
+"""
+safetensors storage for GPT / SoVITS / SV checkpoints.
+
+A converted checkpoint keeps the state dict as safetensors tensors and everything else
+(config, info, lora_rank, sovits version...) as JSON in the safetensors metadata, so it is
+loaded through mmap without unpickling anything. The loaders pick up a converted
+`<name>.safetensors` next to the original file automatically when it is not older than the
+original; convert with `python GPT_SoVITS/convert_to_safetensors.py`.
+"""
+
+import json
+import mmap
+import os
+
+import torch
+
+try:
+    from safetensors import safe_open
+    from safetensors.torch import load_file, save_file
+except ImportError:
+    safe_open = load_file = save_file = None
+
+METADATA_KEY = "gpt_sovits"
+
+
+def is_safetensors(path):
+    return str(path).endswith(".safetensors")
+
+
+def safetensors_path(path):
+    return os.path.splitext(path)[0] + ".safetensors"
+
+
+def prefer_safetensors(path):
+    """Return the converted sibling of `path` if there is an up-to-date one, else `path`."""
+    if save_file is None or is_safetensors(path):
+        return path
+    converted = safetensors_path(path)
+    if os.path.exists(converted) and os.path.getmtime(converted) >= os.path.getmtime(path):
+        return converted
+    return path
+
+
+def _to_plain(value):
+    # HParams / DictToAttrRecursive -> dict, so the config can go into JSON metadata
+    if hasattr(value, "items"):
+        return {k: _to_plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_plain(v) for v in value]
+    return value
+
+
+def save_ckpt(ckpt, path, extra=None):
+    """
+    Save a {"weight": state_dict, ...} checkpoint as safetensors. Every non-weight entry
+    and `extra` are stored as JSON metadata.
+    """
+    if save_file is None:
+        raise ImportError("safetensors is not installed")
+    # clone: safetensors refuses tensors that share storage
+    weights = {k: v.detach().cpu().contiguous().clone() for k, v in ckpt["weight"].items()}
+    meta = {k: _to_plain(v) for k, v in ckpt.items() if k != "weight"}
+    meta.update(extra or {})
+    tmp_path = "%s.tmp" % path
+    save_file(weights, tmp_path, metadata={METADATA_KEY: json.dumps(meta, ensure_ascii=False, default=str)})
+    os.replace(tmp_path, path)
+
+
+def read_metadata(path):
+    with safe_open(path, framework="pt") as f:
+        metadata = f.metadata() or {}
+    return json.loads(metadata.get(METADATA_KEY, "{}"))
+
+
+def load_ckpt(path, device="cpu"):
+    """Load a checkpoint written by save_ckpt: {"weight": state_dict, **metadata}."""
+    if load_file is None:
+        raise ImportError("safetensors is not installed")
+    ckpt = read_metadata(path)
+    ckpt["weight"] = load_file(path, device=str(device))
+    return ckpt
+
+
+def _torch_load(path, device="cpu"):
+    try:
+        return torch.load(path, map_location=device, weights_only=False, mmap=True)
+    except RuntimeError:
+        # legacy (non-zip) torch.save format cannot be memory-mapped
+        return torch.load(path, map_location=device, weights_only=False)
+
+
+def load_state_dict(path, device="cpu"):
+    """Plain state dict from a .safetensors file or a torch checkpoint (mmap, no copy into RAM)."""
+    path = prefer_safetensors(path)
+    if is_safetensors(path):
+        return load_file(path, device=str(device))
+    return _torch_load(path, device)
+
+
+def load_gpt_ckpt(path, device="cpu"):
+    """GPT (.ckpt) checkpoint: {"weight", "config", ...}."""
+    path = prefer_safetensors(path)
+    if is_safetensors(path):
+        return load_ckpt(path, device)
+    return _torch_load(path, device)
+
+
+def load_sovits_ckpt(path):
+    """
+    SoVITS (.pth) checkpoint. New-style files have the first two bytes of the zip header
+    replaced with a version tag; they are mapped copy-on-write and patched in the private
+    mapping instead of reading the whole file into a bytes object.
+    """
+    path = prefer_safetensors(path)
+    if is_safetensors(path):
+        return load_ckpt(path)
+    with open(path, "rb") as f:
+        if f.read(2) == b"PK":
+            return _torch_load(path)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY) as mm:
+            mm[:2] = b"PK"
+            return torch.load(mm, map_location="cpu", weights_only=False)
@@ -7,10 +7,15 @@ sv_path = "GPT_SoVITS/pretrained_models/sv/pretrained_eres2netv2w24s4ep4.ckpt"
 from ERes2NetV2 import ERes2NetV2
 import kaldi as Kaldi
 
+try:
+    from .safetensors_ckpt import load_state_dict
+except ImportError:
+    from safetensors_ckpt import load_state_dict
+
 
 class SV:
     def __init__(self, device, is_half):
-        pretrained_state = torch.load(sv_path, map_location="cpu", weights_only=False)
+        pretrained_state = load_state_dict(sv_path)
         embedding_model = ERes2NetV2(baseWidth=24, scale=4, expansion=4)
         embedding_model.load_state_dict(pretrained_state)
         embedding_model.eval()
@@ -1,17 +1,30 @@
 import logging
 import re
+import threading
+from pathlib import Path
 
-# jieba静音
-import jieba
-jieba.setLogLevel(logging.CRITICAL)
+# jieba / fast_langdetect / split_lang 在第一次切分时才导入
+_LangSplitter = None
+_load_lock = threading.Lock()
 
-# 更改fast_langdetect大模型位置
-from pathlib import Path
-import fast_langdetect
-fast_langdetect.infer._default_detector = fast_langdetect.infer.LangDetector(fast_langdetect.infer.LangDetectConfig(cache_dir=Path(__file__).parent.parent.parent / "pretrained_models" / "fast_langdetect"))
 
+def load():
+    """Import jieba, fast_langdetect and split_lang, returns split_lang.LangSplitter."""
+    global _LangSplitter
+    if _LangSplitter is None:
+        with _load_lock:
+            if _LangSplitter is None:
+                # jieba静音
+                import jieba
+                jieba.setLogLevel(logging.CRITICAL)
 
-from split_lang import LangSplitter
+                # 更改fast_langdetect大模型位置
+                import fast_langdetect
+                fast_langdetect.infer._default_detector = fast_langdetect.infer.LangDetector(fast_langdetect.infer.LangDetectConfig(cache_dir=Path(__file__).parent.parent.parent / "pretrained_models" / "fast_langdetect"))
+
+                from split_lang import LangSplitter
+                _LangSplitter = LangSplitter
+    return _LangSplitter
 
 
 def full_en(text):
@@ -87,8 +100,12 @@ class LangSegmenter():
         "en": "en",
     }
 
+    def preload():
+        """切分一次，加载 jieba 词典和语种检测模型"""
+        LangSegmenter.getTexts("你好，Hello。")
+
     def getTexts(text,default_lang = ""):
-        lang_splitter = LangSplitter(lang_map=LangSegmenter.DEFAULT_LANG_MAP)
+        lang_splitter = load()(lang_map=LangSegmenter.DEFAULT_LANG_MAP)
         lang_splitter.merge_across_digit = False
         substr = lang_splitter.split_by_lang(text=text)
 
@@ -1,5 +1,7 @@
 from . import cleaned_text_to_sequence
+import importlib
 import os
+import threading
 # if os.environ.get("version","v1")=="v1":
 #     from text import chinese
 #     from text.symbols import symbols
@@ -17,16 +19,55 @@ special = [
     # ('@', 'zh', "SP4")#不搞鬼畜了，和第二版保持一致吧
 ]
 
+language_module_maps = {
+    "v1": {"zh": "chinese", "ja": "japanese", "en": "english"},
+    "v2": {"zh": "chinese2", "ja": "japanese", "en": "english", "ko": "korean", "yue": "cantonese"},
+}
+
+# 各语言前端（g2pW ONNX 会话、CMU 词典、pyopenjtalk 等）在第一次用到时才导入
+_language_modules = {}
+_language_modules_lock = threading.Lock()
+
+
+def get_language_module_map(version):
+    return language_module_maps["v1" if version == "v1" else "v2"]
+
+
+def get_language_module(language, version=None):
+    """The frontend module of `language`, imported on first use."""
+    if version is None:
+        version = os.environ.get("version", "v2")
+    name = get_language_module_map(version)[language]
+    module = _language_modules.get(name)
+    if module is None:
+        with _language_modules_lock:
+            module = _language_modules.get(name)
+            if module is None:
+                module = importlib.import_module("text." + name)
+                _language_modules[name] = module
+    return module
+
+
+def preload(languages, version=None):
+    """
+    Import the frontends of `languages` now (e.g. ["zh"] for a Chinese-only deployment)
+    and run them once, so their models and dictionaries are not loaded by the first request.
+    """
+    if version is None:
+        version = os.environ.get("version", "v2")
+    language_module_map = get_language_module_map(version)
+    for language in languages:
+        language = language.replace("all_", "")
+        if language not in language_module_map:
+            continue
+        clean_text({"en": "Hello.", "ja": "こんにちは。", "ko": "안녕하세요."}.get(language, "你好。"), language, version)
+
 
 def clean_text(text, language, version=None):
     if version is None:
         version = os.environ.get("version", "v2")
-    if version == "v1":
-        symbols = symbols_v1.symbols
-        language_module_map = {"zh": "chinese", "ja": "japanese", "en": "english"}
-    else:
-        symbols = symbols_v2.symbols
-        language_module_map = {"zh": "chinese2", "ja": "japanese", "en": "english", "ko": "korean", "yue": "cantonese"}
+    symbols = symbols_v1.symbols if version == "v1" else symbols_v2.symbols
+    language_module_map = get_language_module_map(version)
 
     if language not in language_module_map:
         language = "en"
@@ -34,7 +75,7 @@ def clean_text(text, language, version=None):
     for special_s, special_l, target_symbol in special:
         if special_s in text and language == special_l:
             return clean_special(text, language, special_s, target_symbol, version)
-    language_module = __import__("text." + language_module_map[language], fromlist=[language_module_map[language]])
+    language_module = get_language_module(language, version)
     if hasattr(language_module, "text_normalize"):
         norm_text = language_module.text_normalize(text)
     else:
@@ -58,18 +99,13 @@ def clean_text(text, language, version=None):
 def clean_special(text, language, special_s, target_symbol, version=None):
     if version is None:
         version = os.environ.get("version", "v2")
-    if version == "v1":
-        symbols = symbols_v1.symbols
-        language_module_map = {"zh": "chinese", "ja": "japanese", "en": "english"}
-    else:
-        symbols = symbols_v2.symbols
-        language_module_map = {"zh": "chinese2", "ja": "japanese", "en": "english", "ko": "korean", "yue": "cantonese"}
+    symbols = symbols_v1.symbols if version == "v1" else symbols_v2.symbols
 
     """
     特殊静音段sp符号处理
     """
     text = text.replace(special_s, ",")
-    language_module = __import__("text." + language_module_map[language], fromlist=[language_module_map[language]])
+    language_module = get_language_module(language, version)
     norm_text = language_module.text_normalize(text)
     phones = language_module.g2p(norm_text)
     new_ph = []
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+说话人条件 (SV 向量 + ge) 缓存的端到端基准
+对同一段多 batch 文本跑 TTS.run，对比:
+  缓存开启: 参考音频设置时算一次 SV 向量和 ge，每个 batch 的 VITS 解码直接复用（当前实现）
+  缓存关闭: 每次 VITS 解码前重新跑 SV（fbank + ERes2NetV2）并重新算 ge（旧实现的行为）
+两次使用相同的随机种子，GPT 生成的语义 token 相同，耗时差即为每个 batch 重算的开销
+
+用法（在 text_to_speech 目录下运行）:
+  python benchmarks/bench_sv_embedding.py --batch-size 1 --repeat 3
+"""
+
+import os
+import sys
+import time
+import argparse
+
+now_dir = os.getcwd()
+sys.path.insert(0, now_dir)
+sys.path.insert(0, os.path.join(now_dir, "GPT_SoVITS"))
+
+import torch
+
+DEFAULT_REF = "logs/ZhuangFangyi_V1/reference_audio/zfy_raw_vocals.wav_0011840000_0012000960.wav"
+DEFAULT_REF_TEXT = "不用太拘谨，像从前一样，随意称呼就好"
+DEFAULT_TEXT = (
+    "管理员，好久不见。今天的天气很好，我们出去走走吧。路上记得带伞，傍晚可能会下雨。"
+    "晚饭想吃什么？我知道一家新开的店。听说那里的汤很不错。吃完饭我们再去书店看看。"
+)
+
+
+def disable_speaker_condition_cache(tts):
+    """让每次 VITS 解码都重新计算 SV 向量和 ge，返回解码次数计数器"""
+    decode = tts._vits_decode
+    calls = [0]
+
+    def uncached(codes, phones, refer_audio_spec, speed, sv_emb, speaker_condition):
+        refer_spec = tts.prompt_cache["refer_spec"]
+        if tts.is_v2pro:
+            refer_spec = [(spec, audio, tts.sv_model.compute_embedding3(audio)) for spec, audio, _ in refer_spec]
+            sv_emb = [emb for _, _, emb in refer_spec]
+        speaker_condition = tts._get_speaker_condition(refer_spec)
+        calls[0] += 1
+        return decode(codes, phones, refer_audio_spec, speed, sv_emb, speaker_condition)
+
+    tts._vits_decode = uncached
+    return calls
+
+
+def count_decodes(tts):
+    decode = tts._vits_decode
+    calls = [0]
+
+    def counted(*args, **kwargs):
+        calls[0] += 1
+        return decode(*args, **kwargs)
+
+    tts._vits_decode = counted
+    return calls
+
+
+def timed_run(tts, inputs, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        list(tts.run(dict(inputs)))
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speaker condition cache end-to-end benchmark")
+    parser.add_argument("--gpt", default="GPT_weights_v2/ZhuangFangyi_V1-e16.ckpt", help="GPT 权重")
+    parser.add_argument("--sovits", default="SoVITS_weights_v2/ZhuangFangyi_V1_e20_s300.pth", help="SoVITS 权重")
+    parser.add_argument("--version", default="v2Pro")
+    parser.add_argument("--ref-audio", default=DEFAULT_REF, help="参考音频路径")
+    parser.add_argument("--ref-text", default=DEFAULT_REF_TEXT, help="参考文本")
+    parser.add_argument("--text", default=DEFAULT_TEXT, help="合成文本（按句切分后分成多个 batch）")
+    parser.add_argument("--batch-size", type=int, default=1, help="TTS.run 的 batch_size，越小 batch 越多")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数（取最小值）")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--half", action="store_true", help="使用半精度（仅GPU）")
+    args = parser.parse_args()
+
+    from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
+
+    tts = TTS(TTS_Config({
+        "custom": {
+            "device": args.device,
+            "is_half": args.half and args.device != "cpu",
+            "version": args.version,
+            "t2s_weights_path": args.gpt,
+            "vits_weights_path": args.sovits,
+            "bert_base_path": "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large",
+            "cnhuhbert_base_path": "GPT_SoVITS/pretrained_models/chinese-hubert-base",
+        }
+    }, persist=False))
+    if tts.configs.use_vocoder:
+        print("⚠️  v3/v4 模型不使用 ge 缓存，这个基准只对 v1/v2/v2Pro 有意义")
+
+    inputs = {
+        "text": args.text,
+        "text_lang": "all_zh",
+        "ref_audio_path": args.ref_audio,
+        "prompt_text": args.ref_text,
+        "prompt_lang": "all_zh",
+        "text_split_method": "cut5",
+        "batch_size": args.batch_size,
+        "split_bucket": False,
+        "parallel_infer": True,
+        "seed": 1234,
+    }
+
+    # 预热（同时完成参考音频处理）
+    list(tts.run(dict(inputs)))
+
+    calls = count_decodes(tts)
+    cached = timed_run(tts, inputs, args.repeat)
+    decodes = calls[0] // args.repeat
+
+    tts._vits_decode = TTS._vits_decode.__get__(tts)
+    disable_speaker_condition_cache(tts)
+    uncached = timed_run(tts, inputs, args.repeat)
+
+    print("=" * 60)
+    print(f"设备: {args.device}  半精度: {tts.configs.is_half}  版本: {tts.configs.version}")
+    print(f"每次 TTS.run 的 VITS 解码次数: {decodes}")
+    print(f"缓存关闭 (旧): {uncached * 1000:.1f} ms / 请求")
+    print(f"缓存开启 (新): {cached * 1000:.1f} ms / 请求")
+    print(f"节省: {(uncached - cached) * 1000:.1f} ms ({(uncached - cached) * 1000 / max(decodes, 1):.1f} ms / batch)")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GPT (T2S) KV cache 微基准
+对比 "每步 torch.cat 增长 cache"、"预分配 T2SKVCache 原地写入" 与 "torch.compile 的单步解码"（--compile）的单 token 解码耗时
+--padded 时模拟左填充的 batch：对比每步 F.pad 一份 [batch, head, 1, len] 的 mask（旧的 batch 推理）与由 pad_lens 隐式给出 mask
+使用随机初始化的 Text2SemanticDecoder，不需要模型文件
+
+用法（在 text_to_speech 目录下运行）:
+  python benchmarks/bench_t2s_kv_cache.py --steps 1000 --device cpu
+  python benchmarks/bench_t2s_kv_cache.py --batch-size 16 --prompt-len 600 --padded
+"""
+
+import os
+import sys
+import time
+import argparse
+
+now_dir = os.getcwd()
+sys.path.insert(0, now_dir)
+sys.path.insert(0, os.path.join(now_dir, "GPT_SoVITS"))
+
+import torch
+
+MODEL_CONFIG = {
+    "model": {
+        "embedding_dim": 512,
+        "hidden_dim": 512,
+        "head": 16,
+        "n_layer": 24,
+        "vocab_size": 1025,
+        "phoneme_vocab_size": 732,
+        "dropout": 0,
+        "EOS": 1024,
+    }
+}
+
+
+def sync(device):
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="T2S KV cache benchmark")
+    parser.add_argument("--prompt-len", type=int, default=300, help="prefill 长度（音素 + 参考音频 token）")
+    parser.add_argument("--steps", type=int, default=1000, help="解码步数")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--compile", action="store_true", help="同时测试 torch.compile 的单步解码（先预编译）")
+    parser.add_argument("--padded", action="store_true", help="各行左填充不同长度（最多 prefill 的一半），带 mask 解码")
+    args = parser.parse_args()
+
+    from GPT_SoVITS.AR.models.t2s_model import T2SKVCache, Text2SemanticDecoder
+
+    model = Text2SemanticDecoder(MODEL_CONFIG).to(args.device).eval()
+    transformer = model.t2s_transformer
+    dim = MODEL_CONFIG["model"]["hidden_dim"]
+
+    with torch.no_grad():
+        prompt = torch.randn(args.batch_size, args.prompt_len, dim, device=args.device)
+        mask = torch.zeros(1, 1, args.prompt_len, args.prompt_len, dtype=torch.bool, device=args.device)
+        _, k_cache, v_cache = transformer.process_prompt(prompt, mask, None)
+        x = torch.randn(args.batch_size, 1, dim, device=args.device)
+        pad_lens = None
+        if args.padded:
+            pad_lens = torch.randint(0, args.prompt_len // 2 + 1, (args.batch_size,), device=args.device)
+
+        def run_cat():
+            k = [t.clone() for t in k_cache]
+            v = [t.clone() for t in v_cache]
+            attn_mask = None
+            if pad_lens is not None:
+                # 旧的 batch 推理：每个 head 一份 mask，每步 F.pad 出新的一列
+                attn_mask = torch.arange(args.prompt_len, device=args.device).view(1, 1, 1, -1) < pad_lens.view(-1, 1, 1, 1)
+                attn_mask = attn_mask.expand(-1, model.num_head, -1, -1).contiguous()
+            for _ in range(args.steps):
+                if attn_mask is not None:
+                    attn_mask = torch.nn.functional.pad(attn_mask, (0, 1), value=False)
+                _, k, v = transformer.decode_next_token(x, k, v, attn_mask)
+
+        def run_static():
+            kv_cache = T2SKVCache(k_cache, v_cache, args.prompt_len + args.steps, pad_lens=pad_lens)
+            for _ in range(args.steps):
+                kv_cache.decode_next_token(transformer, x)
+
+        def run_compiled():
+            kv_cache = T2SKVCache(k_cache, v_cache, args.prompt_len + args.steps, model.compiled_decode, pad_lens)
+            for _ in range(args.steps):
+                kv_cache.decode_next_token(transformer, x)
+
+        benchmarks = [("torch.cat", run_cat), ("static", run_static)]
+        if args.compile:
+            model.enable_compiled_decode((args.batch_size,))
+            benchmarks.append(("compiled", run_compiled))
+
+        results = {}
+        for name, fn in benchmarks:
+            fn()  # 预热
+            sync(args.device)
+            start = time.perf_counter()
+            fn()
+            sync(args.device)
+            results[name] = (time.perf_counter() - start) / args.steps
+
+    print("=" * 60)
+    print(f"设备: {args.device}  batch: {args.batch_size}  prefill: {args.prompt_len}  步数: {args.steps}  左填充: {args.padded}")
+    for name, per_token in results.items():
+        print(f"{name:10s}: {per_token * 1000:.2f} ms / token")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GPT (T2S) 并发吞吐基准
+对比 N 个并发客户端下 "逐条 infer_panel（加锁串行）" 与 "T2SScheduler 连续批处理" 的总 token/s
+
+用法（在 text_to_speech 目录下运行）:
+  python benchmarks/bench_t2s_scheduler.py --clients 8 --device cpu
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+
+now_dir = os.getcwd()
+sys.path.insert(0, now_dir)
+sys.path.insert(0, os.path.join(now_dir, "GPT_SoVITS"))
+
+import torch
+
+DEFAULT_GPT = "GPT_weights_v2/ZhuangFangyi_V1-e16.ckpt"
+
+
+def load_t2s(path, device, is_half):
+    from GPT_SoVITS.AR.models.t2s_lightning_module import Text2SemanticLightningModule
+
+    dict_s1 = torch.load(path, map_location="cpu", weights_only=False)
+    t2s_model = Text2SemanticLightningModule(dict_s1["config"], "****", is_train=False)
+    t2s_model.load_state_dict(dict_s1["weight"])
+    if is_half:
+        t2s_model = t2s_model.half()
+    return t2s_model.to(device).eval().model
+
+
+def make_inputs(clients, phones, prompt_len, device, dtype):
+    # 随机文本/参考 token 足以衡量解码吞吐
+    generator = torch.Generator().manual_seed(0)
+    inputs = []
+    for _ in range(clients):
+        x = torch.randint(0, 300, (phones,), generator=generator).to(device)
+        bert = torch.zeros(1024, phones, dtype=dtype, device=device)
+        prompt = torch.randint(0, 1024, (prompt_len,), generator=generator).to(device)
+        inputs.append((x, prompt, bert))
+    return inputs
+
+
+def run_clients(inputs, fn):
+    counts = [0] * len(inputs)
+
+    def worker(i):
+        counts[i] = fn(*inputs[i])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(inputs))]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="T2S continuous batching throughput benchmark")
+    parser.add_argument("--gpt-model", default=DEFAULT_GPT, help="GPT 模型路径")
+    parser.add_argument("--clients", type=int, default=8, help="并发客户端数")
+    parser.add_argument("--phones", type=int, default=80, help="每个请求的音素数")
+    parser.add_argument("--prompt-len", type=int, default=150, help="参考音频 token 数")
+    parser.add_argument("--max-tokens", type=int, default=300, help="每个请求最多生成的 token 数")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--half", action="store_true", help="使用半精度（仅GPU）")
+    args = parser.parse_args()
+
+    from GPT_SoVITS.AR.models.t2s_scheduler import T2SScheduler
+
+    is_half = args.half and args.device != "cpu"
+    dtype = torch.float16 if is_half else torch.float32
+    model = load_t2s(args.gpt_model, args.device, is_half)
+    inputs = make_inputs(args.clients, args.phones, args.prompt_len, args.device, dtype)
+    lock = threading.Lock()
+
+    def serial(x, prompt, bert):
+        with lock, torch.no_grad():
+            y, idx = model.infer_panel(
+                x.unsqueeze(0),
+                torch.tensor([x.shape[0]], device=x.device),
+                prompt.unsqueeze(0),
+                bert.unsqueeze(0),
+                top_k=15,
+                early_stop_num=args.max_tokens,
+            )
+        return idx
+
+    scheduler = T2SScheduler(model, max_batch_size=args.clients)
+
+    def batched(x, prompt, bert):
+        y, idx = scheduler.infer(x, prompt, bert, top_k=15, early_stop_num=args.max_tokens)
+        return idx
+
+    # 预热
+    serial(*inputs[0])
+    batched(*inputs[0])
+
+    serial_tokens, serial_time = run_clients(inputs, serial)
+    batched_tokens, batched_time = run_clients(inputs, batched)
+    scheduler.close()
+
+    print("=" * 60)
+    print(f"设备: {args.device}  半精度: {is_half}  并发客户端: {args.clients}")
+    print(f"逐条串行   : {serial_tokens} tokens / {serial_time:.2f}s = {serial_tokens / serial_time:.1f} tokens/s")
+    print(f"连续批处理 : {batched_tokens} tokens / {batched_time:.2f}s = {batched_tokens / batched_time:.1f} tokens/s")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,8 @@
 
 import os
 import sys
+import json
+import time
 import argparse
 from pathlib import Path
 
@@ -18,11 +20,34 @@ sys.path.insert(0, now_dir)
 # 添加 GPT_SoVITS 到 sys.path，以便 torch.load 能找到 utils 模块
 sys.path.insert(0, os.path.join(now_dir, "GPT_SoVITS"))
 
+import numpy as np
 import torch
 
 class ZhuangFangyiTTS:
-    def __init__(self):
-        """初始化 TTS 模型"""
+    DEFAULT_VOICE = "ZhuangFangyi"
+    # 预热用的典型长度：单句短文本、两句、多句长段落
+    WARMUP_TEXTS = [
+        "你好。",
+        "管理员，好久不见。不用太拘谨，像从前一样，随意称呼就好。",
+        "今天的任务已经安排好了。先去港口确认物资的情况，再回来汇报。路上注意安全，有什么问题随时联系我。"
+        "等一切都结束以后，我们再找个安静的地方，慢慢聊聊这些年发生的事情。",
+    ]
+    
+    def __init__(self, t2s_batch_size=8, batch_size=8, voice_memory_mb=4096, voices_file="voices.json",
+                 onnx_dir=None, compile_t2s=False, time_stretch=False, batch_token_budget=0):
+        """
+        初始化 TTS 模型
+
+        参数:
+            t2s_batch_size: 并发请求共享 GPT 解码 batch 的最大序列数（0 表示逐条推理）
+            batch_size: 单个请求内按句切分后并行推理的 batch 大小
+            batch_token_budget: 分桶时每个 batch 的 token 上限（batch 大小 ×（最长预填充 + 最长预测生成长度）），0 表示只按 batch_size 限制
+            voice_memory_mb: 常驻音色的 GPT/SoVITS 权重总大小上限（MB），超出时卸载最久未用的音色
+            voices_file: 额外音色的配置文件（JSON），不存在时只有默认音色
+            onnx_dir: export_onnx_backend.py 导出的计算图目录，设置后在 CPU 上用 ONNX Runtime 推理
+            compile_t2s: 用 torch.compile 编译 GPT 的单步解码（启动时预编译，较慢），解码更快
+            time_stretch: 语速不为 1 时按原速合成再变速（WSOLA，不变调），仍可分桶并行、走 ONNX 后端
+        """
         print("🎤 正在加载庄方宜语音模型...")
         
         # 配置路径
@@ -33,6 +58,13 @@ class ZhuangFangyiTTS:
         self.reference_audio = "logs/ZhuangFangyi_V1/reference_audio/zfy_raw_vocals.wav_0011840000_0012000960.wav"
         self.reference_text = "不用太拘谨，像从前一样，随意称呼就好"
         
+        # 语言与切句方式（TTS_infer_pack 的语言代码，all_zh 即 WebUI 的"中文"）
+        self.language = "all_zh"
+        self.text_split_method = "cut5"
+        self.batch_size = batch_size
+        self.time_stretch = time_stretch
+        self.batch_token_budget = batch_token_budget
+        
         # 检查模型文件
         if not os.path.exists(self.gpt_model_path):
             raise FileNotFoundError(f"GPT 模型未找到: {self.gpt_model_path}")
@@ -41,27 +73,217 @@ class ZhuangFangyiTTS:
         if not os.path.exists(self.reference_audio):
             raise FileNotFoundError(f"参考音频未找到: {self.reference_audio}")
         
-        # 导入推理模块
-        from GPT_SoVITS.inference_webui import get_tts_wav, change_sovits_weights, change_gpt_weights
+        # 导入推理模块（TTS_infer_pack 不依赖 gradio，模型都在实例内，不使用 WebUI 的全局变量）
+        from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
+        from GPT_SoVITS.TTS_infer_pack.voice_registry import Voice, VoiceRegistry
+        from GPT_SoVITS.frontend_cache import FrontendCache
+        from GPT_SoVITS.ref_feature_store import RefFeatureStore
         
-        self.get_tts_wav = get_tts_wav
+        # ONNX Runtime 后端只支持 CPU + fp32
+        use_cuda = torch.cuda.is_available() and not onnx_dir
+        is_half = os.environ.get("is_half", "True") == "True" and use_cuda
+        tts_config = TTS_Config({
+            "custom": {
+                "device": "cuda" if use_cuda else "cpu",
+                "is_half": is_half,
+                "version": os.environ.get("version", "v2Pro"),
+                "t2s_weights_path": self.gpt_model_path,
+                "vits_weights_path": self.sovits_model_path,
+                "bert_base_path": "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large",
+                "cnhuhbert_base_path": "GPT_SoVITS/pretrained_models/chinese-hubert-base",
+            }
+        })
         
         # 加载模型
-        print("📦 加载 GPT 模型...")
-        change_gpt_weights(self.gpt_model_path)
+        print("📦 加载 GPT / SoVITS 模型...")
+        self.tts = TTS(tts_config)
+        
+        # 参考音频特征缓存：按参考音频内容哈希索引，内存LRU+磁盘两级
+        self.tts.ref_feature_store = RefFeatureStore(
+            capacity=int(os.environ.get("ref_cache_size", 8)),
+            cache_dir=os.environ.get("ref_cache_dir", "TEMP/ref_feature_cache") or None,
+            disk_capacity=int(os.environ.get("ref_cache_disk_size", 256)),
+        )
+        
+        # 文本前端缓存：常用回复和固定的参考文本直接复用音素（以及 BERT 特征）
+        self.tts.text_preprocessor.frontend_cache = FrontendCache(
+            capacity=int(os.environ.get("frontend_cache_size", 4096)),
+            bert_capacity=int(os.environ.get("frontend_bert_cache_size", 256)),
+        )
         
-        print("📦 加载 SoVITS 模型...")
-        # change_sovits_weights 是生成器，需要遍历执行
-        # 传入语言参数以避免未初始化的变量错误
-        for _ in change_sovits_weights(self.sovits_model_path, prompt_language="中文", text_language="中文"):
-            pass
+        ort_threads = int(os.environ.get("ort_threads", 0))
+        # 预编译的解码 batch 大小；其余大小仍按原方式解码
+        max_decode_batch = t2s_batch_size if t2s_batch_size > 0 else batch_size
+        compile_batch_sizes = [b for b in (1, 2, 4, 8, 16) if b <= max_decode_batch]
+        
+        def setup_voice(tts, voice):
+            # 所有 Flask 线程共用同一个实例，一个请求出错不能重新加载其他请求正在用的模型
+            tts.reset_on_error = False
+            if voice.onnx_dir:
+                # GPT / SoVITS / BERT / CNHubert 走 ONNX Runtime，不再需要 GPT 连续批处理
+                tts.enable_ort_backend(voice.onnx_dir, intra_op_num_threads=ort_threads)
+                return
+            if t2s_batch_size > 0:
+                # 多线程调用时，GPT 解码在同一个连续批处理循环里进行（每个音色一个）
+                tts.enable_t2s_scheduler(t2s_batch_size)
+            if compile_t2s:
+                tts.enable_compiled_decode(compile_batch_sizes)
+        
+        default_voice = Voice(self.DEFAULT_VOICE, self.gpt_model_path, self.sovits_model_path,
+                              self.reference_audio, self.reference_text, self.language, onnx_dir=onnx_dir)
+        setup_voice(self.tts, default_voice)
+        self.t2s_scheduler = self.tts.t2s_scheduler
+        
+        # 多音色：每个音色只加载自己的 GPT/SoVITS 权重，BERT/CNHubert/SV 等与默认音色共用
+        self.voices = VoiceRegistry(
+            self.tts,
+            default_voice,
+            memory_budget_mb=voice_memory_mb,
+            setup=setup_voice,
+        )
+        if voices_file and os.path.exists(voices_file):
+            self.load_voices(voices_file)
         
         print("✅ 模型加载完成！\n")
     
+    def warmup(self, texts=None, voice=None, streaming=True):
+        """
+        预热：按几种典型长度各合成一次（可选再跑一次分块流式），
+        jieba / g2pW / BERT 的首次加载、参考音频特征、前端缓存和各个算子的首次初始化都在这里完成，
+        不再落到第一个真实请求上
+        
+        返回:
+            [(文本, 耗时秒数), ...]
+        """
+        texts = texts or self.WARMUP_TEXTS
+        timings = []
+        # 各语言前端按需导入，这里只加载用得到的（默认只有中文）
+        t0 = time.perf_counter()
+        self.tts.text_preprocessor.preload([self.language], self.tts.configs.version)
+        timings.append(("[frontend] " + self.language, time.perf_counter() - t0))
+        for text in texts:
+            t0 = time.perf_counter()
+            self.synthesize(text, voice=voice)
+            timings.append((text, time.perf_counter() - t0))
+        if streaming:
+            t0 = time.perf_counter()
+            for _ in self.generate_stream(texts[-1], streaming_mode=True, voice=voice):
+                pass
+            timings.append(("[stream] " + texts[-1], time.perf_counter() - t0))
+        for text, seconds in timings:
+            print(f"🔥 预热 {seconds:.2f}s: {text[:20]}{'...' if len(text) > 20 else ''}")
+        return timings
+    
+    def register_voice(self, name, gpt_model, sovits_model, reference_audio, reference_text="", reference_lang=None,
+                       onnx_dir=None):
+        """注册一个音色，第一次使用时才加载权重；onnx_dir 为该音色导出的 ONNX 计算图目录"""
+        from GPT_SoVITS.TTS_infer_pack.voice_registry import Voice
+        
+        if not os.path.exists(reference_audio):
+            raise FileNotFoundError(f"参考音频未找到: {reference_audio}")
+        self.voices.register(Voice(name, gpt_model, sovits_model, reference_audio,
+                                   reference_text, reference_lang or self.language, onnx_dir))
+    
+    @staticmethod
+    def list_profiles():
+        """可用的 CFM 采样档位及其参数（步数 / 求解器 / sway 系数）"""
+        from GPT_SoVITS.TTS_infer_pack.TTS import CFM_PROFILES
+        return {name: dict(profile) for name, profile in CFM_PROFILES.items()}
+    
+    def load_voices(self, voices_file):
+        """
+        从 JSON 文件注册音色，格式:
+        {"音色名": {"gpt_model": "...", "sovits_model": "...", "reference_audio": "...", "reference_text": "..."}}
+        """
+        with open(voices_file, 'r', encoding='utf-8') as f:
+            voices = json.load(f)
+        for name, voice in voices.items():
+            try:
+                self.register_voice(name, **voice)
+                print(f"🎙️ 已注册音色: {name}")
+            except Exception as e:
+                print(f"⚠️ 音色 {name} 注册失败: {str(e)}")
+    
+    def _make_inputs(self, voice, text, reference_audio, reference_text, top_k, top_p, temperature, speed,
+                     profile=None, **kwargs):
+        """组装 TTS.run 的输入，参考音频默认使用音色自带的"""
+        inputs = {
+            "text": text,
+            "text_lang": self.language,
+            "ref_audio_path": reference_audio or voice.ref_audio_path,
+            "prompt_text": reference_text or voice.prompt_text,
+            "prompt_lang": voice.prompt_lang,
+            "top_k": top_k,
+            "top_p": top_p,
+            "temperature": temperature,
+            "text_split_method": self.text_split_method,
+            "batch_size": self.batch_size,
+            "split_bucket": True,
+            "batch_token_budget": self.batch_token_budget,
+            "parallel_infer": True,
+            "speed_factor": speed,
+            "speed_method": "time_stretch" if self.time_stretch else "model",
+            "fragment_interval": 0.3,
+            # v3/v4 音色的 CFM 采样档位，None 时用 TTS 的默认（32 步 euler）
+            "cfm_profile": profile,
+        }
+        inputs.update(kwargs)
+        return inputs
+    
+    def synthesize(self, text, reference_audio=None, reference_text=None,
+                   top_k=15, top_p=1.0, temperature=1.0, speed=1.0, voice=None, profile=None):
+        """
+        合成语音，结果留在内存中
+        
+        参数同 generate（没有 output_path）
+        
+        返回:
+            (sample_rate, audio_int16) 元组，audio_int16 为一维 numpy 数组
+        """
+        with self.voices.acquire(voice) as (tts, voice):
+            inputs = self._make_inputs(voice, text, reference_audio, reference_text, top_k, top_p, temperature, speed,
+                                       profile=profile)
+            
+            print(f"🎯 开始合成 [{voice.name}]: {text[:30]}{'...' if len(text) > 30 else ''}")
+            print(f"📝 参考文本: {inputs['prompt_text'][:30]}{'...' if len(inputs['prompt_text']) > 30 else ''}")
+            
+            # 必须把生成器跑完：TTS.run 的异常在迭代过程中抛出
+            results = list(tts.run(inputs))
+        if not results:
+            raise RuntimeError("生成失败，没有返回音频数据")
+        
+        sr = results[0][0]
+        if len(results) == 1:
+            return sr, results[0][1]
+        return sr, np.concatenate([audio for _, audio in results])
+    
+    def synthesize_batch(self, texts, reference_audio=None, reference_text=None,
+                         top_k=15, top_p=1.0, temperature=1.0, speed=1.0, voice=None, profile=None):
+        """
+        批量合成多条文本，所有文本共用一次参考音频处理，分句后一起按长度分桶推理
+        
+        参数同 synthesize，texts 为文本列表
+        
+        返回:
+            [(sample_rate, audio_int16), ...]，与 texts 一一对应
+        """
+        texts = list(texts)
+        with self.voices.acquire(voice) as (tts, voice):
+            inputs = self._make_inputs(voice, texts, reference_audio, reference_text, top_k, top_p, temperature, speed,
+                                       profile=profile)
+            
+            print(f"🎯 开始批量合成 [{voice.name}]: {len(texts)} 条文本")
+            
+            # 同 synthesize，必须把生成器跑完才能拿到异常
+            results = list(tts.run(inputs))
+        if len(results) != len(texts):
+            raise RuntimeError(f"批量生成失败，返回 {len(results)} 段音频，应为 {len(texts)} 段")
+        return results
+    
     def generate(self, text, output_path=None, reference_audio=None, reference_text=None,
-                 top_k=15, top_p=1.0, temperature=1.0, speed=1.0):
+                 top_k=15, top_p=1.0, temperature=1.0, speed=1.0, voice=None, profile=None):
         """
-        生成语音
+        生成语音并保存为文件
         
         参数:
             text: 要合成的文本
@@ -72,15 +294,14 @@ class ZhuangFangyiTTS:
             top_p: GPT 采样参数
             temperature: GPT 采样参数
             speed: 语速调节
+            voice: 音色名（默认庄方宜）
+            profile: CFM 采样档位（"fast" / "balanced" / "quality" / "adaptive"），只对 v3/v4 音色生效，
+                     见 list_profiles()；默认 None 即 32 步 euler
         
         返回:
             生成的音频文件路径
         """
         
-        # 使用默认参考音频
-        ref_audio = reference_audio or self.reference_audio
-        ref_text = reference_text or self.reference_text
-        
         # 生成输出路径
         if output_path is None:
             os.makedirs("outputs", exist_ok=True)
@@ -88,36 +309,24 @@ class ZhuangFangyiTTS:
             timestamp = time.strftime("%Y%m%d_%H%M%S")
             output_path = f"outputs/zfy_{timestamp}.wav"
         
-        print(f"🎯 开始合成: {text[:30]}{'...' if len(text) > 30 else ''}")
-        print(f"📝 参考文本: {ref_text[:30]}{'...' if len(ref_text) > 30 else ''}")
-        
         try:
-            # 调用推理函数
-            result = self.get_tts_wav(
-                ref_wav_path=ref_audio,
-                prompt_text=ref_text,
-                prompt_language="中文",  # 使用中文键名
-                text=text,
-                text_language="中文",  # 使用中文键名
-                how_to_cut="不切",
+            sr, audio_data = self.synthesize(
+                text,
+                reference_audio=reference_audio,
+                reference_text=reference_text,
                 top_k=top_k,
                 top_p=top_p,
                 temperature=temperature,
-                ref_free=False,
                 speed=speed,
-                if_freeze=""
+                voice=voice,
+                profile=profile
             )
             
-            # 获取生成的音频
-            for sr, audio_data in result:
-                if audio_data is not None:
-                    # 保存音频
-                    import soundfile as sf
-                    sf.write(output_path, audio_data, sr)
-                    print(f"✅ 音频已保存: {output_path}")
-                    return output_path
-            
-            raise RuntimeError("生成失败，没有返回音频数据")
+            # 保存音频
+            import soundfile as sf
+            sf.write(output_path, audio_data, sr)
+            print(f"✅ 音频已保存: {output_path}")
+            return output_path
             
         except Exception as e:
             print(f"❌ 生成失败: {str(e)}")
@@ -125,16 +334,67 @@ class ZhuangFangyiTTS:
             traceback.print_exc()
             return None
     
-    def batch_generate(self, texts, output_dir="outputs"):
-        """批量生成语音"""
+    def generate_stream(self, text, reference_audio=None, reference_text=None,
+                        top_k=15, top_p=1.0, temperature=1.0, speed=1.0, streaming_mode=False, voice=None,
+                        profile=None):
+        """
+        流式生成语音，不落盘
+        
+        参数同 generate，另外:
+            streaming_mode: False 时每合成完一句产出一段（音质最好）；
+                            True 时按语义 token 分块产出（首包更快，音质略降）
+        
+        产出:
+            (sample_rate, audio_int16) 元组，audio_int16 为一维 numpy 数组
+        """
+        # 生成器结束（或被关闭）前音色不会被卸载
+        with self.voices.acquire(voice) as (tts, voice):
+            inputs = self._make_inputs(
+                voice, text, reference_audio, reference_text, top_k, top_p, temperature, speed,
+                profile=profile,
+                batch_size=1,
+                split_bucket=False,
+                parallel_infer=not streaming_mode,
+                return_fragment=not streaming_mode,
+                streaming_mode=streaming_mode,
+                # 第一块只攒 8 个语义 token（约 0.3 秒）就开始合成，之后按默认块长
+                first_chunk_length=8,
+            )
+            
+            print(f"🎯 开始流式合成 [{voice.name}]: {text[:30]}{'...' if len(text) > 30 else ''}")
+            
+            for sr, audio_data in tts.run(inputs):
+                if audio_data is not None and len(audio_data) > 0:
+                    yield sr, audio_data
+    
+    def batch_generate(self, texts, output_dir="outputs", chunk_size=32, voice=None):
+        """
+        批量生成语音
+        
+        每 chunk_size 条文本走一次批量推理，耗时随批次数而不是行数增长；
+        某一批失败时只影响该批
+        """
         os.makedirs(output_dir, exist_ok=True)
+        import soundfile as sf
         results = []
         
-        for i, text in enumerate(texts, 1):
-            print(f"\n[{i}/{len(texts)}] 处理中...")
-            output_path = os.path.join(output_dir, f"zfy_{i:03d}.wav")
-            result = self.generate(text, output_path)
-            results.append(result)
+        for start in range(0, len(texts), chunk_size):
+            chunk = texts[start:start + chunk_size]
+            print(f"\n[{start + 1}-{start + len(chunk)}/{len(texts)}] 处理中...")
+            try:
+                audios = self.synthesize_batch(chunk, voice=voice)
+            except Exception as e:
+                print(f"❌ 生成失败: {str(e)}")
+                import traceback
+                traceback.print_exc()
+                results.extend([None] * len(chunk))
+                continue
+            
+            for i, (sr, audio_data) in enumerate(audios, start + 1):
+                output_path = os.path.join(output_dir, f"zfy_{i:03d}.wav")
+                sf.write(output_path, audio_data, sr)
+                print(f"✅ 音频已保存: {output_path}")
+                results.append(output_path)
         
         return results
 
@@ -156,12 +416,16 @@ def main():
   
   # 调整语速和参数
   python simple_tts.py "快点说话" --speed 1.2 --temperature 0.8
+  
+  # 使用 voices.json 中注册的其他音色
+  python simple_tts.py "你好" --voice 其他音色
         """
     )
     
     parser.add_argument("text", nargs="?", help="要合成的文本")
     parser.add_argument("-o", "--output", help="输出文件路径")
     parser.add_argument("-f", "--file", help="从文件读取文本（每行一句）")
+    parser.add_argument("--voice", help="音色名（见 voices.json，默认庄方宜）")
     parser.add_argument("--ref-audio", help="参考音频路径（覆盖默认）")
     parser.add_argument("--ref-text", help="参考文本（覆盖默认）")
     parser.add_argument("--speed", type=float, default=1.0, help="语速 (0.5-2.0)")
@@ -185,7 +449,7 @@ def main():
             with open(args.file, 'r', encoding='utf-8') as f:
                 texts = [line.strip() for line in f if line.strip()]
             print(f"📄 从文件读取了 {len(texts)} 行文本\n")
-            tts.batch_generate(texts)
+            tts.batch_generate(texts, voice=args.voice)
         
         # 单句处理
         elif args.text:
@@ -197,7 +461,8 @@ def main():
                 top_k=args.top_k,
                 top_p=args.top_p,
                 temperature=args.temperature,
-                speed=args.speed
+                speed=args.speed,
+                voice=args.voice
             )
         
         print("\n🎉 全部完成！")
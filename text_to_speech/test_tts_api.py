@@ -75,6 +75,35 @@ def test_single_generation():
     print()
 
 
+def test_stream_generation():
+    """测试流式语音生成"""
+    print("=== 测试流式语音生成 ===")
+    
+    data = {
+        "text": "管理员，好久不见。不用太拘谨，像从前一样，随意称呼就好。",
+        "format": "wav"
+    }
+    
+    print(f"请求数据: {json.dumps(data, indent=2, ensure_ascii=False)}")
+    
+    start_time = time.time()
+    first_chunk_time = None
+    total_bytes = 0
+    with requests.post(f"{BASE_URL}/api/tts/stream", json=data, stream=True) as response:
+        print(f"状态码: {response.status_code}")
+        print(f"采样率: {response.headers.get('X-Sample-Rate')}")
+        with open("stream_test.wav", "wb") as f:
+            for chunk in response.iter_content(chunk_size=None):
+                if first_chunk_time is None:
+                    first_chunk_time = time.time() - start_time
+                total_bytes += len(chunk)
+                f.write(chunk)
+    
+    print(f"首包耗时: {first_chunk_time:.2f}s" if first_chunk_time is not None else "未收到数据")
+    print(f"总耗时: {time.time() - start_time:.2f}s, 共 {total_bytes} 字节 -> stream_test.wav")
+    print()
+
+
 def test_batch_generation():
     """测试批量语音生成"""
     print("=== 测试批量语音生成 ===")
@@ -172,10 +201,13 @@ def main():
         # 4. 自定义参数
         test_custom_parameters()
         
-        # 5. 批量生成
+        # 5. 流式生成
+        test_stream_generation()
+        
+        # 6. 批量生成
         test_batch_generation()
         
-        # 6. 列出文件
+        # 7. 列出文件
         test_list_files()
         
         print("=" * 70)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多音色声码器共用测试
+先加载一个 v3 音色、再加载一个 v4 音色，检查两者各自保留自己的声码器参数（sr / T_chunk），
+且每个版本的声码器只加载一次、由所有音色共用
+
+用法（在 text_to_speech 目录下运行，需要 v3 / v4 的 GPT + SoVITS 权重和预训练声码器）:
+  python test_vocoder_sharing.py --v3-gpt xxx.ckpt --v3-sovits xxx.pth --v4-gpt xxx.ckpt --v4-sovits xxx.pth
+"""
+
+import os
+import sys
+import argparse
+
+now_dir = os.getcwd()
+sys.path.insert(0, now_dir)
+sys.path.insert(0, os.path.join(now_dir, "GPT_SoVITS"))
+
+DEFAULT_REF = "logs/ZhuangFangyi_V1/reference_audio/zfy_raw_vocals.wav_0011840000_0012000960.wav"
+
+
+def check_vocoder(tts, version):
+    from GPT_SoVITS.TTS_infer_pack.TTS import VOCODER_CONFIGS
+
+    expected = VOCODER_CONFIGS[version]
+    print(f"  {version}: sr={tts.vocoder_configs['sr']}  T_chunk={tts.vocoder_configs['T_chunk']}  "
+          f"vocoder={tts.vocoder.__class__.__name__}")
+    assert tts.vocoder_configs == expected, f"{version} 音色的声码器参数被改成了 {tts.vocoder_configs}"
+    assert tts.vocoder is tts.vocoders[version], f"{version} 音色没有使用共用的声码器"
+
+
+def check_v3_then_v4(base, args):
+    """依次加载 v3、v4 音色，两者的声码器参数互不影响"""
+    from GPT_SoVITS.TTS_infer_pack.voice_registry import Voice, VoiceRegistry
+
+    print("=== 测试 v3 / v4 音色的声码器参数 ===")
+    registry = VoiceRegistry(
+        base, Voice("base", args.base_gpt, args.base_sovits, args.ref_audio), memory_budget_mb=1 << 20
+    )
+    registry.register(Voice("v3", args.v3_gpt, args.v3_sovits, args.ref_audio))
+    registry.register(Voice("v4", args.v4_gpt, args.v4_sovits, args.ref_audio))
+
+    with registry.acquire("v3") as (tts_v3, _):
+        check_vocoder(tts_v3, "v3")
+        with registry.acquire("v4") as (tts_v4, _):
+            check_vocoder(tts_v4, "v4")
+            # v4 加载之后，v3 音色的参数和声码器不变
+            check_vocoder(tts_v3, "v3")
+            assert tts_v3.vocoders is tts_v4.vocoders is base.vocoders, "声码器没有在音色之间共用"
+
+    if args.v3_gpt_2 and args.v3_sovits_2:
+        # 第二个 v3 音色复用已经加载的 BigVGAN
+        registry.register(Voice("v3_2", args.v3_gpt_2, args.v3_sovits_2, args.ref_audio))
+        with registry.acquire("v3_2") as (tts_v3_2, _):
+            check_vocoder(tts_v3_2, "v3")
+            assert tts_v3_2.vocoder is tts_v3.vocoder, "第二个 v3 音色重新加载了声码器"
+    print("✅ 通过\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vocoder sharing between v3 / v4 voices")
+    parser.add_argument("--base-gpt", default="GPT_weights_v2/ZhuangFangyi_V1-e16.ckpt")
+    parser.add_argument("--base-sovits", default="SoVITS_weights_v2/ZhuangFangyi_V1_e20_s300.pth")
+    parser.add_argument("--base-version", default="v2Pro")
+    parser.add_argument("--v3-gpt", required=True)
+    parser.add_argument("--v3-sovits", required=True)
+    parser.add_argument("--v4-gpt", required=True)
+    parser.add_argument("--v4-sovits", required=True)
+    parser.add_argument("--v3-gpt-2", default=None, help="可选，第二个 v3 音色")
+    parser.add_argument("--v3-sovits-2", default=None)
+    parser.add_argument("--ref-audio", default=DEFAULT_REF)
+    args = parser.parse_args()
+
+    from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
+
+    base = TTS(TTS_Config({
+        "custom": {
+            "device": "cpu",
+            "is_half": False,
+            "version": args.base_version,
+            "t2s_weights_path": args.base_gpt,
+            "vits_weights_path": args.base_sovits,
+            "bert_base_path": "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large",
+            "cnhuhbert_base_path": "GPT_SoVITS/pretrained_models/chinese-hubert-base",
+        }
+    }, persist=False))
+
+    check_v3_then_v4(base, args)
+
+
+if __name__ == "__main__":
+    main()
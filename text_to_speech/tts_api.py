@@ -10,8 +10,13 @@ import sys
 import json
 import time
 import uuid
+import base64
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 
@@ -23,6 +28,28 @@ from werkzeug.utils import secure_filename
 USE_GPU = True  # 设置为 False 使用 CPU
 USE_HALF_PRECISION = True  # GPU 半精度加速（仅GPU模式有效）
 
+# 并发配置
+T2S_BATCH_SIZE = 8  # 并发请求共享 GPT 解码 batch 的最大序列数（0 表示逐条推理）
+BATCH_CHUNK_SIZE = 32  # /api/tts/batch 每次批量推理的文本条数
+BATCH_TOKEN_BUDGET = 0  # 分桶时每个 batch 的 token 上限（按音素数和预测的语义长度估算），0 表示只按 batch 大小限制
+
+# GPT 单步解码用 torch.compile 编译（启动时预编译各个形状，启动变慢，解码更快）
+COMPILE_T2S = False
+
+# 语速不为 1 时按原速合成再变速（WSOLA，不变调），而不是让 SoVITS 按语速解码；可以继续分桶并行、走 ONNX 后端
+TIME_STRETCH = False
+
+# ONNX Runtime 后端（仅 CPU）：设置为 export_onnx_backend.py 的导出目录，如 "onnx/ZhuangFangyi"
+ONNX_DIR = None
+
+# 启动配置
+EAGER_INIT = True  # 启动时就在后台加载模型，而不是等第一个请求；完成前 /api/tts/health/ready 返回 503
+WARMUP = True  # 加载后按几种典型长度各合成一次，预热前端和各个模型
+
+# 多音色配置
+VOICES_FILE = "voices.json"  # 额外音色（不存在时只有默认的庄方宜）
+VOICE_MEMORY_MB = 4096  # 常驻音色 GPT/SoVITS 权重总大小上限，超出时卸载最久未用的音色
+
 # 设置环境变量
 os.environ["version"] = "v2Pro"
 os.environ["is_half"] = "True" if (USE_GPU and USE_HALF_PRECISION) else "False"
@@ -43,8 +70,19 @@ CORS(app)
 
 # 全局 TTS 实例
 tts_instance = None
+tts_lock = threading.Lock()
+
+# 启动状态：starting -> loading -> warming_up -> ready，出错为 failed（仅 EAGER_INIT）
+startup_state = {"state": "starting", "error": None, "warmup": []}
+started_at = time.time()
+ready_at = None
 OUTPUT_DIR = "outputs"
 
+# 异步落盘：文件名 -> 尚未写完的 WAV 字节
+pending_audio = {}
+pending_lock = threading.Lock()
+persist_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tts_persist")
+
 # 确保输出目录存在
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
@@ -54,6 +92,14 @@ print("TTS API 配置:")
 print(f"  GPU 加速: {'✅ 启用' if USE_GPU else '❌ 禁用'}")
 if USE_GPU:
     print(f"  半精度: {'✅ 启用' if USE_HALF_PRECISION else '❌ 禁用'}")
+print(f"  GPT 连续批处理: {T2S_BATCH_SIZE if T2S_BATCH_SIZE > 0 else '❌ 禁用'}")
+print(f"  批量接口每批文本数: {BATCH_CHUNK_SIZE}")
+print(f"  分桶 token 上限: {BATCH_TOKEN_BUDGET if BATCH_TOKEN_BUDGET > 0 else '不限'}")
+print(f"  音色常驻内存上限: {VOICE_MEMORY_MB} MB")
+print(f"  启动时加载并预热: {'✅ 启用' if EAGER_INIT else '❌ 禁用（第一个请求时加载）'}{'' if WARMUP or not EAGER_INIT else '（不预热）'}")
+print(f"  GPT 解码编译: {'✅ 启用' if COMPILE_T2S else '❌ 禁用'}")
+print(f"  语速调节: {'合成后变速 (WSOLA)' if TIME_STRETCH else 'SoVITS 按语速解码'}")
+print(f"  ONNX Runtime 后端: {ONNX_DIR if ONNX_DIR else '❌ 禁用'}")
 print("=" * 70)
 
 
@@ -61,12 +107,104 @@ def get_tts():
     """获取或初始化 TTS 实例（单例模式）"""
     global tts_instance
     if tts_instance is None:
-        print("🎤 初始化 TTS 模型...")
-        tts_instance = ZhuangFangyiTTS()
-        print("✅ TTS 模型加载完成")
+        # 并发的首个请求只初始化一次模型
+        with tts_lock:
+            if tts_instance is None:
+                print("🎤 初始化 TTS 模型...")
+                tts_instance = ZhuangFangyiTTS(
+                    t2s_batch_size=T2S_BATCH_SIZE,
+                    voice_memory_mb=VOICE_MEMORY_MB,
+                    voices_file=VOICES_FILE,
+                    onnx_dir=ONNX_DIR,
+                    compile_t2s=COMPILE_T2S,
+                    time_stretch=TIME_STRETCH,
+                    batch_token_budget=BATCH_TOKEN_BUDGET
+                )
+                print("✅ TTS 模型加载完成")
     return tts_instance
 
 
+def initialize():
+    """启动时在后台加载模型并预热（EAGER_INIT），结束后才算就绪"""
+    global ready_at
+    try:
+        startup_state["state"] = "loading"
+        tts = get_tts()
+        if WARMUP:
+            startup_state["state"] = "warming_up"
+            startup_state["warmup"] = [
+                {"text": text, "seconds": round(seconds, 3)} for text, seconds in tts.warmup()
+            ]
+        ready_at = time.time()
+        startup_state["state"] = "ready"
+        print(f"✅ 服务就绪，启动耗时 {ready_at - started_at:.1f}s")
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        startup_state["error"] = str(e)
+        startup_state["state"] = "failed"
+
+
+def is_ready():
+    """就绪 = 可以立即处理请求；未开启 EAGER_INIT 时模型按需加载，始终视为就绪"""
+    return not EAGER_INIT or startup_state["state"] == "ready"
+
+
+def check_voice(tts, voice):
+    """音色不存在时返回错误信息"""
+    try:
+        tts.voices.get_voice(voice)
+    except KeyError:
+        return f'未知音色: {voice}'
+    return None
+
+
+def check_profile(tts, profile):
+    """CFM 采样档位不存在时返回错误信息"""
+    if profile is not None and profile not in tts.list_profiles():
+        return f'未知 profile: {profile}，可选: {", ".join(tts.list_profiles())}'
+    return None
+
+
+def encode_wav(audio, sample_rate):
+    """把 int16 单声道音频编码为内存中的 WAV 字节"""
+    wav_buf = BytesIO()
+    with wave.open(wav_buf, "wb") as vfout:
+        vfout.setnchannels(1)
+        vfout.setsampwidth(2)
+        vfout.setframerate(sample_rate)
+        vfout.writeframes(audio.tobytes())
+    return wav_buf.getvalue()
+
+
+def persist_audio_async(filename, wav_bytes):
+    """
+    后台写入 outputs/，不阻塞请求
+    写完之前 /api/tts/audio/<filename> 直接从内存返回
+    """
+    output_path = os.path.join(OUTPUT_DIR, filename)
+    with pending_lock:
+        pending_audio[filename] = wav_bytes
+    
+    def write():
+        # 先写临时文件再改名，避免读到写了一半的文件
+        tmp_path = f"{output_path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(wav_bytes)
+            os.replace(tmp_path, output_path)
+        except Exception as e:
+            print(f"❌ 音频保存失败: {filename}: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        finally:
+            with pending_lock:
+                pending_audio.pop(filename, None)
+    
+    persist_executor.submit(write)
+    return output_path
+
+
 @app.route('/api/tts/generate', methods=['POST'])
 def generate_speech():
     """
@@ -81,10 +219,14 @@ def generate_speech():
         "temperature": 1.0,     // 可选，GPT采样参数
         "reference_audio": "",  // 可选，自定义参考音频路径
         "reference_text": "",   // 可选，自定义参考文本
-        "filename": ""          // 可选，自定义输出文件名
+        "voice": "",            // 可选，音色名（默认庄方宜）
+        "profile": "",          // 可选，CFM 采样档位 fast / balanced / quality / adaptive（仅 v3/v4 音色）
+        "filename": "",         // 可选，自定义输出文件名
+        "response_format": "url", // 可选，url / base64 / wav
+        "save": true            // 可选，是否保存到 outputs/（base64 / wav 默认不保存）
     }
     
-    Response (JSON):
+    Response (response_format=url，默认):
     {
         "success": true,
         "data": {
@@ -93,9 +235,13 @@ def generate_speech():
             "audio_url": "/api/tts/audio/xxx.wav",
             "text": "原始文本",
             "duration": 3.5,
+            "sample_rate": 32000,
             "generated_at": "2026-02-12T19:30:00"
         }
     }
+    
+    response_format=base64: data 中额外包含 "audio_base64"（WAV 文件内容），未保存时没有路径字段
+    response_format=wav: 直接返回 audio/wav，时长等信息在 X-Duration / X-Sample-Rate 等响应头中
     """
     try:
         # 解析请求数据
@@ -123,6 +269,9 @@ def generate_speech():
         reference_audio = data.get('reference_audio')
         reference_text = data.get('reference_text')
         custom_filename = data.get('filename')
+        response_format = data.get('response_format', 'url')
+        voice = data.get('voice') or None
+        profile = data.get('profile') or None
         
         # 参数验证
         if not (0.5 <= speed <= 2.0):
@@ -131,65 +280,95 @@ def generate_speech():
                 'error': 'speed 参数必须在 0.5 到 2.0 之间'
             }), 400
         
-        # 生成输出文件名
-        if custom_filename:
-            filename = secure_filename(custom_filename)
-            if not filename.endswith('.wav'):
-                filename += '.wav'
-        else:
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
-            unique_id = str(uuid.uuid4())[:8]
-            filename = f"tts_{timestamp}_{unique_id}.wav"
+        if response_format not in ('url', 'base64', 'wav'):
+            return jsonify({
+                'success': False,
+                'error': 'response_format 参数必须是 url、base64 或 wav'
+            }), 400
         
-        output_path = os.path.join(OUTPUT_DIR, filename)
+        # url 模式必须落盘，其余模式按需保存
+        save = response_format == 'url' or bool(data.get('save', False))
         
         print(f"📝 TTS 请求: {text[:50]}{'...' if len(text) > 50 else ''}")
         
         # 获取 TTS 实例并生成音频
         tts = get_tts()
+        voice_error = check_voice(tts, voice)
+        if voice_error:
+            return jsonify({
+                'success': False,
+                'error': voice_error
+            }), 400
+        profile_error = check_profile(tts, profile)
+        if profile_error:
+            return jsonify({
+                'success': False,
+                'error': profile_error
+            }), 400
         start_time = time.time()
         
-        result_path = tts.generate(
+        sample_rate, audio_data = tts.synthesize(
             text=text,
-            output_path=output_path,
             reference_audio=reference_audio,
             reference_text=reference_text,
             top_k=top_k,
             top_p=top_p,
             temperature=temperature,
-            speed=speed
+            speed=speed,
+            voice=voice,
+            profile=profile
         )
         
         generation_time = time.time() - start_time
+        duration = len(audio_data) / sample_rate
+        wav_bytes = encode_wav(audio_data, sample_rate)
+        
+        filename = None
+        output_path = None
+        if save:
+            # 生成输出文件名
+            if custom_filename:
+                filename = secure_filename(custom_filename)
+                if not filename.endswith('.wav'):
+                    filename += '.wav'
+            else:
+                timestamp = time.strftime("%Y%m%d_%H%M%S")
+                unique_id = str(uuid.uuid4())[:8]
+                filename = f"tts_{timestamp}_{unique_id}.wav"
+            output_path = persist_audio_async(filename, wav_bytes)
         
-        if result_path and os.path.exists(result_path):
-            # 获取音频时长
-            try:
-                import soundfile as sf
-                audio_data, sample_rate = sf.read(result_path)
-                duration = len(audio_data) / sample_rate
-            except Exception:
-                duration = None
-            
-            print(f"✅ 生成成功: {filename} (耗时: {generation_time:.2f}s)")
-            
-            return jsonify({
-                'success': True,
-                'data': {
-                    'audio_path': result_path,
-                    'filename': filename,
-                    'audio_url': f'/api/tts/audio/{filename}',
-                    'text': text,
-                    'duration': duration,
-                    'generation_time': round(generation_time, 2),
-                    'generated_at': time.strftime("%Y-%m-%dT%H:%M:%S")
-                }
+        print(f"✅ 生成成功: {filename or '(未保存)'} (耗时: {generation_time:.2f}s)")
+        
+        if response_format == 'wav':
+            headers = {
+                'X-Duration': f'{duration:.3f}',
+                'X-Sample-Rate': str(sample_rate),
+                'X-Generation-Time': f'{generation_time:.2f}'
+            }
+            if filename:
+                headers['X-Filename'] = filename
+            return Response(wav_bytes, mimetype='audio/wav', headers=headers)
+        
+        result = {
+            'text': text,
+            'duration': duration,
+            'sample_rate': sample_rate,
+            'generation_time': round(generation_time, 2),
+            'generated_at': time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+        if filename:
+            result.update({
+                'audio_path': output_path,
+                'filename': filename,
+                'audio_url': f'/api/tts/audio/{filename}'
             })
-        else:
-            return jsonify({
-                'success': False,
-                'error': '音频生成失败'
-            }), 500
+        if response_format == 'base64':
+            result['audio_base64'] = base64.b64encode(wav_bytes).decode('ascii')
+        
+        return jsonify({
+            'success': True,
+            'data': result
+        })
         
     except Exception as e:
         print(f"❌ 错误: {str(e)}")
@@ -202,6 +381,136 @@ def generate_speech():
         }), 500
 
 
+def wave_header_chunk(sample_rate, channels=1, sample_width=2):
+    """生成数据长度为 0 的 WAV 头，后面直接追加 PCM 数据即可边收边播"""
+    wav_buf = BytesIO()
+    with wave.open(wav_buf, "wb") as vfout:
+        vfout.setnchannels(channels)
+        vfout.setsampwidth(sample_width)
+        vfout.setframerate(sample_rate)
+        vfout.writeframes(b"")
+    return wav_buf.getvalue()
+
+
+@app.route('/api/tts/stream', methods=['POST'])
+def stream_speech():
+    """
+    流式生成语音 API（不落盘，边合成边返回）
+    
+    Request Body (JSON):
+    {
+        "text": "要合成的文本",
+        "format": "wav",        // 可选，wav（WAV 头 + PCM 分块）或 pcm（裸 16bit 单声道 PCM）
+        "speed": 1.0,           // 可选，语速 (0.5-2.0)
+        "top_k": 15,            // 可选，GPT采样参数
+        "top_p": 1.0,           // 可选，GPT采样参数
+        "temperature": 1.0,     // 可选，GPT采样参数
+        "reference_audio": "",  // 可选，自定义参考音频路径
+        "reference_text": "",   // 可选，自定义参考文本
+        "voice": "",            // 可选，音色名（默认庄方宜）
+        "profile": "",          // 可选，CFM 采样档位 fast / balanced / quality / adaptive（仅 v3/v4 音色）
+        "streaming_mode": false // 可选，true 时按语义 token 分块返回（首包更快，音质略降）
+    }
+    
+    Response: audio/wav 或 audio/pcm 分块传输，采样率见响应头 X-Sample-Rate
+    """
+    data = request.json
+    
+    if not data or 'text' not in data:
+        return jsonify({
+            'success': False,
+            'error': '缺少必需参数: text'
+        }), 400
+    
+    text = data['text'].strip()
+    
+    if not text:
+        return jsonify({
+            'success': False,
+            'error': '文本不能为空'
+        }), 400
+    
+    media_format = data.get('format', 'wav')
+    if media_format not in ('wav', 'pcm'):
+        return jsonify({
+            'success': False,
+            'error': 'format 参数必须是 wav 或 pcm'
+        }), 400
+    
+    speed = float(data.get('speed', 1.0))
+    if not (0.5 <= speed <= 2.0):
+        return jsonify({
+            'success': False,
+            'error': 'speed 参数必须在 0.5 到 2.0 之间'
+        }), 400
+    
+    print(f"📝 TTS 流式请求: {text[:50]}{'...' if len(text) > 50 else ''}")
+    
+    tts = get_tts()
+    voice = data.get('voice') or None
+    voice_error = check_voice(tts, voice)
+    if voice_error:
+        return jsonify({
+            'success': False,
+            'error': voice_error
+        }), 400
+    profile = data.get('profile') or None
+    profile_error = check_profile(tts, profile)
+    if profile_error:
+        return jsonify({
+            'success': False,
+            'error': profile_error
+        }), 400
+    chunks = tts.generate_stream(
+        text=text,
+        reference_audio=data.get('reference_audio'),
+        reference_text=data.get('reference_text'),
+        top_k=int(data.get('top_k', 15)),
+        top_p=float(data.get('top_p', 1.0)),
+        temperature=float(data.get('temperature', 1.0)),
+        speed=speed,
+        streaming_mode=bool(data.get('streaming_mode', False)),
+        voice=voice,
+        profile=profile
+    )
+    
+    # 先合成第一段，拿到采样率再发响应头；出错时还能返回 JSON
+    start_time = time.time()
+    try:
+        sample_rate, first_chunk = next(chunks)
+    except StopIteration:
+        return jsonify({
+            'success': False,
+            'error': '音频生成失败'
+        }), 500
+    except Exception as e:
+        print(f"❌ 错误: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+    print(f"⚡ 首段音频: {time.time() - start_time:.2f}s")
+    
+    def generate():
+        if media_format == 'wav':
+            yield wave_header_chunk(sample_rate)
+        yield first_chunk.tobytes()
+        try:
+            for _, chunk in chunks:
+                yield chunk.tobytes()
+        except Exception as e:
+            # 响应头已发出，只能中断连接
+            print(f"❌ 流式合成中断: {str(e)}")
+            raise
+        print(f"✅ 流式合成完成 (耗时: {time.time() - start_time:.2f}s)")
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='audio/wav' if media_format == 'wav' else 'audio/pcm',
+        headers={'X-Sample-Rate': str(sample_rate)}
+    )
+
+
 @app.route('/api/tts/audio/<filename>', methods=['GET'])
 def get_audio(filename):
     """
@@ -216,6 +525,17 @@ def get_audio(filename):
         filename = secure_filename(filename)
         file_path = os.path.join(OUTPUT_DIR, filename)
         
+        # 还在后台写入的文件直接从内存返回
+        with pending_lock:
+            wav_bytes = pending_audio.get(filename)
+        if wav_bytes is not None:
+            return send_file(
+                BytesIO(wav_bytes),
+                mimetype='audio/wav',
+                as_attachment=False,
+                download_name=filename
+            )
+        
         if not os.path.exists(file_path):
             return jsonify({
                 'success': False,
@@ -247,7 +567,9 @@ def batch_generate():
         "speed": 1.0,
         "top_k": 15,
         "top_p": 1.0,
-        "temperature": 1.0
+        "temperature": 1.0,
+        "voice": "",            // 可选，音色名（默认庄方宜）
+        "profile": ""           // 可选，CFM 采样档位（仅 v3/v4 音色）
     }
     
     Response (JSON):
@@ -293,70 +615,83 @@ def batch_generate():
         top_k = int(data.get('top_k', 15))
         top_p = float(data.get('top_p', 1.0))
         temperature = float(data.get('temperature', 1.0))
+        voice = data.get('voice') or None
+        profile = data.get('profile') or None
         
         print(f"📦 批量生成请求: {len(texts)} 条文本")
         
         # 获取 TTS 实例
         tts = get_tts()
+        voice_error = check_voice(tts, voice)
+        if voice_error:
+            return jsonify({
+                'success': False,
+                'error': voice_error
+            }), 400
+        profile_error = check_profile(tts, profile)
+        if profile_error:
+            return jsonify({
+                'success': False,
+                'error': profile_error
+            }), 400
         
-        results = []
+        results = [None] * len(texts)
         succeeded = 0
         failed = 0
         
+        pending = []  # (index, text)
         for idx, text in enumerate(texts):
             text = text.strip()
-            
             if not text:
-                results.append({
+                results[idx] = {
                     'index': idx,
                     'text': text,
                     'success': False,
                     'error': '文本为空'
-                })
+                }
                 failed += 1
                 continue
-            
+            pending.append((idx, text))
+        
+        # 每批文本共用一次参考音频处理，分句后一起分桶做 GPT/SoVITS 批量推理
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        for start in range(0, len(pending), BATCH_CHUNK_SIZE):
+            chunk = pending[start:start + BATCH_CHUNK_SIZE]
             try:
-                timestamp = time.strftime("%Y%m%d_%H%M%S")
-                filename = f"batch_{timestamp}_{idx:03d}.wav"
-                output_path = os.path.join(OUTPUT_DIR, filename)
-                
-                result_path = tts.generate(
-                    text=text,
-                    output_path=output_path,
+                audios = tts.synthesize_batch(
+                    [text for _, text in chunk],
                     top_k=top_k,
                     top_p=top_p,
                     temperature=temperature,
-                    speed=speed
+                    speed=speed,
+                    voice=voice,
+                    profile=profile
                 )
-                
-                if result_path and os.path.exists(result_path):
-                    results.append({
-                        'index': idx,
-                        'text': text,
-                        'success': True,
-                        'audio_path': result_path,
-                        'filename': filename,
-                        'audio_url': f'/api/tts/audio/{filename}'
-                    })
-                    succeeded += 1
-                else:
-                    results.append({
+            except Exception as e:
+                # 一批失败只影响这一批
+                for idx, text in chunk:
+                    results[idx] = {
                         'index': idx,
                         'text': text,
                         'success': False,
-                        'error': '生成失败'
-                    })
-                    failed += 1
-                    
-            except Exception as e:
-                results.append({
+                        'error': str(e)
+                    }
+                failed += len(chunk)
+                continue
+            
+            for (idx, text), (sample_rate, audio_data) in zip(chunk, audios):
+                filename = f"batch_{timestamp}_{idx:03d}.wav"
+                result_path = persist_audio_async(filename, encode_wav(audio_data, sample_rate))
+                results[idx] = {
                     'index': idx,
                     'text': text,
-                    'success': False,
-                    'error': str(e)
-                })
-                failed += 1
+                    'success': True,
+                    'audio_path': result_path,
+                    'filename': filename,
+                    'audio_url': f'/api/tts/audio/{filename}',
+                    'duration': len(audio_data) / sample_rate
+                }
+                succeeded += 1
         
         print(f"✅ 批量生成完成: 成功 {succeeded}, 失败 {failed}")
         
@@ -451,23 +786,60 @@ def list_files():
 @app.route('/api/tts/health', methods=['GET'])
 def health_check():
     """
-    健康检查端点
+    健康检查端点（存活检查，进程能响应即返回 200；是否就绪见 ready 字段）
     
     Response (JSON):
     {
         "status": "healthy",
+        "ready": true,
+        "state": "ready",
         "model_loaded": true,
         "output_dir": "outputs"
     }
     """
     return jsonify({
         'status': 'healthy',
+        'ready': is_ready(),
+        'state': startup_state['state'] if EAGER_INIT else 'lazy',
         'model_loaded': tts_instance is not None,
         'output_dir': OUTPUT_DIR,
         'version': 'v2Pro'
     })
 
 
+@app.route('/api/tts/health/live', methods=['GET'])
+def liveness_check():
+    """存活检查：进程在运行、能响应请求即返回 200，不管模型是否加载完"""
+    return jsonify({
+        'status': 'alive',
+        'uptime': round(time.time() - started_at, 1)
+    })
+
+
+@app.route('/api/tts/health/ready', methods=['GET'])
+def readiness_check():
+    """
+    就绪检查：模型已加载并预热完成时返回 200，否则返回 503
+    
+    Response (JSON):
+    {
+        "ready": false,
+        "state": "warming_up",     // starting / loading / warming_up / ready / failed / lazy
+        "error": null,
+        "startup_seconds": null,   // 就绪时为启动耗时
+        "warmup": [{"text": "你好。", "seconds": 1.2}, ...]
+    }
+    """
+    ready = is_ready()
+    return jsonify({
+        'ready': ready,
+        'state': startup_state['state'] if EAGER_INIT else 'lazy',
+        'error': startup_state['error'],
+        'startup_seconds': round(ready_at - started_at, 1) if ready_at else None,
+        'warmup': startup_state['warmup']
+    }), 200 if ready else 503
+
+
 @app.route('/api/tts/info', methods=['GET'])
 def get_info():
     """
@@ -481,7 +853,13 @@ def get_info():
             "gpt_model": "GPT_weights_v2/ZhuangFangyi_V1-e16.ckpt",
             "sovits_model": "SoVITS_weights_v2/ZhuangFangyi_V1_e20_s300.pth",
             "reference_audio": "logs/ZhuangFangyi_V1/reference_audio/...",
-            "reference_text": "不用太拘谨，像从前一样，随意称呼就好"
+            "reference_text": "不用太拘谨，像从前一样，随意称呼就好",
+            "t2s_scheduler": {"active": 0, "queued": 0, ...},
+            "frontend_cache": {"size": 12, "hits": 30, "misses": 12, "bert_hits": 25, ...},
+            "segment_cost": {"tokens_per_phone": {"han": 2.4}, "observed_segments": {"han": 57}, ...},
+            "cfm_profiles": {"fast": {"sample_steps": 8, "cfm_solver": "euler", "sway_coef": -1.0}, ...},
+            "voices": [{"name": "ZhuangFangyi", "gpt_model": "...", "resident": true, ...}, ...],
+            "voice_registry": {"memory_budget_mb": 4096, "resident_mb": 240.5, "resident": [...], ...}
         }
     }
     """
@@ -495,7 +873,13 @@ def get_info():
                 'gpt_model': tts.gpt_model_path,
                 'sovits_model': tts.sovits_model_path,
                 'reference_audio': tts.reference_audio,
-                'reference_text': tts.reference_text
+                'reference_text': tts.reference_text,
+                't2s_scheduler': tts.t2s_scheduler.stats() if tts.t2s_scheduler else None,
+                'frontend_cache': tts.tts.text_preprocessor.frontend_cache.stats(),
+                'segment_cost': tts.tts.segment_cost.stats(),
+                'cfm_profiles': tts.list_profiles(),
+                'voices': tts.voices.list_voices(),
+                'voice_registry': tts.voices.stats()
             }
         })
         
@@ -540,16 +924,24 @@ def main():
     print(f"📡 服务地址: http://{args.host}:{args.port}")
     print(f"📖 API 文档:")
     print(f"   - POST   /api/tts/generate      - 生成单个语音")
+    print(f"   - POST   /api/tts/stream        - 流式生成语音")
     print(f"   - POST   /api/tts/batch         - 批量生成语音")
     print(f"   - GET    /api/tts/audio/<file>  - 获取音频文件")
     print(f"   - GET    /api/tts/files         - 列出所有文件")
     print(f"   - GET    /api/tts/health        - 健康检查")
+    print(f"   - GET    /api/tts/health/live   - 存活检查")
+    print(f"   - GET    /api/tts/health/ready  - 就绪检查（加载和预热完成前返回 503）")
     print(f"   - GET    /api/tts/info          - 系统信息")
     print("=" * 70)
     print("按 Ctrl+C 停止服务器")
     print("=" * 70)
     print()
     
+    # debug 模式下 reloader 的监视进程不加载模型
+    if EAGER_INIT and (not args.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true"):
+        # 后台加载和预热，HTTP 服务先起来响应存活检查
+        threading.Thread(target=initialize, name="tts_init", daemon=True).start()
+    
     app.run(
         host=args.host,
         port=args.port,